@@ -0,0 +1,113 @@
+"""
+Extracted audio shared by all pipeline stages
+
+The audio track of an upload is decoded once, on first use, to 16 kHz mono
+float32 samples (the input format of Whisper and Pyannote) stored as a raw
+array file next to the upload. Stages get a read-only memory map of it, so
+transcription workers and diarization read the same pages from the page
+cache without decoding or copying the audio again. The file is removed with
+the upload.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+
+import numpy as np
+
+import profiling
+from shared_state import FileLock, Pending
+
+SAMPLE_RATE = 16000
+SUFFIX = 'pcm16k.f32'
+
+
+class AudioCache:
+    """Lazily extracted, memory-mapped 16 kHz mono audio per upload"""
+
+    def __init__(self, store):
+        self.store = store
+        self.extractions = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def path(self, sha256):
+        return self.store.derived_path(sha256, SUFFIX)
+
+    def get(self, sha256):
+        """Samples of an upload as a read-only float32 memmap, extracting them if needed"""
+        while True:
+            record = self.store.get(sha256)
+            if record is None:
+                raise KeyError(sha256)
+            path = self.path(sha256)
+            with self._lock:
+                if self._is_current(path, record):
+                    self.hits += 1
+                    return open_samples(path)
+                pending = self._pending.get(sha256)
+                leader = pending is None
+                if leader:
+                    pending = self._pending[sha256] = Pending()
+            if leader:
+                try:
+                    # Another server process may be extracting the same upload
+                    with FileLock(f"{path}.lock"):
+                        if not self._is_current(path, record):
+                            self._extract(self.store.blob_path(record), path)
+                except Exception as e:
+                    pending.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._pending[sha256]
+                    pending.done.set()
+            else:
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+
+    def _is_current(self, path, record):
+        try:
+            return os.stat(path).st_mtime >= os.stat(self.store.blob_path(record)).st_mtime
+        except FileNotFoundError:
+            return False
+
+    def _extract(self, source_path, path):
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg is required to extract audio")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with profiling.span('ffmpeg_extract_audio'):
+                subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y', '-i', source_path,
+                                '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 'f32le', tmp_path],
+                               check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise ValueError(f"Could not decode audio: {e.stderr.decode(errors='replace').strip()[-300:]}")
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.extractions += 1
+        print(f"🔊 Extracted audio: {os.path.basename(path)}")
+
+    def invalidate(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {"extractions": self.extractions, "hits": self.hits}
+
+
+def open_samples(path):
+    """Read-only float32 view of an extracted audio file"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype='<f4', mode='r')
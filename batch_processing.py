@@ -0,0 +1,180 @@
+"""
+Batch clip processing on a process pool
+
+``/api/process_batch`` exports many clips of one source video as a single job.
+With ffmpeg available the whole batch is cut in one pass over the source (see
+``trim_engine``). Otherwise, or if that pass fails, each clip is cut (and
+optionally resized) in a worker process, so a batch uses every core instead of
+running one ffmpeg after another. Resized clips are cropped along the source's
+stored crop track (see ``crop_tracks``). When the batch is done the outputs are
+also bundled into one zip archive for download.
+"""
+
+import os
+import shutil
+import subprocess
+import time
+import zipfile
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import crop_tracks
+import trim_engine
+from job_queue import JobCancelled
+from process_pool import ProcessPool
+from trim_engine import center_crop_filter
+
+OPERATIONS = ('trim', 'trim_and_resize')
+
+# Sized to the available cores unless CLIPSAI_PROCESS_WORKERS is set
+_pool = ProcessPool(lambda: int(os.environ.get('CLIPSAI_PROCESS_WORKERS', '0')) or os.cpu_count() or 1)
+
+
+def process_clip(source_path, output_path, start, end, operation, aspect_ratio, video_filter=None):
+    """Cut one clip; runs in a worker process. Returns the output size, or None if simulated."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None or source_path is None:
+        # No ffmpeg in this environment: simulate the work like /api/process
+        time.sleep(4 if operation == 'trim_and_resize' else 2)
+        return None
+
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+           '-ss', f"{start:.3f}", '-to', f"{end:.3f}", '-i', source_path]
+    if operation == 'trim_and_resize':
+        cmd += ['-vf', video_filter or center_crop_filter(aspect_ratio),
+                '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'copy']
+    else:
+        cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    cmd.append(output_path)
+    subprocess.run(cmd, check=True, capture_output=True)
+    return os.path.getsize(output_path)
+
+
+def resolve_clips(items, known_clips):
+    """Fill in start/end for items given only by ``clip_id`` and validate them"""
+    by_id = {clip['id']: clip for clip in known_clips}
+    clips = []
+    for item in items:
+        clip_id = item.get('clip_id', item.get('id'))
+        clip = dict(by_id.get(clip_id, {}), **item)
+        start, end = float(clip.get('start', -1)), float(clip.get('end', -1))
+        if start < 0 or end <= start:
+            raise ValueError(f"Clip {clip_id} needs a valid start and end")
+        clips.append({"clip_id": clip_id, "start": start, "end": end,
+                      "operation": clip.get('operation'), "aspect_ratio": clip.get('aspect_ratio')})
+    return clips
+
+
+def cut_in_one_pass(job, source_path, output_dir, tasks, info=None):
+    """Cut all clips with the single-pass engine; returns ``{index: outcome}``"""
+    clips = [{"start": clip['start'], "end": clip['end'], "aspect_ratio": aspect, "video_filter": video_filter,
+              "output_path": os.path.join(output_dir, output_file)}
+             for _, clip, clip_operation, output_file, aspect, video_filter in tasks]
+    results = trim_engine.cut_clips(source_path, clips, output_dir,
+                                    progress=lambda fraction: job.update(fraction * 0.95), info=info)
+    outcomes = {}
+    for (index, _, _, output_file, _, _), result in zip(tasks, results):
+        if 'error' in result:
+            outcomes[index] = {"success": False, "error": result['error']}
+        else:
+            outcomes[index] = {"success": True, "output_file": output_file, "size": result['size'],
+                               "cut": result['mode']}
+    return outcomes
+
+
+def cut_on_pool(job, source_path, output_dir, tasks):
+    """Cut each clip separately on the process pool; returns ``{index: outcome}``"""
+    outcomes = {}
+    with _pool.use() as pool:
+        futures = {}
+        for index, clip, clip_operation, output_file, aspect, video_filter in tasks:
+            future = pool.submit(process_clip, source_path, os.path.join(output_dir, output_file),
+                                 clip['start'], clip['end'], clip_operation, aspect, video_filter)
+            futures[future] = (index, output_file)
+
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                index, output_file = futures[future]
+                try:
+                    outcomes[index] = {"success": True, "output_file": output_file, "size": future.result()}
+                except BrokenProcessPool as e:
+                    _pool.reset()
+                    outcomes[index] = {"success": False, "error": str(e)}
+                except Exception as e:
+                    outcomes[index] = {"success": False, "error": str(e)}
+                job.update(done / len(tasks) * 0.95, message=f"{done}/{len(tasks)} clips")
+        finally:
+            for future in futures:
+                future.cancel()
+    return outcomes
+
+
+def run_batch(job, store, tracks, video_index, output_dir, file_id, clips, operation, aspect_ratio):
+    """Job function: process all clips and bundle the outputs"""
+    record = store.get(file_id)
+    source_path = store.blob_path(record) if record else None
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = []
+    for index, clip in enumerate(clips):
+        clip_operation = clip['operation'] or operation
+        if clip_operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {clip_operation}")
+        aspect = (clip['aspect_ratio'] or aspect_ratio) if clip_operation == 'trim_and_resize' else None
+        video_filter = None
+        if aspect and source_path and trim_engine.ffmpeg_binary():
+            # Computed on the first resize of this source and aspect ratio, then reused
+            job.update(0.0, 'tracking')
+            video_filter = crop_tracks.crop_filter(tracks.track(file_id, aspect), clip['start'], clip['end'])
+        tasks.append((index, clip, clip_operation, f"clip_{clip['clip_id']}_{job.id[:8]}_{index}.mp4",
+                      aspect, video_filter))
+
+    job.update(0.0, 'processing', f"{len(clips)} clips")
+    outcomes = None
+    if source_path and trim_engine.ffmpeg_binary():
+        try:
+            outcomes = cut_in_one_pass(job, source_path, output_dir, tasks, video_index.probe(file_id))
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"⚠️  Single-pass cut failed, cutting clips separately: {e}")
+    if outcomes is None:
+        outcomes = cut_on_pool(job, source_path, output_dir, tasks)
+
+    results = []
+    for index, clip, clip_operation, output_file, _, _ in tasks:
+        result = {
+            "clip_id": clip['clip_id'],
+            "operation": clip_operation,
+            "start": clip['start'],
+            "end": clip['end'],
+            "duration": round(clip['end'] - clip['start'], 3),
+        }
+        result.update(outcomes[index])
+        if result['success']:
+            if result.get('size') is not None:
+                result['url'] = f"/uploads/processed/{output_file}"
+            store.append_artifact(file_id, "processed", result)
+        results.append(result)
+
+    job.update(0.95, 'archiving')
+    archive_url = None
+    outputs = [r for r in results if r.get('url')]
+    if outputs:
+        archive_name = f"clips_{job.id[:8]}.zip"
+        with zipfile.ZipFile(os.path.join(output_dir, archive_name), 'w', zipfile.ZIP_STORED) as archive:
+            for r in outputs:
+                # Video is already compressed; store it as is
+                archive.write(os.path.join(output_dir, r['output_file']), r['output_file'])
+        archive_url = f"/uploads/processed/{archive_name}"
+
+    succeeded = sum(1 for r in results if r['success'])
+    return {
+        "success": succeeded == len(results),
+        "file_id": file_id,
+        "clips": results,
+        "total_clips": len(results),
+        "succeeded": succeeded,
+        "archive_url": archive_url,
+        "message": f"Processed {succeeded} of {len(results)} clips"
+    }
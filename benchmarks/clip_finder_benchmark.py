@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Clip finder benchmark: TextTiling cost vs. transcript length
+
+Builds synthetic transcripts (topics with their own vocabulary) of increasing
+length and reports, per length, the time to embed the sentences (hashing
+embedder), to compute the similarity and depth scores, and to select clips for
+a few duration ranges (what a slider change costs):
+
+    python benchmarks/clip_finder_benchmark.py --hours 0.5,1,3,6
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clip_finder  # noqa: E402
+
+RANGES = [(15, 60), (30, 120), (60, 600)]
+
+
+def synthetic_words(hours, seed):
+    rng = random.Random(seed)
+    filler = "the a and we so this is it that you".split()
+    words, now, topic = [], 0.0, 0
+    while now < hours * 3600:
+        vocabulary = [f"topic{topic}word{i}" for i in range(40)]
+        for _ in range(rng.randint(4, 12)):
+            length = rng.randint(6, 18)
+            for j in range(length):
+                word = rng.choice(vocabulary) if rng.random() < 0.6 else rng.choice(filler)
+                words.append({"word": word + ('.' if j == length - 1 else ''),
+                              "start": now, "end": now + 0.3, "score": 0.9})
+                now += 0.4
+        topic += 1
+    return words
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hours", default="0.5,1,3,6", help="comma separated transcript lengths")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    embedder = clip_finder.HashingEmbedder()
+    print(f"{'hours':>6} {'words':>8} {'sentences':>10} {'embed s':>8} {'depth s':>8} {'select ms':>10}")
+    for hours in [float(h) for h in args.hours.split(",")]:
+        words = synthetic_words(hours, args.seed)
+        texts, starts, ends = clip_finder.split_sentences(words)
+        embeddings, embed_time = timed(lambda: embedder.embed(texts))
+        analysis, depth_time = timed(lambda: clip_finder.TranscriptAnalysis(texts, starts, ends, embeddings))
+        select_times = [timed(lambda: analysis.select(low, high))[1] for low, high in RANGES]
+        print(f"{hours:>6g} {len(words):>8} {len(texts):>10} {embed_time:>8.3f} {depth_time:>8.3f} "
+              f"{max(select_times) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark for the ClipsAI web server
+
+Starts the server in-process on a free port and measures:
+  * throughput of cheap requests (status checks, main page) as the number of
+    concurrent clients grows
+  * /api/status latency while long pipeline calls are in flight
+
+Run it once with ``--workers 1`` to see the old single-threaded behaviour:
+
+    python benchmarks/concurrency_benchmark.py --workers 1
+    python benchmarks/concurrency_benchmark.py --workers 32
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import enhanced_web_server  # noqa: E402
+
+
+def quiet_log(self, format, *args):
+    pass
+
+
+def fetch(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        start = time.perf_counter()
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        conn.getresponse().read()
+        return time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def run_throughput(port, clients, requests_per_client, paths):
+    """Fire ``clients * requests_per_client`` GETs and return requests per second"""
+    def client(idx):
+        for i in range(requests_per_client):
+            fetch(port, "GET", paths[(idx + i) % len(paths)])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    return clients * requests_per_client / elapsed
+
+
+def upload_sample(port, work_dir):
+    """Upload a short video (synthetic bytes without ffmpeg) and return its file_id"""
+    path = os.path.join(work_dir, 'sample.mp4')
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate=25',
+                        '-f', 'lavfi', '-i', 'sine=frequency=300:sample_rate=16000',
+                        '-t', '20', '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', path], check=True)
+    else:
+        with open(path, 'wb') as f:
+            f.write(os.urandom(256 * 1024))
+    with open(path, 'rb') as f:
+        content = f.read()
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"sample.mp4\"\r\n"
+            f"Content-Type: video/mp4\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request("POST", "/api/upload", body=body,
+                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        return json.loads(conn.getresponse().read())['file_id']
+    finally:
+        conn.close()
+
+
+def run_head_of_line(port, slow_calls, probes, file_id):
+    """Measure /api/status latency while ``slow_calls`` transcriptions of ``file_id`` are running"""
+    slow = [threading.Thread(target=fetch, args=(port, "POST", "/api/transcribe", json.dumps(
+                {"file_id": file_id, "model_size": "tiny", "mode": "single"})))
+            for _ in range(slow_calls)]
+    for t in slow:
+        t.start()
+    time.sleep(0.1)
+    latencies = [fetch(port, "GET", "/api/status") for _ in range(probes)]
+    for t in slow:
+        t.join()
+    # Let the jobs finish before the upload directory is removed
+    jobs = enhanced_web_server.ClipsAIHandler.jobs
+    while jobs.queue_depth() or any(jobs.running().values()):
+        time.sleep(0.1)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=enhanced_web_server.DEFAULT_WORKERS)
+    parser.add_argument("--clients", default="1,2,4,8,16,32",
+                        help="comma separated concurrent client counts")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--slow-calls", type=int, default=4)
+    args = parser.parse_args()
+
+    enhanced_web_server.ClipsAIHandler.log_message = quiet_log
+    # Keep benchmark uploads and jobs out of the persistent upload directory
+    upload_dir = None if os.environ.get('CLIPSAI_UPLOAD_DIR') else tempfile.mkdtemp(prefix='concurrency-bench-uploads-')
+    work_dir = tempfile.mkdtemp(prefix='concurrency-bench-')
+    enhanced_web_server.ClipsAIHandler.open_upload_dir(upload_dir)
+    httpd = enhanced_web_server.create_server(0, args.workers, host="127.0.0.1")
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    try:
+        print(f"workers={args.workers}")
+        print(f"{'clients':>8} {'req/s':>10}")
+        for clients in [int(c) for c in args.clients.split(",")]:
+            rps = run_throughput(port, clients, args.requests, ["/api/status", "/"])
+            print(f"{clients:>8} {rps:>10.1f}")
+
+        latencies = run_head_of_line(port, args.slow_calls, 5, upload_sample(port, work_dir))
+        print(f"/api/status during {args.slow_calls} transcriptions: "
+              f"median {statistics.median(latencies) * 1000:.1f} ms, "
+              f"max {max(latencies) * 1000:.1f} ms")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the ClipsAI web server and pipeline
+
+Starts the server in-process on a free port (simulated Whisper backend unless
+``CLIPSAI_WHISPER_BACKEND`` is set) and runs concurrent scenarios:
+  * mixed: status checks, page and asset loads
+  * upload: single-request uploads of distinct synthetic files
+  * range: Range requests for random slices of an uploaded file
+  * pipeline: upload, transcribe and find clips, each job followed to the end
+
+Each scenario reports requests per second and p50/p95/p99 latency. Results can
+be saved as JSON and checked against thresholds (absolute limits per scenario)
+and a baseline run (relative regression); the exit status is 1 if any check
+fails:
+
+    python benchmarks/load_benchmark.py --output results.json
+    python benchmarks/load_benchmark.py --thresholds benchmarks/load_thresholds.json
+    python benchmarks/load_benchmark.py --baseline results.json --tolerance 0.25
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CLIPSAI_WHISPER_BACKEND', 'simulated')
+
+import enhanced_web_server  # noqa: E402
+
+SCENARIOS = ('mixed', 'upload', 'range', 'pipeline')
+# Higher is better for these; lower for the rest
+HIGHER_IS_BETTER = ('rps', 'mb_per_s')
+
+
+def quiet_log(self, format, *args):
+    pass
+
+
+class Client:
+    """One connection per request, like the browser's parallel fetches"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, body=None, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def json(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else None
+        status, payload = self.request(method, path, body, {"Content-Type": "application/json"})
+        return status, json.loads(payload) if payload else {}
+
+    def upload(self, name, content):
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+            f"Content-Type: video/mp4\r\n\r\n".encode(),
+            content,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        status, payload = self.request("POST", "/api/upload", body,
+                                       {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        return status, json.loads(payload) if payload else {}
+
+    def follow_job(self, status, response, timeout=300):
+        """Poll a submitted job until it finishes; returns its final state"""
+        if status != 202:
+            return {"state": "failed", "error": response.get('error')}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            _, job = self.json("GET", response['status_url'])
+            if job.get('state') not in ('queued', 'running'):
+                return job
+            time.sleep(0.05)
+        return {"state": "timeout"}
+
+
+def run_scenario(operations, clients):
+    """Run each operation (a callable returning ``(ok, bytes)``) on ``clients`` threads"""
+    latencies, errors, transferred = [], [0], [0]
+    lock = threading.Lock()
+
+    def run(operation):
+        start = time.perf_counter()
+        try:
+            ok, size = operation()
+        except Exception:
+            ok, size = False, 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            transferred[0] += size
+            if not ok:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(run, operations))
+    return summarize(latencies, errors[0], transferred[0], time.perf_counter() - start)
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, transferred, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(transferred / elapsed / 1e6, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def mixed_operations(client, count, rng):
+    assets = list(enhanced_web_server.ClipsAIHandler.get_static_assets())
+    paths = ['/api/status'] * 6 + assets + ['/api/jobs']
+
+    def operation(path):
+        status, body = client.request("GET", path)
+        return status == 200, len(body)
+
+    return [lambda path=rng.choice(paths): operation(path) for _ in range(count)]
+
+
+def upload_operations(client, count, size):
+    def operation(index):
+        # Distinct content, so every upload is stored rather than deduplicated
+        content = os.urandom(size)
+        status, response = client.upload(f"bench_{index}.mp4", content)
+        return status == 200 and response.get('success'), size
+
+    return [lambda index=index: operation(index) for index in range(count)]
+
+
+def range_operations(client, count, size, slice_size, rng):
+    status, response = client.upload("bench_range.mp4", os.urandom(size))
+    if status != 200:
+        raise RuntimeError(f"Upload for the range scenario failed: {response}")
+    url = response['url']
+
+    def operation(start):
+        end = min(size, start + slice_size) - 1
+        status, body = client.request("GET", url, headers={"Range": f"bytes={start}-{end}"})
+        return status == 206 and len(body) == end - start + 1, len(body)
+
+    return [lambda start=rng.randrange(0, max(1, size - slice_size)): operation(start) for _ in range(count)]
+
+
+def pipeline_sources(count, work_dir):
+    """Distinct short videos (audio included) when ffmpeg exists, else synthetic bytes"""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return [os.urandom(256 * 1024) for _ in range(count)]
+    base = os.path.join(work_dir, 'pipeline.mp4')
+    subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'testsrc2=size=320x180:rate=25',
+                    '-f', 'lavfi', '-i', 'sine=frequency=300:sample_rate=16000',
+                    '-t', '20', '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50', '-pix_fmt', 'yuv420p',
+                    '-c:a', 'aac', base], check=True)
+    sources = []
+    for index in range(count):
+        # Same streams, different metadata: a new upload (and transcription) each time
+        path = os.path.join(work_dir, f"pipeline_{index}.mp4")
+        subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', base, '-c', 'copy',
+                        '-metadata', f"comment=bench-{uuid.uuid4().hex}", path], check=True)
+        with open(path, 'rb') as f:
+            sources.append(f.read())
+    return sources
+
+
+def pipeline_operations(client, sources):
+    def operation(content):
+        status, upload = client.upload("bench_pipeline.mp4", content)
+        if status != 200:
+            return False, 0
+        job = client.follow_job(*client.json("POST", "/api/transcribe", {
+            "file_id": upload['file_id'], "model_size": "tiny", "mode": "single"}))
+        if job.get('state') != 'succeeded':
+            return False, len(content)
+        job = client.follow_job(*client.json("POST", "/api/find_clips", {
+            "file_id": upload['file_id'], "model_size": "tiny", "min_duration": 5, "max_duration": 60}))
+        return job.get('state') == 'succeeded', len(content)
+
+    return [lambda content=content: operation(content) for content in sources]
+
+
+def check(results, thresholds, baseline, tolerance):
+    """Failed checks as human readable lines"""
+    failures = []
+    for name, result in results.items():
+        for key, limit in (thresholds.get(name) or {}).items():
+            metric = key[4:]
+            if key.startswith('min_') and result[metric] < limit:
+                failures.append(f"{name}: {metric} {result[metric]} < {limit}")
+            elif key.startswith('max_') and result[metric] > limit:
+                failures.append(f"{name}: {metric} {result[metric]} > {limit}")
+        previous = (baseline or {}).get(name)
+        if not previous:
+            continue
+        for metric in ('rps', 'p95_ms', 'p99_ms'):
+            before, now = previous.get(metric), result[metric]
+            if not before:
+                continue
+            if metric in HIGHER_IS_BETTER and now < before * (1 - tolerance):
+                failures.append(f"{name}: {metric} {now} is more than {tolerance:.0%} below baseline {before}")
+            elif metric not in HIGHER_IS_BETTER and now > before * (1 + tolerance):
+                failures.append(f"{name}: {metric} {now} is more than {tolerance:.0%} above baseline {before}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=','.join(SCENARIOS), help="comma separated scenarios to run")
+    parser.add_argument("--workers", type=int, default=enhanced_web_server.DEFAULT_WORKERS)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=2000, help="requests in the mixed and range scenarios")
+    parser.add_argument("--uploads", type=int, default=64)
+    parser.add_argument("--upload-kb", type=int, default=1024, help="size of each synthetic upload")
+    parser.add_argument("--range-mb", type=int, default=64, help="size of the file read by the range scenario")
+    parser.add_argument("--range-kb", type=int, default=256, help="bytes per range request")
+    parser.add_argument("--pipeline-runs", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--thresholds", help="JSON file of per-scenario min_/max_ limits")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the server's log output")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    thresholds = baseline = None
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+
+    enhanced_web_server.ClipsAIHandler.log_message = quiet_log
+    # Keep benchmark uploads and jobs out of the persistent upload directory
+    upload_dir = None if os.environ.get('CLIPSAI_UPLOAD_DIR') else tempfile.mkdtemp(prefix='load-bench-uploads-')
+    enhanced_web_server.ClipsAIHandler.open_upload_dir(upload_dir)
+    httpd = enhanced_web_server.create_server(0, args.workers, host="127.0.0.1")
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = Client(port)
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='load-bench-')
+    server_log = sys.stdout if args.verbose else open(os.devnull, 'w')
+
+    results = {}
+    try:
+        print(f"workers={args.workers} clients={args.clients}")
+        print(f"{'scenario':<10} {'requests':>8} {'errors':>6} {'req/s':>9} {'MB/s':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>9}")
+        for name in scenarios:
+            with contextlib.redirect_stdout(server_log):
+                if name == 'mixed':
+                    operations = mixed_operations(client, args.requests, rng)
+                elif name == 'upload':
+                    operations = upload_operations(client, args.uploads, args.upload_kb * 1024)
+                elif name == 'range':
+                    operations = range_operations(client, args.requests, args.range_mb * 1024 * 1024,
+                                                  args.range_kb * 1024, rng)
+                else:
+                    operations = pipeline_operations(client, pipeline_sources(args.pipeline_runs, work_dir))
+                result = run_scenario(operations, args.clients)
+            results[name] = result
+            print(f"{name:<10} {result['requests']:>8} {result['errors']:>6} {result['rps']:>9.1f} "
+                  f"{result['mb_per_s']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{result['p99_ms']:>9.1f}")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "config": {k: v for k, v in vars(args).items() if k not in ('output', 'thresholds', 'baseline')},
+                "scenarios": results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    failures = check(results, thresholds or {}, baseline, args.tolerance)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
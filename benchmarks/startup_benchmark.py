@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for the ClipsAI web server
+
+Measures, in fresh interpreters:
+  * import: time to import enhanced_web_server (``python -X importtime``), with
+    the modules that contribute most
+  * startup: from spawning ``enhanced_web_server.py`` to the first accepted
+    connection, to the first byte of ``/api/status``, and until the background
+    warm-up reports ``warm``
+
+Results can be saved as JSON and checked against thresholds (``max_`` limits
+per section); the exit status is 1 if any check fails:
+
+    python benchmarks/startup_benchmark.py --output startup.json
+    python benchmarks/startup_benchmark.py --thresholds benchmarks/startup_thresholds.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child_env(upload_dir):
+    env = dict(os.environ)
+    env.setdefault('CLIPSAI_WHISPER_BACKEND', 'simulated')
+    env.setdefault('CLIPSAI_UPLOAD_DIR', upload_dir)
+    return env
+
+
+def import_times(runs, top):
+    """Median import milliseconds of the server module and its costliest direct imports"""
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='startup-bench-uploads-') as upload_dir:
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import enhanced_web_server'],
+                                    cwd=ROOT, env=child_env(upload_dir), capture_output=True, text=True,
+                                    check=True)
+        children = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            depth = (len(name) - len(name.lstrip())) // 2
+            if depth == 1:
+                # Printed before the module importing them
+                children.append((name.strip(), int(cumulative) / 1000))
+            elif depth == 0:
+                if name.strip() == 'enhanced_web_server':
+                    totals.append(int(cumulative) / 1000)
+                    for child, ms in children:
+                        modules.setdefault(child, []).append(ms)
+                children = []
+    slowest = sorted(((statistics.median(times), name) for name, times in modules.items()), reverse=True)[:top]
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(totals), 1),
+        "max_ms": round(max(totals), 1),
+        "modules": {name: round(ms, 1) for ms, name in slowest},
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_status(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", "/api/status")
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def startup_once(timeout):
+    """Seconds from spawning the server to listening, first status byte and warm"""
+    port = free_port()
+    upload_dir = tempfile.mkdtemp(prefix='startup-bench-uploads-')
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'enhanced_web_server.py', '--port', str(port)], cwd=ROOT,
+                               env=child_env(upload_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        listening = None
+        while listening is None:
+            if time.perf_counter() - started > timeout or process.poll() is not None:
+                raise RuntimeError("server did not start listening")
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=1)
+            except OSError:
+                time.sleep(0.002)
+                continue
+            listening = time.perf_counter() - started
+        with sock:
+            sock.sendall(b"GET /api/status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            sock.recv(1)
+            first_byte = time.perf_counter() - started
+        while get_status(port)["startup"]["state"] != "warm":
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("server did not finish warming up")
+            time.sleep(0.01)
+        warm = time.perf_counter() - started
+        return listening, first_byte, warm
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+def startup_times(runs, timeout):
+    samples = [startup_once(timeout) for _ in range(runs)]
+    result = {"runs": runs}
+    for index, name in enumerate(("listen", "ttfb", "warm")):
+        values = [sample[index] * 1000 for sample in samples]
+        result[f"{name}_median_ms"] = round(statistics.median(values), 1)
+        result[f"{name}_max_ms"] = round(max(values), 1)
+    return result
+
+
+def check(results, thresholds):
+    """Failed checks as human readable lines"""
+    failures = []
+    for section, limits in thresholds.items():
+        for key, limit in limits.items():
+            metric = key[4:]
+            value = results.get(section, {}).get(metric)
+            if value is not None and key.startswith('max_') and value > limit:
+                failures.append(f"{section}: {metric} {value} > {limit}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=8, help="direct imports to list")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--thresholds", help="JSON file of per-section max_ limits")
+    args = parser.parse_args()
+
+    imports = import_times(args.runs, args.top)
+    print(f"import enhanced_web_server: median {imports['median_ms']:.1f} ms, max {imports['max_ms']:.1f} ms")
+    for name, ms in imports["modules"].items():
+        print(f"  {name:<28} {ms:>8.1f} ms")
+
+    startup = startup_times(args.runs, args.timeout)
+    print(f"{'startup':<10} {'median ms':>10} {'max ms':>10}")
+    for name in ("listen", "ttfb", "warm"):
+        print(f"{name:<10} {startup[f'{name}_median_ms']:>10.1f} {startup[f'{name}_max_ms']:>10.1f}")
+
+    results = {"import": imports, "startup": startup}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                **results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    thresholds = {}
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    failures = check(results, thresholds)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
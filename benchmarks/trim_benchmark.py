@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Clip cutting benchmark: single-pass engine vs one ffmpeg run per clip
+
+Cuts the same set of clips three ways and reports wall time and CPU seconds
+(ffmpeg children included):
+  * naive accurate: one ffmpeg per clip, re-encoding the clip (frame accurate)
+  * naive copy: one ffmpeg per clip with stream copy (fast, but starts at the
+    keyframe before the cut point)
+  * engine: ``trim_engine.cut_clips``, one pass over the source with stream
+    copy between keyframes and re-encoded edges (frame accurate)
+
+Without ``--source`` a test video is generated with ffmpeg:
+
+    python benchmarks/trim_benchmark.py --clips 8 --clip-seconds 12
+    python benchmarks/trim_benchmark.py --source talk.mp4 --clips 20
+"""
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trim_engine  # noqa: E402
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(fn):
+    wall, cpu = time.perf_counter(), cpu_seconds()
+    fn()
+    return time.perf_counter() - wall, cpu_seconds() - cpu
+
+
+def generate_source(path, seconds, size):
+    subprocess.run([trim_engine.ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y',
+                    '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=30",
+                    '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+                    '-t', str(seconds), '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60',
+                    '-pix_fmt', 'yuv420p', '-c:a', 'aac', path], check=True)
+
+
+def naive(source, clips, out_dir, accurate):
+    for i, clip in enumerate(clips):
+        cmd = [trim_engine.ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y',
+               '-ss', f"{clip['start']:.3f}", '-i', source, '-t', f"{clip['end'] - clip['start']:.3f}"]
+        if accurate:
+            cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-c:a', 'copy']
+        else:
+            cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+        subprocess.run(cmd + [os.path.join(out_dir, f"naive_{i}.mp4")], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="video to cut (default: generate one)")
+    parser.add_argument("--source-seconds", type=int, default=120)
+    parser.add_argument("--size", default="1280x720", help="generated video size")
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--clip-seconds", type=float, default=12.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if trim_engine.ffmpeg_binary() is None:
+        sys.exit("ffmpeg is required")
+    work = tempfile.mkdtemp(prefix='trim-bench-')
+    try:
+        source = args.source
+        if source is None:
+            source = os.path.join(work, 'source.mp4')
+            generate_source(source, args.source_seconds, args.size)
+        duration = trim_engine.probe(source)["duration"]
+
+        rng = random.Random(args.seed)
+        clips = []
+        for i in range(args.clips):
+            start = round(rng.uniform(0, max(duration - args.clip_seconds, 0)), 3)
+            clips.append({"start": start, "end": min(start + args.clip_seconds, duration),
+                          "output_path": os.path.join(work, f"engine_{i}.mp4")})
+
+        print(f"source={source} duration={duration:.1f}s clips={len(clips)}x{args.clip_seconds:g}s")
+        print(f"{'approach':<16} {'wall s':>8} {'cpu s':>8}")
+        rows = [
+            ("naive accurate", lambda: naive(source, clips, work, True)),
+            ("naive copy", lambda: naive(source, clips, work, False)),
+            ("engine", lambda: trim_engine.cut_clips(source, clips, work)),
+        ]
+        for name, fn in rows:
+            wall, cpu = measure(fn)
+            print(f"{name:<16} {wall:>8.2f} {cpu:>8.2f}")
+
+        modes = [trim_engine.plan_clip(trim_engine.probe(source), c['start'], c['end'])[0] for c in clips]
+        print("engine cuts: " + ", ".join(f"{m}={modes.count(m)}" for m in ('copy', 'smart', 'encode')))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Resumable chunked uploads
+
+The browser splits a file into fixed-size chunks and sends them in parallel.
+Each chunk is written with ``os.pwrite`` at its final offset in a preallocated
+``.part`` file, so completing the upload is a rename rather than a reassembly
+copy. A chunk that was already received is not written again when it is
+re-sent, and a chunk sent with a checksum is staged and verified before it
+reaches the ``.part`` file, so the bytes that were hashed never change. A
+SHA-256 of the whole file is kept up to date as contiguous chunks arrive, so
+completion does not reread the file. Chunks of one upload may arrive at
+different server processes: the received set is merged from the state file
+under a file lock, and chunks another process wrote are hashed from disk.
+The lock file outlives the upload, so a request racing its completion still
+locks the same file; :meth:`ChunkedUploadManager.expire` removes it later.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from shared_state import FileLock
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class ChunkedUploadError(ValueError):
+    """A chunked upload request was invalid; ``status`` is the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUpload:
+    """State of one in-progress chunked upload"""
+
+    def __init__(self, upload_id, filename, size, chunk_size, lock_path, received=()):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.total_chunks = max(1, -(-size // chunk_size))
+        self.received = set(received)
+        self.lock = FileLock(lock_path)
+        # Running hash over chunks [0, hashed_chunks)
+        self.digest = hashlib.sha256()
+        self.hashed_chunks = 0
+
+    def chunk_length(self, index):
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def missing(self):
+        return [i for i in range(self.total_chunks) if i not in self.received]
+
+    def to_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "total_chunks": self.total_chunks,
+            "received": sorted(self.received),
+        }
+
+
+class ChunkedUploadManager:
+    """Tracks chunked uploads staged under ``staging_dir``"""
+
+    def __init__(self, staging_dir, max_size):
+        self.staging_dir = staging_dir
+        self.max_size = max_size
+        self._uploads = {}
+        self._lock = threading.Lock()
+        os.makedirs(staging_dir, exist_ok=True)
+
+    def part_path(self, upload_id):
+        """Staging file of an upload"""
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.json")
+
+    def _lock_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.lock")
+
+    def _load_state(self, upload_id):
+        try:
+            with open(self._state_path(upload_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _refresh(self, upload):
+        # Merge chunks received by other processes (upload.lock held)
+        state = self._load_state(upload.upload_id)
+        if state is None:
+            # Completed or aborted elsewhere
+            with self._lock:
+                self._uploads.pop(upload.upload_id, None)
+            raise ChunkedUploadError("Unknown upload", 404)
+        upload.received.update(state['received'])
+
+    def _save_state(self, upload):
+        tmp_path = self._state_path(upload.upload_id) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(upload.to_dict(), f)
+        os.replace(tmp_path, self._state_path(upload.upload_id))
+
+    def init(self, filename, size, chunk_size=None):
+        """Start a new upload and preallocate its ``.part`` file"""
+        if not filename:
+            raise ChunkedUploadError("No file selected")
+        if size < 0:
+            raise ChunkedUploadError("Invalid file size")
+        if size > self.max_size:
+            raise ChunkedUploadError(
+                f"File exceeds the {self.max_size / (1024 * 1024):.0f}MB upload limit", 413)
+        chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+        chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+        upload_id = uuid.uuid4().hex
+        upload = ChunkedUpload(upload_id, filename, size, chunk_size, self._lock_path(upload_id))
+        with open(self.part_path(upload.upload_id), 'wb') as f:
+            f.truncate(size)
+        self._save_state(upload)
+        with self._lock:
+            self._uploads[upload.upload_id] = upload
+        return upload
+
+    def get(self, upload_id):
+        """Return an upload with its state brought up to date from disk"""
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise ChunkedUploadError("Unknown upload", 404)
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                state = self._load_state(upload_id)
+                if state is None:
+                    raise ChunkedUploadError("Unknown upload", 404)
+                upload = ChunkedUpload(upload_id, state['filename'], state['size'],
+                                       state['chunk_size'], self._lock_path(upload_id), state['received'])
+                self._uploads[upload_id] = upload
+        with upload.lock:
+            self._refresh(upload)
+            self._catch_up_hash(upload)
+        return upload
+
+    def write_chunk(self, upload_id, index, rfile, length, expected_sha256=None):
+        """Stream one chunk from ``rfile`` to its offset; safe to repeat"""
+        upload = self.get(upload_id)
+        if not 0 <= index < upload.total_chunks:
+            raise ChunkedUploadError("Chunk index out of range")
+        if length != upload.chunk_length(index):
+            raise ChunkedUploadError(
+                f"Chunk {index} must be {upload.chunk_length(index)} bytes, got {length}")
+
+        with upload.lock:
+            self._refresh(upload)
+            received = index in upload.received
+            # Hash in-order chunks while they stream past instead of rereading them later
+            running = upload.digest.copy() if index == upload.hashed_chunks and not received else None
+        chunk_digest = hashlib.sha256() if expected_sha256 else None
+        digests = [digest for digest in (running, chunk_digest) if digest is not None]
+
+        part_path = self.part_path(upload_id)
+        offset = index * upload.chunk_size
+        if received:
+            # A retry of a chunk that already arrived: its bytes may already be hashed, keep them
+            self._stream(rfile, length, None, 0, digests)
+            self._verify(index, chunk_digest, expected_sha256)
+            return upload
+        if chunk_digest is None:
+            self._stream(rfile, length, part_path, offset, digests)
+        else:
+            # Verify before writing, so a corrupt chunk never overwrites the .part file
+            staged_path = os.path.join(self.staging_dir, f"{upload_id}.{index}.{uuid.uuid4().hex}.chunk")
+            try:
+                self._stream(rfile, length, staged_path, 0, digests)
+                self._verify(index, chunk_digest, expected_sha256)
+                self._copy_into(staged_path, part_path, offset, length)
+            finally:
+                try:
+                    os.remove(staged_path)
+                except OSError:
+                    pass
+
+        with upload.lock:
+            self._refresh(upload)
+            if index not in upload.received:
+                upload.received.add(index)
+                if running is not None and upload.hashed_chunks == index:
+                    upload.digest = running
+                    upload.hashed_chunks += 1
+            self._catch_up_hash(upload)
+            self._save_state(upload)
+        return upload
+
+    @staticmethod
+    def _stream(rfile, length, path, offset, digests):
+        # Copy ``length`` body bytes to ``path`` at ``offset`` (or drop them if path is None)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600) if path is not None else None
+        try:
+            remaining = length
+            while remaining > 0:
+                data = rfile.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise ChunkedUploadError("Chunk body ended early")
+                remaining -= len(data)
+                for digest in digests:
+                    digest.update(data)
+                while fd is not None and data:
+                    written = os.pwrite(fd, data, offset)
+                    offset += written
+                    data = data[written:]
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    @staticmethod
+    def _verify(index, chunk_digest, expected_sha256):
+        if chunk_digest is not None and chunk_digest.hexdigest() != expected_sha256.lower():
+            raise ChunkedUploadError(f"Checksum mismatch for chunk {index}")
+
+    @staticmethod
+    def _copy_into(src_path, dst_path, offset, length):
+        # Copy a verified chunk into place, in the kernel where possible
+        with open(src_path, 'rb') as src:
+            fd = os.open(dst_path, os.O_WRONLY)
+            try:
+                position = 0
+                while position < length:
+                    if hasattr(os, 'copy_file_range'):
+                        copied = os.copy_file_range(src.fileno(), fd, length - position, position, offset + position)
+                    else:
+                        data = os.pread(src.fileno(), min(READ_SIZE, length - position), position)
+                        copied = os.pwrite(fd, data, offset + position) if data else 0
+                    if not copied:
+                        raise ChunkedUploadError("Chunk could not be written")
+                    position += copied
+            finally:
+                os.close(fd)
+
+    def _catch_up_hash(self, upload):
+        """Extend the running hash over chunks that arrived out of order"""
+        if upload.hashed_chunks in upload.received:
+            with open(self.part_path(upload.upload_id), 'rb') as f:
+                while upload.hashed_chunks in upload.received:
+                    index = upload.hashed_chunks
+                    f.seek(index * upload.chunk_size)
+                    remaining = upload.chunk_length(index)
+                    while remaining > 0:
+                        data = f.read(min(READ_SIZE, remaining))
+                        if not data:
+                            break
+                        upload.digest.update(data)
+                        remaining -= len(data)
+                    upload.hashed_chunks += 1
+
+    def complete(self, upload_id, final_path):
+        """Move a fully received upload to ``final_path``; returns ``(size, sha256)``"""
+        upload = self.get(upload_id)
+        with upload.lock:
+            self._refresh(upload)
+            missing = upload.missing()
+            if missing and upload.size:
+                raise ChunkedUploadError(f"Upload incomplete: {len(missing)} chunks missing", 409)
+            self._catch_up_hash(upload)
+            os.replace(self.part_path(upload_id), final_path)
+            self._discard_state(upload_id)
+        return upload.size, upload.digest.hexdigest()
+
+    def abort(self, upload_id):
+        """Discard an upload and its staged data"""
+        upload = self.get(upload_id)
+        with upload.lock:
+            try:
+                os.remove(self.part_path(upload_id))
+            except OSError:
+                pass
+            self._discard_state(upload_id)
+
+    def expire(self, max_age):
+        """Abort uploads that received no chunk for ``max_age`` seconds; returns how many"""
+        cutoff = time.time() - max_age
+        expired = 0
+        for name in os.listdir(self.staging_dir):
+            if name.endswith('.lock') and not os.path.exists(self._state_path(name[:-len('.lock')])):
+                # Lock of a finished upload: a request that still holds it finds no state and gives up
+                try:
+                    os.remove(os.path.join(self.staging_dir, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            try:
+                if os.stat(self._state_path(upload_id)).st_mtime >= cutoff:
+                    continue
+                self.abort(upload_id)
+            except (OSError, ChunkedUploadError):
+                continue
+            expired += 1
+        return expired
+
+    def _discard_state(self, upload_id):
+        # The lock file stays: complete and abort still hold it (see expire)
+        try:
+            os.remove(self._state_path(upload_id))
+        except OSError:
+            pass
+        with self._lock:
+            self._uploads.pop(upload_id, None)
@@ -0,0 +1,298 @@
+"""
+TextTiling clip finder
+
+The transcript is split into sentences, each sentence is embedded, and the
+similarity between the blocks of sentences before and after every sentence gap
+is computed. Gaps in similarity valleys get a depth score (TextTiling); deep
+gaps are topic changes and become candidate clip boundaries. Clips are the
+best scoring spans between boundaries that fit the requested duration range.
+
+All scoring runs as NumPy array operations. The embedding and depth scores of
+a transcript are kept in an LRU cache, so changing the duration range only
+repeats the (cheap) selection step.
+
+The embedder is chosen by ``CLIPSAI_EMBEDDER``: ``sentence-transformers``
+(model from ``CLIPSAI_EMBEDDING_MODEL``), ``hashing`` (TF-IDF over hashed
+words, no extra dependencies) or ``auto``.
+"""
+
+import collections
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+import profiling
+
+# Sentences per block on each side of a gap; depth scores are averaged over all
+BLOCK_SIZES = (2, 4, 8)
+SMOOTHING_WIDTH = 3
+# A pause this long (seconds) ends a sentence even without punctuation
+SENTENCE_PAUSE = 1.5
+MAX_SENTENCE_WORDS = 60
+
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]*$')
+_TOKEN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers him his how i if in into is it its just me more most my no nor not now of off on once only or
+other our out over own same she should so some such than that the their them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with
+would you your yeah okay um uh like know really going get got thing things
+""".split())
+
+
+class HashingEmbedder:
+    """TF-IDF sentence vectors over hashed word features (no model weights needed)"""
+
+    name = 'hashing'
+
+    def __init__(self, dims=2048):
+        self.dims = dims
+
+    def embed(self, sentences):
+        rows, cols = [], []
+        for row, sentence in enumerate(sentences):
+            for token in _TOKEN.findall(sentence.lower()):
+                if token not in STOPWORDS:
+                    rows.append(row)
+                    cols.append(zlib.crc32(token.encode()) % self.dims)
+        counts = np.zeros((len(sentences), self.dims), dtype=np.float32)
+        np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1
+        vectors = np.log1p(counts) * idf.astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+
+class SentenceTransformerEmbedder:
+    """Sentence embeddings from a sentence-transformers model"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self.model = SentenceTransformer(model_name, device=os.environ.get('CLIPSAI_DEVICE', 'cpu'))
+
+    def embed(self, sentences):
+        return self.model.encode(sentences, batch_size=64, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+def load_embedder():
+    """Default embedder honouring CLIPSAI_EMBEDDER"""
+    backend = os.environ.get('CLIPSAI_EMBEDDER', 'auto')
+    if backend in ('auto', 'sentence-transformers'):
+        try:
+            return SentenceTransformerEmbedder(os.environ.get('CLIPSAI_EMBEDDING_MODEL', 'all-roberta-large-v1'))
+        except ImportError:
+            if backend == 'sentence-transformers':
+                raise
+    return HashingEmbedder()
+
+
+def split_sentences(words):
+    """Group transcript words into sentences; returns ``(texts, starts, ends)``"""
+    texts, starts, ends = [], [], []
+    current = []
+    for i, word in enumerate(words):
+        current.append(word)
+        following = words[i + 1] if i + 1 < len(words) else None
+        if (following is None or _SENTENCE_END.search(word['word'])
+                or following['start'] - word['end'] >= SENTENCE_PAUSE
+                or len(current) >= MAX_SENTENCE_WORDS):
+            texts.append(' '.join(w['word'] for w in current))
+            starts.append(current[0]['start'])
+            ends.append(current[-1]['end'])
+            current = []
+    return texts, np.array(starts, dtype=np.float64), np.array(ends, dtype=np.float64)
+
+
+def block_similarities(embeddings, block_sizes=BLOCK_SIZES):
+    """Cosine similarity of the k sentences before and after each of the n-1 gaps.
+
+    Returns ``{k: similarities}``. The blocks grow one shifted slice at a time,
+    so all block sizes share one pass over the embeddings.
+    """
+    n, dims = embeddings.shape
+    widest = max(block_sizes)
+    padded = np.zeros((n + 2 * widest, dims), dtype=np.float32)
+    padded[widest:widest + n] = embeddings
+    left = np.zeros((n - 1, dims), dtype=np.float32)
+    right = np.zeros((n - 1, dims), dtype=np.float32)
+    similarities = {}
+    for j in range(widest):
+        # Gap g (1..n-1) lies between sentences g-1 and g
+        left += padded[widest - j:widest + n - 1 - j]
+        right += padded[widest + 1 + j:widest + n + j]
+        if j + 1 in block_sizes:
+            norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+            similarities[j + 1] = np.einsum('ij,ij->i', left, right) / np.maximum(norms, 1e-12)
+    return similarities
+
+
+def smooth(values, width=SMOOTHING_WIDTH):
+    if width <= 1 or len(values) < width:
+        return values
+    kernel = np.ones(width) / width
+    padded = np.pad(values, width // 2, mode='edge')
+    return np.convolve(padded, kernel, mode='valid')[:len(values)]
+
+
+def depth_scores(similarity):
+    """TextTiling depth: climb to the nearest peak on each side of every gap"""
+    n = len(similarity)
+    if n == 0:
+        return similarity
+    index = np.arange(n)
+    # Left peak: last position j <= i where going further left would descend
+    rises = np.zeros(n, dtype=bool)
+    rises[0] = True
+    rises[1:] = similarity[:-1] < similarity[1:]
+    left_peak = np.maximum.accumulate(np.where(rises, index, 0))
+    # Right peak: first position j >= i where going further right would descend
+    falls = np.zeros(n, dtype=bool)
+    falls[-1] = True
+    falls[:-1] = similarity[1:] < similarity[:-1]
+    right_peak = np.minimum.accumulate(np.where(falls, index, n - 1)[::-1])[::-1]
+    return (similarity[left_peak] - similarity) + (similarity[right_peak] - similarity)
+
+
+class TranscriptAnalysis:
+    """Sentence timing and gap depth scores of one transcript"""
+
+    def __init__(self, texts, starts, ends, embeddings):
+        self.texts = texts
+        self.starts = starts
+        self.ends = ends
+        count = len(texts)
+        if count > 1:
+            depths = []
+            for similarity in block_similarities(np.asarray(embeddings, dtype=np.float32)).values():
+                depth = depth_scores(smooth(similarity))
+                peak = depth.max()
+                depths.append(depth / peak if peak > 0 else depth)
+            self.depth = np.mean(depths, axis=0)
+        else:
+            self.depth = np.zeros(0)
+
+    def select(self, min_duration, max_duration, max_clips=20):
+        """Best non-overlapping clips between topic boundaries within the duration range"""
+        count = len(self.texts)
+        if count == 0:
+            return []
+        # Boundary positions: sentence indices a clip may start at / end before,
+        # with their strength (the start and end of the video count as strongest)
+        positions = np.concatenate(([0], np.flatnonzero(self.depth > 0) + 1, [count]))
+        strength = np.concatenate(([1.0], self.depth[positions[1:-1] - 1], [1.0]))
+        start_times = self.starts[np.minimum(positions, count - 1)]
+        end_times = self.ends[np.maximum(positions - 1, 0)]
+
+        lows, highs, scores = [], [], []
+        inner = np.full(len(positions) - 1, -np.inf)
+        for offset in range(1, len(positions)):
+            first, last = positions[:-offset], positions[offset:]
+            if offset > 1:
+                # Strongest boundary strictly inside each span (running max over offsets)
+                inner = np.maximum(inner[:-1], strength[offset - 1:-1])
+            durations = end_times[offset:] - start_times[:-offset]
+            fits = (durations >= min_duration) & (durations <= max_duration)
+            if fits.any():
+                edge = np.minimum(strength[:-offset], strength[offset:])
+                score = edge - np.maximum(inner, 0)
+                lows.append(first[fits])
+                highs.append(last[fits])
+                scores.append(score[fits])
+            if durations.min() > max_duration:
+                break
+        if not scores:
+            return []
+
+        lows, highs, scores = np.concatenate(lows), np.concatenate(highs), np.concatenate(scores)
+        taken = np.zeros(count, dtype=bool)
+        chosen = []
+        for i in np.argsort(-scores, kind='stable'):
+            if scores[i] <= 0 and chosen:
+                break
+            if not taken[lows[i]:highs[i]].any():
+                taken[lows[i]:highs[i]] = True
+                chosen.append(i)
+                if len(chosen) >= max_clips:
+                    break
+
+        clips = []
+        for clip_id, i in enumerate(sorted(chosen, key=lambda i: lows[i]), 1):
+            start, end = float(self.starts[lows[i]]), float(self.ends[highs[i] - 1])
+            clips.append({
+                "id": clip_id,
+                "topic": topic_label(self.texts[lows[i]]),
+                "start": round(start, 2),
+                "end": round(end, 2),
+                "duration": round(end - start, 2),
+                "score": round(float(max(0.0, min(1.0, scores[i]))), 3),
+            })
+        return clips
+
+
+def topic_label(sentence, words=8):
+    tokens = sentence.split()
+    return ' '.join(tokens[:words]) + ('…' if len(tokens) > words else '')
+
+
+class ClipFinder:
+    """Analyzes transcripts with a shared embedder and caches the analyses"""
+
+    def __init__(self, embedder_loader=load_embedder, max_entries=32):
+        self.embedder_loader = embedder_loader
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._embedder = None
+        self._lock = threading.Lock()
+        self._analyses = collections.OrderedDict()  # key -> TranscriptAnalysis, oldest first
+
+    @property
+    def embedder(self):
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = self.embedder_loader()
+            return self._embedder
+
+    def cached(self, key):
+        with self._lock:
+            analysis = self._analyses.get(key)
+            if analysis is not None:
+                self._analyses.move_to_end(key)
+                self.hits += 1
+            return analysis
+
+    def analyze(self, key, words, progress=None):
+        """Analysis of a transcript's words, computed once per ``key``"""
+        analysis = self.cached(key)
+        if analysis is not None:
+            return analysis
+        texts, starts, ends = split_sentences(words)
+        with profiling.span('embed', sentences=len(texts)):
+            embeddings = self.embedder.embed(texts) if texts else np.zeros((0, 1), dtype=np.float32)
+        if progress:
+            progress(0.9)
+        with profiling.span('depth_scores'):
+            analysis = TranscriptAnalysis(texts, starts, ends, embeddings)
+        with self._lock:
+            self.misses += 1
+            self._analyses[key] = analysis
+            while len(self._analyses) > self.max_entries:
+                self._analyses.popitem(last=False)
+        return analysis
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._analyses),
+                "hits": self.hits,
+                "misses": self.misses,
+                "embedder": getattr(self._embedder, 'name', None),
+            }
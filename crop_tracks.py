@@ -0,0 +1,313 @@
+"""
+Speaker diarization and crop tracks, computed once per source video
+
+Resizing a clip to another aspect ratio needs to know who speaks when
+(diarization) and where that speaker is in the frame. Both depend only on the
+source video, so they are computed once and stored next to the upload as
+hidden derived files: the diarization once per video, the crop track once per
+video and aspect ratio. A resize request then only slices the stored track to
+the clip and applies it as an ffmpeg crop.
+
+A crop track is a list of shots: spans of the video with a fixed crop window.
+Shots start at speaker changes and where the detected speaker position moves;
+short shots and shots whose window barely moves are merged into their
+neighbours, so the window does not jitter.
+
+Backends are chosen like the other models:
+
+* ``CLIPSAI_DIARIZER``: ``pyannote`` (needs ``CLIPSAI_HF_TOKEN``), ``energy``
+  (speech/silence from the audio level, one speaker) or ``auto``;
+* ``CLIPSAI_CROP_LOCATOR``: ``faces`` (OpenCV face detection), ``motion``
+  (where the picture changes) or ``auto``.
+
+Speaker positions are sampled on keyframes only, which are decoded without
+decoding the frames between them.
+"""
+
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+import profiling
+import trim_engine
+from shared_state import DerivedResults
+from audio_cache import SAMPLE_RATE
+from parallel_transcription import FRAME_SECONDS, frame_energy, silence_threshold
+
+# Shots shorter than this (seconds) are merged into their neighbour
+MIN_SHOT_SECONDS = 1.5
+# Neighbouring shots whose speaker positions differ by less than this share one window
+MERGE_DISTANCE = 0.05
+# Speech pauses shorter than this stay within one speech segment
+SPEECH_GAP_SECONDS = 0.5
+# Keyframes closer together than this are not all analyzed
+MIN_SAMPLE_INTERVAL = 0.25
+ANALYSIS_WIDTH = 256
+
+
+class PyannoteDiarizer:
+    """Speaker turns from a Pyannote pipeline"""
+
+    name = 'pyannote'
+
+    def __init__(self, token):
+        import torch
+        from pyannote.audio import Pipeline
+        self.torch = torch
+        self.pipeline = Pipeline.from_pretrained(
+            os.environ.get('CLIPSAI_DIARIZATION_MODEL', 'pyannote/speaker-diarization-3.0'), use_auth_token=token)
+
+    def diarize(self, samples):
+        waveform = self.torch.from_numpy(np.array(samples, dtype=np.float32))[None]
+        annotation = self.pipeline({"waveform": waveform, "sample_rate": SAMPLE_RATE})
+        return [{"speaker": speaker, "start": round(turn.start, 3), "end": round(turn.end, 3)}
+                for turn, _, speaker in annotation.itertracks(yield_label=True)]
+
+
+class EnergyDiarizer:
+    """Speech segments from the audio level, all attributed to one speaker"""
+
+    name = 'energy'
+
+    def diarize(self, samples):
+        hop = int(FRAME_SECONDS * SAMPLE_RATE)
+        energy = frame_energy(samples, hop)
+        speech = np.concatenate(([False], energy >= silence_threshold(energy), [False]))
+        edges = np.flatnonzero(speech[1:] != speech[:-1]) * FRAME_SECONDS
+        segments = []
+        for start, end in zip(edges[0::2], edges[1::2]):
+            if segments and start - segments[-1]["end"] < SPEECH_GAP_SECONDS:
+                segments[-1]["end"] = round(float(end), 3)
+            else:
+                segments.append({"speaker": "SPEAKER_00", "start": round(float(start), 3),
+                                 "end": round(float(end), 3)})
+        return segments
+
+
+def load_diarizer():
+    """Default diarizer honouring CLIPSAI_DIARIZER"""
+    backend = os.environ.get('CLIPSAI_DIARIZER', 'auto')
+    token = os.environ.get('CLIPSAI_HF_TOKEN') or os.environ.get('HF_TOKEN')
+    if backend == 'pyannote' or (backend == 'auto' and token):
+        try:
+            return PyannoteDiarizer(token)
+        except ImportError:
+            if backend == 'pyannote':
+                raise
+    return EnergyDiarizer()
+
+
+class FaceLocator:
+    """Horizontal position of the largest face in a frame"""
+
+    name = 'faces'
+
+    def __init__(self):
+        import cv2
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def locate(self, frame):
+        faces = self.cascade.detectMultiScale(frame, scaleFactor=1.1, minNeighbors=4)
+        if len(faces) == 0:
+            return None
+        x, _, w, _ = max(faces, key=lambda face: face[2] * face[3])
+        return (x + w / 2) / frame.shape[1]
+
+
+class MotionLocator:
+    """Horizontal centre of the change since the previous sampled frame"""
+
+    name = 'motion'
+
+    def __init__(self):
+        self.previous = None
+
+    def locate(self, frame):
+        frame = frame.astype(np.int16)
+        previous, self.previous = self.previous, frame
+        if previous is None:
+            return None
+        columns = np.abs(frame - previous).sum(axis=0, dtype=np.float64)
+        if columns.sum() < 2.0 * frame.size:
+            return None  # (almost) still picture
+        return float(np.average(np.arange(len(columns)), weights=columns) + 0.5) / len(columns)
+
+
+def load_locator():
+    """Default speaker locator honouring CLIPSAI_CROP_LOCATOR"""
+    backend = os.environ.get('CLIPSAI_CROP_LOCATOR', 'auto')
+    if backend in ('auto', 'faces'):
+        try:
+            return FaceLocator()
+        except ImportError:
+            if backend == 'faces':
+                raise
+    return MotionLocator()
+
+
+def parse_aspect_ratio(aspect_ratio):
+    """``"W:H"`` as two positive ints; ValueError otherwise"""
+    try:
+        ratio_w, ratio_h = (int(x) for x in str(aspect_ratio).split(':'))
+    except ValueError:
+        raise ValueError(f"Invalid aspect ratio: {aspect_ratio}")
+    if ratio_w <= 0 or ratio_h <= 0:
+        raise ValueError(f"Invalid aspect ratio: {aspect_ratio}")
+    return ratio_w, ratio_h
+
+
+def crop_size(width, height, aspect_ratio):
+    """Largest even ``(width, height)`` of the aspect ratio that fits the frame"""
+    ratio_w, ratio_h = parse_aspect_ratio(aspect_ratio)
+    crop_w = min(width, height * ratio_w / ratio_h)
+    crop_h = min(height, width * ratio_h / ratio_w)
+    return int(crop_w) // 2 * 2, int(crop_h) // 2 * 2
+
+
+def sample_positions(source_path, info, locator):
+    """``(time, position)`` of the speaker on keyframes; position is 0..1 across the frame or None"""
+    width, height = info["width"], info["height"]
+    analysis_h = max(2, round(height * ANALYSIS_WIDTH / width / 2) * 2)
+    frame_bytes = ANALYSIS_WIDTH * analysis_h
+    process = subprocess.Popen(
+        [trim_engine.ffmpeg_binary(), '-hide_banner', '-nostdin', '-loglevel', 'error',
+         '-skip_frame', 'nokey', '-i', source_path, '-map', '0:v:0',
+         '-vf', f"scale={ANALYSIS_WIDTH}:{analysis_h},format=gray", '-fps_mode', 'passthrough',
+         '-f', 'rawvideo', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    samples = []
+    last = -MIN_SAMPLE_INTERVAL
+    try:
+        # Decoded keyframes come out in presentation order
+        for pts, _ in info["keyframes"]:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            if pts - last < MIN_SAMPLE_INTERVAL:
+                continue
+            last = pts
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(analysis_h, ANALYSIS_WIDTH)
+            samples.append((pts, locator.locate(frame)))
+    finally:
+        process.kill()
+        process.wait()
+    return samples
+
+
+def build_track(info, aspect_ratio, turns, samples):
+    """Shots with a fixed crop window each, covering the whole video"""
+    width, height = info["width"], info["height"]
+    duration = info["duration"] or (samples[-1][0] if samples else 0.0)
+    crop_w, crop_h = crop_size(width, height, aspect_ratio)
+
+    # Candidate shots start at speaker changes and at every sampled position;
+    # pauses belong to the preceding turn
+    boundaries = {0.0}
+    speaker = None
+    for turn in sorted(turns, key=lambda t: t["start"]):
+        if speaker is not None and turn["speaker"] != speaker:
+            boundaries.add(turn["start"])
+        speaker = turn["speaker"]
+    times = np.array([t for t, position in samples if position is not None])
+    positions = np.array([position for _, position in samples if position is not None])
+    if len(positions) >= 3:
+        # Median of three against single-frame detection errors
+        positions[1:-1] = np.median(np.stack([positions[:-2], positions[1:-1], positions[2:]]), axis=0)
+    boundaries.update(float(t) for t in times)
+    starts = sorted(t for t in boundaries if t < duration) or [0.0]
+    starts[0] = 0.0
+
+    shots = []
+    previous = 0.5
+    for start, end in zip(starts, starts[1:] + [duration]):
+        inside = positions[(times >= start) & (times < end)]
+        centre = float(np.median(inside)) if len(inside) else previous
+        previous = centre
+        if shots and (end - start < MIN_SHOT_SECONDS or abs(centre - shots[-1][2]) < MERGE_DISTANCE
+                      or shots[-1][1] - shots[-1][0] < MIN_SHOT_SECONDS):
+            # Merge: the window of the combined shot is the time-weighted mean
+            first, _, other = shots[-1]
+            shots[-1] = (first, end, (other * (start - first) + centre * (end - start)) / (end - first))
+        else:
+            shots.append((start, end, centre))
+
+    return {
+        "aspect_ratio": aspect_ratio,
+        "width": width,
+        "height": height,
+        "crop_width": crop_w,
+        "crop_height": crop_h,
+        "shots": [{"start": round(start, 3), "end": round(end, 3),
+                   "x": int(min(max(centre * width - crop_w / 2, 0), width - crop_w)) // 2 * 2,
+                   "y": (height - crop_h) // 4 * 2}
+                  for start, end, centre in shots],
+    }
+
+
+def crop_filter(track, start, end):
+    """ffmpeg crop for the part of ``track`` between ``start`` and ``end``; ``t`` is clip time"""
+    shots = [shot for shot in track["shots"] if shot["end"] > start and shot["start"] < end]
+    shots = shots or track["shots"][-1:]
+    x = str(shots[-1]["x"])
+    for shot in reversed(shots[:-1]):
+        x = f"if(lt(t,{shot['end'] - start:.3f}),{shot['x']},{x})"
+    return f"crop={track['crop_width']}:{track['crop_height']}:'{x}':{shots[0]['y']}"
+
+
+class CropTracks:
+    """Persisted diarization and crop tracks per upload, each computed once"""
+
+    def __init__(self, store, audio_cache, diarizer_loader=load_diarizer, locator_loader=load_locator):
+        self.store = store
+        self.audio_cache = audio_cache
+        self.diarizer_loader = diarizer_loader
+        self.locator_loader = locator_loader
+        self._diarizer = None
+        self._lock = threading.Lock()
+        self._results = DerivedResults(store)
+
+    @property
+    def diarizer(self):
+        with self._lock:
+            if self._diarizer is None:
+                self._diarizer = self.diarizer_loader()
+            return self._diarizer
+
+    def diarization(self, sha256):
+        """Speaker turns ``[{speaker, start, end}]`` of an upload"""
+        return self._results.get(sha256, 'diarization.json', lambda record: self._diarize(sha256))
+
+    def track(self, sha256, aspect_ratio):
+        """Crop track of an upload for an ``"W:H"`` aspect ratio"""
+        ratio_w, ratio_h = parse_aspect_ratio(aspect_ratio)
+        return self._results.get(sha256, f"crop-{ratio_w}x{ratio_h}.json",
+                                 lambda record: self._track(sha256, record, f"{ratio_w}:{ratio_h}"))
+
+    def _diarize(self, sha256):
+        try:
+            samples = self.audio_cache.get(sha256)
+        except ValueError:
+            return []  # no audio track
+        with profiling.span('diarize', diarizer=self.diarizer.name):
+            return self.diarizer.diarize(samples)
+
+    def _track(self, sha256, record, aspect_ratio):
+        source_path = self.store.blob_path(record)
+        info = trim_engine.probe(source_path)
+        if not info["width"]:
+            raise ValueError("Source has no video stream")
+        with profiling.span('locate_speakers', keyframes=len(info["keyframes"])):
+            samples = sample_positions(source_path, info, self.locator_loader())
+        track = build_track(info, aspect_ratio, self.diarization(sha256), samples)
+        print(f"🎯 Crop track {aspect_ratio} for {record['filename']}: {len(track['shots'])} shots")
+        return track
+
+    def stats(self):
+        with self._lock:
+            return {
+                "computed": self._results.computed,
+                "reused": self._results.reused,
+                "diarizer": getattr(self._diarizer, 'name', None),
+            }
@@ -1,44 +1,429 @@
 #!/usr/bin/env python3
 """
 Enhanced ClipsAI Web Server with Working File Upload and HF Token Validation
+
+Importing this module stays cheap: the pipeline modules (numpy and, with the
+real backends, WhisperX, torch and pyannote) and ``requests`` load on first
+use or in a warm-up thread started once the socket is listening, so
+``/api/status`` answers as soon as the process binds.
+
+With ``--processes N`` (``CLIPSAI_PROCESSES``) the server runs as N worker
+processes sharing one listening socket under a supervising master (see
+prefork.py); jobs, metrics and traces are then shared through the upload
+directory.
 """
 
 import http.server
 import socketserver
 import urllib.parse
 import json
-import tempfile
 import os
 import threading
 import time
-import cgi
-import shutil
-import requests
 from pathlib import Path
 import mimetypes
+import argparse
+import email.utils
+import re
+import importlib
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from multipart_upload import MultipartParser, MultipartError, UploadTooLarge, clean_filename
+from chunked_upload import ChunkedUploadManager, ChunkedUploadError
+from metadata_db import MetadataDB
+from upload_store import UploadStore, is_sha256
+from storage_manager import StorageManager, StorageFull
+from job_queue import JobManager, QueueFull, parse_limits
+from transcript_cache import TranscriptCache
+from model_pool import ModelPool
+from static_assets import build_page_assets
+from token_validator import TokenValidator
+import prefork
+import profiling
+from metrics import REGISTRY, START_TIME
+
+# Number of worker threads serving requests concurrently (per process)
+DEFAULT_WORKERS = int(os.environ.get('CLIPSAI_WORKERS', '32'))
+# Server processes sharing the listening socket; 0 means one per CPU
+DEFAULT_PROCESSES = prefork.process_count(os.environ.get('CLIPSAI_PROCESSES', '1'))
+
+# Server-side upload size limit (the browser enforces the same limit)
+MAX_UPLOAD_SIZE = int(os.environ.get('CLIPSAI_MAX_UPLOAD_MB', '100')) * 1024 * 1024
+# Limit for resumable chunked uploads, which are meant for long recordings
+MAX_CHUNKED_UPLOAD_SIZE = int(os.environ.get('CLIPSAI_MAX_CHUNKED_UPLOAD_MB', '20480')) * 1024 * 1024
+
+# Uploads, outputs, caches and the metadata database; kept across restarts
+UPLOAD_DIR = os.environ.get('CLIPSAI_UPLOAD_DIR') or os.path.join(
+    os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'clipsai')
+
+# Background pipeline jobs: total workers and per-kind concurrency limits
+JOB_WORKERS = int(os.environ.get('CLIPSAI_JOB_WORKERS', '4'))
+JOB_LIMITS = parse_limits(os.environ.get('CLIPSAI_JOB_LIMITS',
+                                         'transcribe=1,find_clips=2,process=2,process_batch=1,index=1'))
+# Transcript cache budget; entries are evicted least recently used first
+TRANSCRIPT_CACHE_BYTES = int(os.environ.get('CLIPSAI_TRANSCRIPT_CACHE_MB', '512')) * 1024 * 1024
+
+# Memory budget for warm Whisper models, and sizes to load at startup (e.g. "base,small")
+MODEL_MEMORY_BUDGET = int(os.environ.get('CLIPSAI_MODEL_MEMORY_MB', '12288')) * 1024 * 1024
+PRELOAD_MODELS = [m.strip() for m in os.environ.get('CLIPSAI_PRELOAD_MODELS', '').split(',') if m.strip()]
+
+# Load pipeline modules and build static assets in the background after binding
+# ("0": everything loads with the first request that needs it)
+WARMUP = os.environ.get('CLIPSAI_WARMUP', '1') != '0'
+# Modules imported by the warm-up thread; the handlers import them on first use
+WARMUP_MODULES = ('pipeline', 'batch_processing')
+
+# Seconds between keep-alive comments on idle job event streams
+SSE_KEEPALIVE = 15
+# Job event streams open at once per process; each holds a worker thread, so by default
+# a quarter of the workers (0), leaving the rest for other requests. Others poll instead.
+MAX_EVENT_STREAMS = int(os.environ.get('CLIPSAI_MAX_EVENT_STREAMS', '0'))
+
+# Read size used when streaming files without os.sendfile
+STREAM_CHUNK_SIZE = 256 * 1024
+
+HTTP_REQUESTS = REGISTRY.counter('clipsai_http_requests_total', "HTTP requests by method, route and status",
+                                 ('method', 'route', 'status'))
+HTTP_SECONDS = REGISTRY.histogram('clipsai_http_request_seconds', "Time to handle an HTTP request",
+                                  ('method', 'route'))
+HTTP_BYTES_IN = REGISTRY.counter('clipsai_http_request_bytes_total', "Request body bytes received", ('route',))
+HTTP_BYTES_OUT = REGISTRY.counter('clipsai_http_response_bytes_total', "Response body bytes sent", ('route',))
+
+# Routes with ids in the path, reported as one route each (bounded label values)
+ROUTE_PATTERNS = [
+    (re.compile(r'^/uploads/'), '/uploads/{file}'),
+    (re.compile(r'^/static/'), '/static/{asset}'),
+    (re.compile(r'^/api/upload/[^/]+/complete$'), '/api/upload/{id}/complete'),
+    (re.compile(r'^/api/upload/[^/]+/[^/]+$'), '/api/upload/{id}/{index}'),
+    (re.compile(r'^/api/upload/(?!init$)[^/]+$'), '/api/upload/{id}'),
+    (re.compile(r'^/api/uploads/[^/]+/thumbnails/[^/]+$'), '/api/uploads/{id}/thumbnails/{sheet}'),
+    (re.compile(r'^/api/uploads/[^/]+/(keyframes|thumbnails)$'), r'/api/uploads/{id}/\1'),
+    (re.compile(r'^/api/jobs/[^/]+/(events|cancel)$'), r'/api/jobs/{id}/\1'),
+    (re.compile(r'^/api/jobs/[^/]+$'), '/api/jobs/{id}'),
+    (re.compile(r'^/api/traces/[^/]+/profile$'), '/api/traces/{id}/profile'),
+    (re.compile(r'^/api/traces/[^/]+$'), '/api/traces/{id}'),
+]
+KNOWN_ROUTES = {'/', '/index.html', '/metrics', '/api/status', '/api/upload', '/api/upload/init', '/api/jobs',
+                '/api/traces',
+                '/api/validate_token', '/api/transcribe', '/api/find_clips', '/api/process', '/api/process_batch'}
+
+
+def metrics_route(path):
+    """Route label of a request path: ids become placeholders, unknown paths ``other``"""
+    path = urllib.parse.urlsplit(path).path
+    if path in KNOWN_ROUTES:
+        return path
+    for pattern, route in ROUTE_PATTERNS:
+        match = pattern.match(path)
+        if match:
+            return match.expand(route)
+    return 'other'
+
+
+class LazyComponent:
+    """Handler class attribute built on first access.
+
+    ``LazyComponent('audio_cache', 'AudioCache', 'upload_store')`` imports
+    ``audio_cache`` and calls ``AudioCache(cls.upload_store)`` the first time the
+    attribute is read, then replaces itself with the instance.
+    """
+
+    def __init__(self, module, factory, *dependencies):
+        self.module = module
+        self.factory = factory
+        self.dependencies = dependencies
+        self._lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        with self._lock:
+            value = self.owner.__dict__[self.name]
+            if value is self:
+                factory = getattr(importlib.import_module(self.module), self.factory)
+                value = factory(*(getattr(self.owner, name) for name in self.dependencies))
+                setattr(self.owner, self.name, value)
+        return value
+
+
+class Startup:
+    """Progress of the background warm-up, reported by /api/status"""
+
+    def __init__(self):
+        self.state = 'pending'
+        self.started = None
+        self.seconds = None
+        self.steps = {}
+        self.errors = {}
+
+    def run(self, steps):
+        self.state = 'warming'
+        self.started = time.perf_counter()
+        for name, fn in steps:
+            step_started = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"⚠️  Warm-up step '{name}' failed: {e}")
+            self.steps[name] = round(time.perf_counter() - step_started, 4)
+        self.seconds = round(time.perf_counter() - self.started, 4)
+        self.state = 'warm'
+
+    def to_dict(self):
+        return {"state": self.state, "warmup_seconds": self.seconds, "steps": dict(self.steps),
+                "errors": dict(self.errors)}
+
+
+# Subdirectories of the upload directory whose files /uploads/ serves, besides upload blobs
+SERVED_DIRS = ('processed',)
+
+
+def is_served_upload(name):
+    """Whether /uploads/ serves ``name`` ('/'-separated, relative to the upload directory).
+
+    Only upload blobs (``<sha256><ext>``) and outputs in SERVED_DIRS are; the
+    metadata database, staged uploads and derived files never are.
+    """
+    parts = name.split('/')
+    if any(not part or part.startswith('.') for part in parts):
+        return False
+    if len(parts) == 1:
+        return is_sha256(name[:64]) and name[64:65] in ('', '.')
+    return parts[0] in SERVED_DIRS
+
+
+def parse_byte_range(header, size):
+    """Parse a ``Range: bytes=...`` header against a file of ``size`` bytes.
+
+    Returns an inclusive ``(start, end)`` tuple, or None when the header should
+    be ignored and the whole file served (missing, malformed or multi-range).
+    Raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split('-', 1))
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
 
 class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
-    # Class-wide upload directory to persist across requests
-    upload_dir = tempfile.mkdtemp()
+    # Class-wide upload directory to persist across requests and restarts (shared by pre-fork workers)
+    upload_dir = UPLOAD_DIR
+    # Records of uploads, transcripts and jobs (see metadata_db.py); this and the other
+    # components kept in the upload directory are created by open_upload_dir
+    db = None
+    # State of other worker processes (jobs, metrics, traces) in pre-fork mode
+    shared_dir = None
+    # Staging area for resumable uploads (hidden from /uploads/)
+    chunked_uploads = None
+    # Uploads are stored once per content hash
+    upload_store = None
+    # Quota, least recently used eviction and usage of the upload directory
+    storage = None
+    # 16 kHz mono audio of each upload, decoded once and shared by all stages
+    audio_cache = LazyComponent('audio_cache', 'AudioCache', 'upload_store')
+    # Diarization and crop tracks per source video, reused by every resize
+    crop_tracks = LazyComponent('crop_tracks', 'CropTracks', 'upload_store', 'audio_cache')
+    # Keyframe table and thumbnail sprite sheets per upload, built in the background after upload
+    video_index = LazyComponent('video_index', 'VideoIndex', 'upload_store')
+    _index_jobs = {}
+    _index_jobs_lock = threading.Lock()
+    jobs = None
+    transcript_cache = None
+    models = ModelPool(budget=MODEL_MEMORY_BUDGET)
+    # Sentence embeddings and topic depth scores per transcript
+    clip_finder = LazyComponent('clip_finder', 'ClipFinder')
+    token_validator = TokenValidator()
+    startup = Startup()
+    # Encoded page, CSS and JS, built once (see get_static_assets)
+    static_assets = None
+    _static_assets_lock = threading.Lock()
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def open_upload_dir(cls, upload_dir=None):
+        """Create the upload directory and open the database, stores and job manager kept in it.
+
+        Done when the server is created rather than on import, so importing this
+        module stays cheap and touches nothing on disk. Does nothing once open.
+        """
+        if cls.db is not None:
+            return
+        cls.upload_dir = upload_dir or cls.upload_dir
+        state_dir = os.path.join(cls.upload_dir, '.storage')
+        os.makedirs(state_dir, exist_ok=True)
+        # Hidden, like all server state; a database left at the top level by an earlier version moves in
+        db_path = os.path.join(state_dir, 'clipsai.db')
+        if not os.path.exists(db_path) and os.path.exists(os.path.join(cls.upload_dir, 'clipsai.db')):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(os.path.join(cls.upload_dir, 'clipsai.db' + suffix)):
+                    os.replace(os.path.join(cls.upload_dir, 'clipsai.db' + suffix), db_path + suffix)
+        cls.db = MetadataDB(db_path)
+        cls.chunked_uploads = ChunkedUploadManager(os.path.join(cls.upload_dir, '.chunked'),
+                                                   MAX_CHUNKED_UPLOAD_SIZE)
+        cls.upload_store = UploadStore(cls.upload_dir, cls.db)
+        cls.storage = StorageManager(cls.upload_dir, cls.upload_store, cls.chunked_uploads)
+        cls.jobs = JobManager(JOB_WORKERS, JOB_LIMITS, db=cls.db, owner=prefork.run_id())
+        cls.transcript_cache = TranscriptCache(
+            os.environ.get('CLIPSAI_TRANSCRIPT_CACHE_DIR', os.path.join(cls.upload_dir, '.transcripts')),
+            TRANSCRIPT_CACHE_BYTES, db=cls.db)
+        if prefork.is_worker():
+            cls.shared_dir = os.path.join(cls.upload_dir, '.workers')
+            REGISTRY.share(os.path.join(cls.shared_dir, 'metrics'))
+            profiling.TRACES.share(os.path.join(cls.shared_dir, 'traces'))
+
+    def handle_one_request(self):
+        # Time from the parsed request line to the end of the response
+        self._request_started = None
+        self._trace = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self._trace is not None:
+                self._trace.args["status"] = self._status
+                profiling.finish(self._trace)
+            if self._request_started is not None and self.command:
+                self.record_request_metrics()
+
+    def parse_request(self):
+        self._request_started = time.perf_counter()
+        self._status = 0
+        self._bytes_out = 0
+        if not super().parse_request():
+            return False
+        self.start_trace()
+        return True
+
+    def start_trace(self):
+        # Opt-in profiling (see profiling.py); the profile query flag is removed
+        # so routing sees the plain path
+        flag = self.headers.get('X-ClipsAI-Profile')
+        parts = urllib.parse.urlsplit(self.path)
+        if 'profile=' in parts.query:
+            query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+            flag = next((value for key, value in query if key == 'profile'), flag)
+            self.path = urllib.parse.urlunsplit(parts._replace(
+                query=urllib.parse.urlencode([(key, value) for key, value in query if key != 'profile'])))
+        if parts.path.startswith('/api/traces'):
+            return
+        self._trace = profiling.start(f"{self.command} {metrics_route(self.path)}", 'request',
+                                      profiling.requested_mode(flag), path=self.path)
+
+    def end_headers(self):
+        if self._trace is not None:
+            self.send_header('X-ClipsAI-Trace', self._trace.id)
+        super().end_headers()
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length' and self.command != 'HEAD' and self._status != 304:
+            self._bytes_out += int(value)
+        super().send_header(keyword, value)
+
+    def record_request_metrics(self):
+        route = metrics_route(self.path)
+        HTTP_REQUESTS.inc(1, (self.command, route, str(self._status)))
+        HTTP_SECONDS.observe(time.perf_counter() - self._request_started, (self.command, route))
+        bytes_in = self.headers.get('Content-Length') if self.headers else None
+        if bytes_in and bytes_in.isdigit():
+            HTTP_BYTES_IN.inc(int(bytes_in), (route,))
+        if self._bytes_out:
+            HTTP_BYTES_OUT.inc(self._bytes_out, (route,))
+
+    @classmethod
+    def component_stats(cls, name):
+        """Stats of a shared component, or None while it is not loaded yet"""
+        component = cls.__dict__[name]
+        return None if isinstance(component, LazyComponent) else component.stats()
+
+    @classmethod
+    def warm_up(cls):
+        """Load what the first pipeline and page requests need"""
+        steps = [(module, lambda module=module: importlib.import_module(module)) for module in WARMUP_MODULES]
+        steps += [(name, lambda name=name: getattr(cls, name))
+                  for name in ('audio_cache', 'crop_tracks', 'video_index', 'clip_finder')]
+        steps += [
+            ('static_assets', cls.get_static_assets),
+            ('mimetypes', mimetypes.init),
+            ('token_validator', lambda: cls.token_validator.session),
+        ]
+        cls.startup.run(steps)
+
+    @classmethod
+    def get_static_assets(cls):
+        if cls.static_assets is None:
+            with cls._static_assets_lock:
+                if cls.static_assets is None:
+                    cls.static_assets = build_page_assets(cls.get_main_html(), cls.get_main_css(),
+                                                          cls.get_main_js())
+        return cls.static_assets
+
     def do_GET(self):
-        if self.path == '/' or self.path == '/index.html':
-            self.serve_main_page()
+        asset = self.get_static_assets().get(urllib.parse.urlsplit(self.path).path)
+        if asset is not None:
+            self.serve_static_asset(asset)
         elif self.path == '/api/status':
             self.serve_status()
+        elif self.path == '/metrics':
+            self.serve_metrics()
+        elif self.path == '/api/traces' or self.path.startswith('/api/traces/'):
+            self.serve_traces()
         elif self.path.startswith('/uploads/'):
             self.serve_uploaded_file()
+        elif self.path.startswith('/api/upload/'):
+            self.serve_chunked_upload_status()
+        elif self.path.startswith('/api/uploads/'):
+            self.serve_video_index()
+        elif self.path.startswith('/api/jobs/') and urllib.parse.urlsplit(self.path).path.endswith('/events'):
+            self.serve_job_events()
+        elif self.path == '/api/jobs' or self.path.startswith('/api/jobs/'):
+            self.serve_jobs()
         elif self.path.startswith('/api/'):
             self.serve_api()
         else:
             super().do_GET()
 
+    def do_HEAD(self):
+        asset = self.get_static_assets().get(urllib.parse.urlsplit(self.path).path)
+        if asset is not None:
+            self.serve_static_asset(asset, head_only=True)
+        elif self.path.startswith('/uploads/'):
+            self.serve_uploaded_file(head_only=True)
+        else:
+            super().do_HEAD()
+
     def do_POST(self):
         if self.path == '/api/upload':
             self.handle_upload()
+        elif self.path == '/api/upload/init':
+            self.handle_chunked_upload_init()
+        elif self.path.startswith('/api/upload/') and self.path.endswith('/complete'):
+            self.handle_chunked_upload_complete()
         elif self.path == '/api/validate_token':
             self.handle_token_validation()
         elif self.path == '/api/transcribe':
@@ -47,47 +432,217 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             self.handle_find_clips()
         elif self.path == '/api/process':
             self.handle_process()
+        elif self.path == '/api/process_batch':
+            self.handle_process_batch()
+        elif self.path.startswith('/api/jobs/') and self.path.endswith('/cancel'):
+            self.handle_job_cancel()
         else:
             self.send_error(404, "API endpoint not found")
 
-    def serve_main_page(self):
-        html = self.get_main_html()
+    def do_PUT(self):
+        if self.path.startswith('/api/upload/'):
+            self.handle_chunked_upload_chunk()
+        else:
+            self.send_error(404, "API endpoint not found")
+
+    def do_DELETE(self):
+        if self.path.startswith('/api/upload/'):
+            self.handle_chunked_upload_abort()
+        elif self.path.startswith('/api/jobs/'):
+            self.handle_job_cancel()
+        else:
+            self.send_error(404, "API endpoint not found")
+
+    def serve_static_asset(self, asset, head_only=False):
+        # Prebuilt page/CSS/JS: pick a precompressed variant and honour revalidation
+        encoding = asset.choose_encoding(self.headers.get('Accept-Encoding'))
+        etag = asset.etag(encoding)
+        if self.is_not_modified(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', asset.cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = asset.variants[encoding]
         self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.send_header('Content-length', str(len(html)))
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('Content-length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', asset.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
         self.end_headers()
-        self.wfile.write(html.encode())
+        if not head_only:
+            self.wfile.write(body)
 
     def serve_status(self):
         status = {
             "status": "running",
             "version": "2.0.0",
-            "features": ["upload", "transcribe", "clip_finding", "processing", "token_validation"],
-            "uptime": time.time(),
-            "upload_dir": ClipsAIHandler.upload_dir
+            "features": ["upload", "transcribe", "clip_finding", "processing", "token_validation", "thumbnails"],
+            "started": START_TIME,
+            "uptime": round(time.time() - START_TIME, 3),
+            "pid": os.getpid(),
+            "worker": prefork.worker_index() if prefork.is_worker() else None,
+            "upload_dir": ClipsAIHandler.upload_dir,
+            "storage": ClipsAIHandler.storage.stats(),
+            "transcript_cache": ClipsAIHandler.transcript_cache.stats(),
+            "models": ClipsAIHandler.models.stats(),
+            "audio_cache": ClipsAIHandler.component_stats('audio_cache'),
+            "crop_tracks": ClipsAIHandler.component_stats('crop_tracks'),
+            "video_index": ClipsAIHandler.component_stats('video_index'),
+            "clip_finder": ClipsAIHandler.component_stats('clip_finder'),
+            "token_cache": ClipsAIHandler.token_validator.stats(),
+            "startup": ClipsAIHandler.startup.to_dict()
         }
         self.send_json_response(status)
 
-    def serve_uploaded_file(self):
-        # Serve uploaded files
-        file_path = self.path.replace('/uploads/', '')
-        full_path = os.path.join(ClipsAIHandler.upload_dir, file_path)
-        
-        if os.path.exists(full_path) and os.path.isfile(full_path):
-            mime_type, _ = mimetypes.guess_type(full_path)
-            if mime_type is None:
-                mime_type = 'application/octet-stream'
-            
-            with open(full_path, 'rb') as f:
-                content = f.read()
-            
+    def serve_metrics(self):
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_traces(self):
+        # /api/traces: recent traces; /api/traces/<id>: Chrome trace JSON; .../profile: cProfile text
+        parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+        if len(parts) == 2:
+            self.send_json_response({"success": True, "traces": profiling.TRACES.list()})
+            return
+        trace = profiling.TRACES.get(parts[2])
+        if trace is None:
+            self.send_json_response({"success": False, "error": "Trace not found"}, 404)
+        elif len(parts) == 3:
+            body = json.dumps(trace.to_chrome()).encode()
             self.send_response(200)
-            self.send_header('Content-type', mime_type)
-            self.send_header('Content-length', str(len(content)))
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Disposition', f'attachment; filename="trace-{trace.id}.json"')
+            self.send_header('Content-length', str(len(body)))
             self.end_headers()
-            self.wfile.write(content)
+            self.wfile.write(body)
+        elif parts[3:] == ['profile'] and trace.profile_text is not None:
+            body = trace.profile_text.encode()
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Content-length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
         else:
+            self.send_json_response({"success": False, "error": "No cProfile output for this trace"}, 404)
+
+    def serve_uploaded_file(self, head_only=False):
+        # Serve uploaded files, streamed with Range and conditional request support
+        file_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path[len('/uploads/'):])
+        upload_root = os.path.realpath(ClipsAIHandler.upload_dir)
+        full_path = os.path.realpath(os.path.join(upload_root, file_path))
+        
+        name = os.path.relpath(full_path, upload_root).replace(os.sep, '/')
+        if (os.path.commonpath([upload_root, full_path]) != upload_root or not is_served_upload(name)
+                or not os.path.isfile(full_path)):
             self.send_error(404, "File not found")
+            return
+        ClipsAIHandler.storage.touch(StorageManager.key_for(name))
+
+        mime_type, _ = mimetypes.guess_type(full_path)
+        if mime_type is None:
+            mime_type = 'application/octet-stream'
+
+        with open(full_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+            last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+            if self.is_not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                return
+
+            byte_range = None
+            if_range = self.headers.get('If-Range')
+            if if_range is None or if_range.strip() in (etag, last_modified):
+                try:
+                    byte_range = parse_byte_range(self.headers.get('Range'), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-length', '0')
+                    self.end_headers()
+                    return
+
+            if byte_range is None:
+                start, end = 0, size - 1
+                self.send_response(200)
+            else:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            length = end - start + 1 if size else 0
+
+            self.send_header('Content-type', mime_type)
+            self.send_header('Content-length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+
+            if not head_only and length:
+                try:
+                    self.copy_file_range(f, start, length)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client went away, e.g. the video element seeked elsewhere
+                    self.close_connection = True
+
+    def is_not_modified(self, etag, mtime=None):
+        """Evaluate If-None-Match / If-Modified-Since for a GET or HEAD"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and mtime is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def copy_file_range(self, f, offset, length):
+        """Send ``length`` bytes of ``f`` from ``offset`` without buffering the file"""
+        with profiling.span('send_file', bytes=length):
+            self._copy_file_range(f, offset, length)
+
+    def _copy_file_range(self, f, offset, length):
+        self.wfile.flush()
+        if hasattr(os, 'sendfile'):
+            try:
+                out_fd = self.connection.fileno()
+                while length > 0:
+                    sent = os.sendfile(out_fd, f.fileno(), offset, min(length, 1 << 30))
+                    if sent == 0:
+                        break
+                    offset += sent
+                    length -= sent
+                return
+            except OSError as e:
+                if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                    raise
+                # Socket type not supported by sendfile; fall back to chunked copy
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            length -= len(chunk)
 
     def serve_api(self):
         self.send_json_response({"message": "ClipsAI API is running", "version": "2.0.0"})
@@ -100,49 +655,285 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_json_response({"success": False, "error": "Expected multipart/form-data"}, 400)
                 return
 
-            # Parse the form data
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST'}
-            )
-
-            # Get the uploaded file
-            if 'file' not in form:
-                self.send_json_response({"success": False, "error": "No file uploaded"}, 400)
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                self.send_json_response({"success": False, "error": "Content-Length required"}, 411)
                 return
+            content_length = int(content_length)
+            # The multipart framing adds a little to the file size; reject obvious oversize bodies unread
+            if content_length > MAX_UPLOAD_SIZE + 64 * 1024:
+                self.close_connection = True
+                self.send_json_response({"success": False, "error": str(UploadTooLarge(MAX_UPLOAD_SIZE))}, 413)
+                return
+
+            # The first file part is written to the path the reservation covers
+            incoming = [ClipsAIHandler.upload_store.incoming_path()]
+
+            def open_file(field_name, original_name, file_content_type):
+                return incoming.pop() if incoming else ClipsAIHandler.upload_store.incoming_path()
+
+            # Room for the body is made (or refused) before any of it is read
+            with ClipsAIHandler.storage.reserve(content_length, incoming[0]):
+                # Stream the body; the file part is written to its final path in one pass
+                parser = MultipartParser(self.rfile, content_type, content_length, open_file,
+                                         max_file_size=MAX_UPLOAD_SIZE, file_fields=('file',))
+                try:
+                    with profiling.span('parse_multipart', bytes=content_length):
+                        fields, files = parser.parse()
+                except UploadTooLarge as e:
+                    self.close_connection = True
+                    self.send_json_response({"success": False, "error": str(e)}, 413)
+                    return
+                except MultipartError as e:
+                    self.close_connection = True
+                    self.send_json_response({"success": False, "error": str(e)}, 400)
+                    return
+
+                # Get the uploaded file
+                if 'file' not in files:
+                    self.send_json_response({"success": False, "error": "No file uploaded"}, 400)
+                    return
 
-            file_item = form['file']
-            if not file_item.filename:
-                self.send_json_response({"success": False, "error": "No file selected"}, 400)
+                file_item = files['file']
+                record, duplicate = ClipsAIHandler.upload_store.add(file_item.path, file_item.sha256,
+                                                                    file_item.filename, file_item.size)
+            self.send_json_response(self.upload_response(record, file_item.filename, duplicate))
+
+        except StorageFull as e:
+            self.close_connection = True
+            self.send_json_response({"success": False, "error": str(e)}, 507)
+        except Exception as e:
+            print(f"❌ Upload error: {e}")
+            self.send_json_response({"success": False, "error": str(e)}, 500)
+
+    def upload_response(self, record, original_name, duplicate):
+        filename = record['filename']
+        ClipsAIHandler.storage.touch(record['sha256'])
+        ClipsAIHandler.storage.refresh(record['sha256'])
+        if duplicate:
+            print(f"♻️  Duplicate upload: {original_name} -> {filename}")
+        else:
+            print(f"✅ File uploaded: {filename} ({record['size']} bytes)")
+        return {
+            "success": True,
+            "file_id": record['sha256'],
+            "filename": filename,
+            "original_name": original_name,
+            "size": record['size'],
+            "sha256": record['sha256'],
+            "path": ClipsAIHandler.upload_store.blob_path(record),
+            "url": f"/uploads/{urllib.parse.quote(filename)}",
+            "duplicate": duplicate,
+            "artifacts": {**record['artifacts'], **ClipsAIHandler.transcript_cache.entries_for(record['sha256'])},
+            "index_job_id": self.start_indexing(record['sha256']),
+            "message": "File already uploaded" if duplicate else "File uploaded successfully"
+        }
+
+    @staticmethod
+    def start_indexing(file_id):
+        # Index a new upload in the background; returns the job id, or None if there is nothing to do.
+        # Files that do not look like video are indexed on demand, when first requested.
+        from video_index import looks_like_video
+        index = ClipsAIHandler.video_index
+        record = ClipsAIHandler.upload_store.get(file_id)
+        if not shutil.which('ffmpeg') or record is None or index.is_indexed(file_id) or \
+                not looks_like_video(ClipsAIHandler.upload_store.blob_path(record)):
+            return None
+        try:
+            return ClipsAIHandler.index_job(file_id).id
+        except QueueFull:
+            # Indexed on demand when its keyframes or thumbnails are first requested
+            return None
+
+    @classmethod
+    def index_job(cls, file_id):
+        """The job indexing an upload; a new one unless one is under way or has failed"""
+        with cls._index_jobs_lock:
+            job = cls.jobs.get(cls._index_jobs.get(file_id))
+            if job is None or job.state in ('succeeded', 'cancelled'):
+                fn, args = cls.job_call('index', {"file_id": file_id})
+                job = cls.jobs.submit('index', fn, *args, params={"file_id": file_id})
+                cls._index_jobs[file_id] = job.id
+            return job
+
+    def serve_video_index(self):
+        # /api/uploads/<file_id>/keyframes, /thumbnails or /thumbnails/<sheet>.jpg
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.split('/')[3:]
+        file_id = parts[0]
+        if len(parts) not in (2, 3) or parts[1] not in ('keyframes', 'thumbnails') or \
+                (len(parts) == 3 and (parts[1] != 'thumbnails' or not re.fullmatch(r'\d+\.jpg', parts[2]))):
+            self.send_json_response({"success": False, "error": "Not found"}, 404)
+            return
+        at = urllib.parse.parse_qs(url.query).get('at')
+        try:
+            at = float(at[0]) if at else None
+        except ValueError:
+            self.send_json_response({"success": False, "error": "at must be a time in seconds"}, 400)
+            return
+        try:
+            if not self.require_upload(file_id):
                 return
+            index = ClipsAIHandler.video_index
+            if len(parts) == 3:
+                self.serve_sprite_sheet(index.sheet_path(file_id, parts[2][:-4]))
+                return
+            if not index.is_indexed(file_id):
+                if not shutil.which('ffmpeg'):
+                    self.send_json_response({"success": False, "error": "ffmpeg is required to index videos"}, 503)
+                    return
+                job = ClipsAIHandler.index_job(file_id)
+                if job.state == 'failed':
+                    self.send_json_response({"success": False, "job_id": job.id,
+                                             "error": f"Could not index this upload: {job.to_dict()['error']}"}, 422)
+                    return
+                # Not indexed yet: follow the indexing job, then ask again
+                self.send_job_response(job)
+                return
+            if parts[1] == 'keyframes':
+                self.send_json_response(self.keyframes_response(file_id, index.keyframes(file_id), at))
+                return
+            manifest = index.thumbnails(file_id)
+            sheets = [f"/api/uploads/{file_id}/thumbnails/{number}.jpg" for number in range(manifest['sheets'])]
+            self.send_json_response({"success": True, "file_id": file_id, **manifest, "sheets": sheets})
+        except QueueFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 503)
+        except Exception as e:
+            self.send_json_response({"success": False, "error": str(e)}, 500)
 
-            # Save the file
-            filename = f"{int(time.time())}_{file_item.filename}"
-            file_path = os.path.join(ClipsAIHandler.upload_dir, filename)
-            
-            with open(file_path, 'wb') as f:
-                shutil.copyfileobj(file_item.file, f)
+    @staticmethod
+    def keyframes_response(file_id, info, at=None):
+        from video_index import nearest_keyframe
+        fields = ('time', 'decode_time', 'offset')
+        response = {
+            "success": True,
+            "file_id": file_id,
+            "duration": info['duration'],
+            "width": info['width'],
+            "height": info['height'],
+            "video_codec": info['video_codec'],
+            "byte_offsets": info['byte_offsets'],
+            "keyframes": [dict(zip(fields, keyframe)) for keyframe in info['keyframes']],
+        }
+        if at is not None:
+            # The keyframe to seek to for a position: the last one at or before it
+            keyframe = nearest_keyframe(info, at)
+            response["keyframe"] = dict(zip(fields, keyframe)) if keyframe else None
+        return response
 
-            file_size = os.path.getsize(file_path)
-            
-            print(f"✅ File uploaded: {filename} ({file_size} bytes)")
+    def serve_sprite_sheet(self, path):
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                body = f.read()
+        except FileNotFoundError:
+            self.send_json_response({"success": False, "error": "Not found"}, 404)
+            return
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if self.is_not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'image/jpeg')
+        self.send_header('Content-length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        self.end_headers()
+        self.wfile.write(body)
 
-            response = {
-                "success": True,
-                "filename": filename,
-                "original_name": file_item.filename,
-                "size": file_size,
-                "path": file_path,
-                "url": f"/uploads/{filename}",
-                "message": "File uploaded successfully"
-            }
-            self.send_json_response(response)
+    def chunked_upload_id(self):
+        # /api/upload/<upload_id>[/<index>|/complete]
+        parts = urllib.parse.urlsplit(self.path).path.split('/')
+        return parts[3], parts[4:]
+
+    def handle_chunked_upload_init(self):
+        try:
+            data = self.read_json_body()
+            upload_id = data.get('upload_id')
+            filename = clean_filename(data.get('filename') or '')
+            known = ClipsAIHandler.upload_store.add_name(data.get('sha256'), filename, data.get('size'))
+            if known is not None:
+                # Content already stored: skip the transfer entirely
+                if upload_id:
+                    ClipsAIHandler.chunked_uploads.abort(upload_id)
+                    ClipsAIHandler.storage.index_files([ClipsAIHandler.chunked_uploads.part_path(upload_id)])
+                self.send_json_response(self.upload_response(known, filename or known['names'][0], True))
+                return
+            if upload_id:
+                # Resuming: report which chunks the server already has
+                upload = ClipsAIHandler.chunked_uploads.get(upload_id)
+            else:
+                size = int(data.get('size', -1))
+                # The staged file is preallocated at its full size
+                with ClipsAIHandler.storage.reserve(max(size, 0)):
+                    upload = ClipsAIHandler.chunked_uploads.init(filename, size, data.get('chunk_size'))
+                    ClipsAIHandler.storage.index_files(
+                        [ClipsAIHandler.chunked_uploads.part_path(upload.upload_id)])
+            self.send_json_response({"success": True, **upload.to_dict()})
+        except ChunkedUploadError as e:
+            self.send_json_response({"success": False, "error": str(e)}, e.status)
+        except StorageFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 507)
+        except Exception as e:
+            self.send_json_response({"success": False, "error": str(e)}, 500)
+
+    def serve_chunked_upload_status(self):
+        try:
+            upload_id, _ = self.chunked_upload_id()
+            upload = ClipsAIHandler.chunked_uploads.get(upload_id)
+            self.send_json_response({"success": True, **upload.to_dict(), "missing": upload.missing()})
+        except ChunkedUploadError as e:
+            self.send_json_response({"success": False, "error": str(e)}, e.status)
+
+    def handle_chunked_upload_chunk(self):
+        try:
+            upload_id, rest = self.chunked_upload_id()
+            if len(rest) != 1 or not rest[0].isdigit():
+                self.send_json_response({"success": False, "error": "Expected /api/upload/<id>/<index>"}, 404)
+                return
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                self.send_json_response({"success": False, "error": "Content-Length required"}, 411)
+                return
+            with profiling.span('write_chunk', bytes=int(content_length)):
+                upload = ClipsAIHandler.chunked_uploads.write_chunk(
+                    upload_id, int(rest[0]), self.rfile, int(content_length),
+                    self.headers.get('X-Chunk-SHA256'))
+            self.send_json_response({"success": True, "index": int(rest[0]),
+                                     "received": len(upload.received), "total_chunks": upload.total_chunks})
+        except ChunkedUploadError as e:
+            self.close_connection = True
+            self.send_json_response({"success": False, "error": str(e)}, e.status)
+        except Exception as e:
+            self.close_connection = True
+            self.send_json_response({"success": False, "error": str(e)}, 500)
 
+    def handle_chunked_upload_complete(self):
+        try:
+            upload_id, _ = self.chunked_upload_id()
+            upload = ClipsAIHandler.chunked_uploads.get(upload_id)
+            file_path = ClipsAIHandler.upload_store.incoming_path()
+            size, sha256 = ClipsAIHandler.chunked_uploads.complete(upload_id, file_path)
+            ClipsAIHandler.storage.index_files([ClipsAIHandler.chunked_uploads.part_path(upload_id)])
+            record, duplicate = ClipsAIHandler.upload_store.add(file_path, sha256, upload.filename, size)
+            self.send_json_response(self.upload_response(record, upload.filename, duplicate))
+        except ChunkedUploadError as e:
+            self.send_json_response({"success": False, "error": str(e)}, e.status)
         except Exception as e:
             print(f"❌ Upload error: {e}")
             self.send_json_response({"success": False, "error": str(e)}, 500)
 
+    def handle_chunked_upload_abort(self):
+        try:
+            upload_id, _ = self.chunked_upload_id()
+            ClipsAIHandler.chunked_uploads.abort(upload_id)
+            ClipsAIHandler.storage.index_files([ClipsAIHandler.chunked_uploads.part_path(upload_id)])
+            self.send_json_response({"success": True, "upload_id": upload_id})
+        except ChunkedUploadError as e:
+            self.send_json_response({"success": False, "error": str(e)}, e.status)
+
     def handle_token_validation(self):
         try:
             content_length = int(self.headers['Content-Length'])
@@ -159,132 +950,293 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                 })
                 return
             
-            # Validate token by trying to access Pyannote model
-            try:
-                headers = {'Authorization': f'Bearer {token}'}
-                response = requests.get(
-                    'https://huggingface.co/api/models/pyannote/speaker-diarization-3.0',
-                    headers=headers,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    self.send_json_response({
-                        "success": True,
-                        "valid": True,
-                        "message": "Token is valid and has access to Pyannote models"
-                    })
-                elif response.status_code == 401:
-                    self.send_json_response({
-                        "success": False,
-                        "valid": False,
-                        "error": "Invalid token or token doesn't have required permissions"
-                    })
-                elif response.status_code == 403:
-                    self.send_json_response({
-                        "success": False,
-                        "valid": False,
-                        "error": "Token is valid but you need to accept the Pyannote license first",
-                        "license_url": "https://huggingface.co/pyannote/speaker-diarization-3.0"
-                    })
-                else:
-                    self.send_json_response({
-                        "success": False,
-                        "valid": False,
-                        "error": f"Unexpected response from Hugging Face API: {response.status_code}"
-                    })
-                    
-            except requests.exceptions.RequestException as e:
-                self.send_json_response({
-                    "success": False,
-                    "valid": False,
-                    "error": f"Network error: {str(e)}"
-                })
+            # Validate token by trying to access Pyannote model (cached per token hash)
+            self.send_json_response(ClipsAIHandler.token_validator.validate(token))
                 
         except Exception as e:
             self.send_json_response({"success": False, "error": str(e)}, 500)
 
     def handle_transcribe(self):
         try:
-            # Simulate transcription processing
-            time.sleep(2)  # Simulate processing time
-            
-            response = {
-                "success": True,
-                "transcript": "This is a sample transcription of the uploaded video. In a real implementation, this would be generated using WhisperX with the selected model size.",
-                "language": "en",
-                "duration": 85.7,
-                "word_count": 234,
-                "confidence": 0.94
-            }
-            self.send_json_response(response)
+            data = self.read_json_body()
+            file_id = data.get('file_id')
+            if not self.require_upload(file_id):
+                return
+            model_size = data.get('model_size', 'base')
+            language = data.get('language') or None
+            mode = data.get('mode', 'auto')
+            if mode not in ('auto', 'single', 'parallel'):
+                self.send_json_response({"success": False, "error": f"Unknown mode: {mode}"}, 400)
+                return
+            cached = ClipsAIHandler.transcript_cache.get(file_id, model_size, language)
+            if cached:
+                # This recording was already transcribed with this model and language
+                job = ClipsAIHandler.jobs.completed('transcribe', cached)
+            else:
+                job = self.submit_job('transcribe', {"file_id": file_id, "model_size": model_size,
+                                                     "language": language, "mode": mode})
+            self.send_job_response(job)
+        except QueueFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 503)
         except Exception as e:
             self.send_json_response({"success": False, "error": str(e)}, 500)
 
     def handle_find_clips(self):
         try:
-            # Simulate clip finding
-            time.sleep(1.5)
-            
-            clips = [
-                {"id": 1, "topic": "Introduction", "start": 0.0, "end": 15.0, "duration": 15.0, "score": 0.95},
-                {"id": 2, "topic": "Main Content", "start": 15.0, "end": 45.0, "duration": 30.0, "score": 0.92},
-                {"id": 3, "topic": "Key Point", "start": 45.0, "end": 60.0, "duration": 15.0, "score": 0.88},
-                {"id": 4, "topic": "Conclusion", "start": 60.0, "end": 85.0, "duration": 25.0, "score": 0.85}
-            ]
-            
-            response = {
-                "success": True,
-                "clips": clips,
-                "total_clips": len(clips),
-                "message": f"Found {len(clips)} potential clips"
-            }
-            self.send_json_response(response)
+            import pipeline
+            data = self.read_json_body()
+            file_id = data.get('file_id')
+            if not self.require_upload(file_id):
+                return
+            model_size = data.get('model_size')
+            language = data.get('language') or None
+            try:
+                min_duration = float(data.get('min_duration', 15))
+                max_duration = float(data.get('max_duration', 120))
+            except (TypeError, ValueError):
+                self.send_json_response({"success": False, "error": "Invalid duration range"}, 400)
+                return
+            if not 0 <= min_duration <= max_duration:
+                self.send_json_response({"success": False, "error": "Invalid duration range"}, 400)
+                return
+
+            transcript = ClipsAIHandler.find_transcript(file_id, model_size, language)
+            if transcript is None:
+                self.send_json_response({"success": False, "error": "Transcribe the video first"}, 409)
+                return
+
+            key = (file_id, transcript['model_size'], transcript['language'])
+            analysis = ClipsAIHandler.clip_finder.cached(key)
+            if analysis is not None:
+                # Only the duration range changed: reselect without re-embedding
+                job = ClipsAIHandler.jobs.completed('find_clips', pipeline.clips_result(
+                    ClipsAIHandler.upload_store, file_id, analysis, min_duration, max_duration))
+            else:
+                job = self.submit_job('find_clips', {"file_id": file_id, "model_size": model_size,
+                                                     "language": language, "min_duration": min_duration,
+                                                     "max_duration": max_duration}, transcript)
+            self.send_job_response(job)
+        except QueueFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 503)
         except Exception as e:
             self.send_json_response({"success": False, "error": str(e)}, 500)
 
     def handle_process(self):
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(post_data)
-            
+            from crop_tracks import parse_aspect_ratio
+            data = self.read_json_body()
+            aspect_ratio = data.get('aspect_ratio', '9:16')
+            try:
+                if data.get('operation') == 'trim_and_resize':
+                    parse_aspect_ratio(aspect_ratio)
+            except ValueError as e:
+                self.send_json_response({"success": False, "error": str(e)}, 400)
+                return
+            file_id = data.get('file_id')
+            if not self.require_upload(file_id):
+                return
+            job = self.submit_job('process', {"file_id": file_id, "operation": data.get('operation', 'trim'),
+                                              "clip_id": data.get('clip_id', 1), "aspect_ratio": aspect_ratio})
+            self.send_job_response(job)
+        except QueueFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 503)
+        except Exception as e:
+            self.send_json_response({"success": False, "error": str(e)}, 500)
+
+    def handle_process_batch(self):
+        try:
+            import batch_processing
+            from crop_tracks import parse_aspect_ratio
+            data = self.read_json_body()
+            file_id = data.get('file_id')
             operation = data.get('operation', 'trim')
-            clip_id = data.get('clip_id', 1)
-            
-            # Simulate processing time
-            if operation == 'trim_and_resize':
-                time.sleep(4)
-                message = "Video trimmed and resized successfully"
-                duration = 25.0
-            else:
-                time.sleep(2)
-                message = "Video trimmed successfully"
-                duration = 30.0
-            
-            response = {
-                "success": True,
-                "operation": operation,
-                "clip_id": clip_id,
-                "duration": duration,
-                "output_file": f"processed_clip_{clip_id}_{int(time.time())}.mp4",
-                "size": 2100000,  # 2.1 MB
-                "message": message
-            }
-            self.send_json_response(response)
+            if operation not in batch_processing.OPERATIONS:
+                self.send_json_response({"success": False, "error": f"Unknown operation: {operation}"}, 400)
+                return
+            record = self.require_upload(file_id)
+            if record is None:
+                return
+            items = data.get('clips') or []
+            if not items:
+                self.send_json_response({"success": False, "error": "No clips given"}, 400)
+                return
+            known_clips = (record['artifacts'].get('clips') or {}).get('clips', [])
+            try:
+                clips = batch_processing.resolve_clips(items, known_clips)
+                if 'trim_and_resize' in [operation] + [clip['operation'] for clip in clips]:
+                    parse_aspect_ratio(data.get('aspect_ratio', '9:16'))
+            except (TypeError, ValueError) as e:
+                self.send_json_response({"success": False, "error": str(e)}, 400)
+                return
+
+            job = self.submit_job('process_batch', {"file_id": file_id, "clips": clips, "operation": operation,
+                                                    "aspect_ratio": data.get('aspect_ratio', '9:16')})
+            self.send_job_response(job)
+        except QueueFull as e:
+            self.send_json_response({"success": False, "error": str(e)}, 503)
         except Exception as e:
             self.send_json_response({"success": False, "error": str(e)}, 500)
 
+    def require_upload(self, file_id):
+        """The stored upload ``file_id`` names, marked as used; sends 404 and returns None if there is none"""
+        record = ClipsAIHandler.upload_store.get(file_id)
+        if record is None:
+            self.send_json_response({"success": False, "error": "Unknown file_id"}, 404)
+            return None
+        ClipsAIHandler.storage.touch(file_id)
+        return record
+
+    @classmethod
+    def find_transcript(cls, file_id, model_size, language):
+        """The cached transcript for a clip search: of ``model_size`` if given, else any"""
+        if model_size:
+            return cls.transcript_cache.get(file_id, model_size, language)
+        for entry in cls.transcript_cache.entries_for(file_id).values():
+            transcript = cls.transcript_cache.get(file_id, entry['model_size'], entry['language'])
+            if transcript is not None:
+                return transcript
+        return None
+
+    @classmethod
+    def job_call(cls, kind, params, transcript=None):
+        """``(fn, args)`` of a pipeline job from its stored parameters, or None if it can no longer run.
+
+        Used to submit jobs and to resume interrupted ones (see JobManager.recover).
+        """
+        import pipeline
+        file_id = params['file_id']
+        processed_dir = os.path.join(cls.upload_dir, 'processed')
+        if kind == 'transcribe':
+            fn, args = pipeline.transcribe, (cls.upload_store, cls.transcript_cache, cls.models, cls.audio_cache,
+                                             file_id, params['model_size'], params['language'], params['mode'])
+        elif kind == 'find_clips':
+            transcript = transcript or cls.find_transcript(file_id, params['model_size'], params['language'])
+            if transcript is None:
+                return None
+            key = (file_id, transcript['model_size'], transcript['language'])
+            fn, args = pipeline.find_clips, (cls.upload_store, cls.clip_finder, file_id, key, transcript['words'],
+                                             params['min_duration'], params['max_duration'])
+        elif kind == 'process':
+            fn, args = pipeline.process, (cls.upload_store, cls.crop_tracks, cls.video_index, processed_dir,
+                                          file_id, params['operation'], params['clip_id'], params['aspect_ratio'])
+        elif kind == 'process_batch':
+            import batch_processing
+            fn, args = batch_processing.run_batch, (cls.upload_store, cls.crop_tracks, cls.video_index,
+                                                    processed_dir, file_id, params['clips'], params['operation'],
+                                                    params['aspect_ratio'])
+        elif kind == 'index':
+            fn, args = pipeline.index_upload, (cls.video_index, file_id)
+        else:
+            return None
+        return cls.storage.using(file_id, fn), args
+
+    def submit_job(self, kind, params, transcript=None):
+        fn, args = ClipsAIHandler.job_call(kind, params, transcript)
+        return ClipsAIHandler.jobs.submit(kind, fn, *args, params=params)
+
+    def send_job_response(self, job):
+        # 202 Accepted: the work continues in the background
+        self.send_json_response({
+            "success": True,
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}",
+            "job": job.to_dict()
+        }, 202)
+
+    def job_id_from_path(self):
+        # /api/jobs/<job_id>[/cancel]
+        parts = urllib.parse.urlsplit(self.path).path.split('/')
+        return parts[3] if len(parts) > 3 else None
+
+    def serve_jobs(self):
+        job_id = self.job_id_from_path()
+        if not job_id:
+            jobs = sorted(ClipsAIHandler.jobs.list(), key=lambda j: j.created, reverse=True)
+            self.send_json_response({
+                "success": True,
+                "queue_depth": ClipsAIHandler.jobs.queue_depth(),
+                "jobs": [{k: v for k, v in job.to_dict().items() if k != 'result'} for job in jobs]
+            })
+            return
+        job = ClipsAIHandler.jobs.get(job_id)
+        if job is None:
+            self.send_json_response({"success": False, "error": "Job not found"}, 404)
+            return
+        self.send_json_response({"success": True, **job.to_dict()})
+
+    def serve_job_events(self):
+        # Server-Sent Events: push stage/progress changes until the job finishes
+        job = ClipsAIHandler.jobs.get(self.job_id_from_path())
+        if job is None:
+            self.send_json_response({"success": False, "error": "Job not found"}, 404)
+            return
+        if not self.server.event_streams.acquire(blocking=False):
+            # Every stream slot is taken: the client follows the job by polling instead
+            self.send_json_response({"success": False, "error": "Too many open job event streams, poll status_url",
+                                     "status_url": f"/api/jobs/{job.id}"}, 503)
+            return
+        try:
+            self.stream_job_events(job)
+        finally:
+            self.server.event_streams.release()
+
+    def stream_job_events(self, job):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+
+        seen_version = None
+        sent_partials = 0
+        try:
+            self.wfile.write(b'retry: 2000\n\n')
+            while True:
+                if job.version != seen_version:
+                    # Partial results are sent once each, in the order they were published
+                    for partial in job.partials[sent_partials:]:
+                        self.wfile.write(f"event: partial\ndata: {json.dumps(partial)}\n\n".encode())
+                        sent_partials += 1
+                    # Send the latest snapshot; intermediate updates are coalesced
+                    finished = job.finished_state
+                    snapshot = job.to_dict(include_result=finished)
+                    seen_version = snapshot['version']
+                    event = 'done' if finished else 'progress'
+                    self.wfile.write(f"id: {seen_version}\nevent: {event}\ndata: {json.dumps(snapshot)}\n\n".encode())
+                    if finished:
+                        return
+                elif job.wait_for_change(seen_version, SSE_KEEPALIVE) == seen_version:
+                    self.wfile.write(b': keep-alive\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client closed the page
+            pass
+
+    def handle_job_cancel(self):
+        job = ClipsAIHandler.jobs.cancel(self.job_id_from_path())
+        if job is None:
+            self.send_json_response({"success": False, "error": "Job not found"}, 404)
+            return
+        self.send_json_response({"success": True, **job.to_dict()})
+
+    def read_json_body(self):
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if not content_length:
+            return {}
+        with profiling.span('read_body', bytes=content_length):
+            return json.loads(self.rfile.read(content_length).decode('utf-8'))
+
     def send_json_response(self, data, status=200):
-        json_data = json.dumps(data, indent=2)
+        json_data = json.dumps(data, indent=2).encode()
         self.send_response(status)
         self.send_header('Content-type', 'application/json')
         self.send_header('Content-length', str(len(json_data)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json_data.encode())
+        self.wfile.write(json_data)
 
-    def get_main_html(self):
+    @staticmethod
+    def get_main_html():
         return """
 <!DOCTYPE html>
 <html lang="en">
@@ -292,52 +1244,7 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>🎬 ClipsAI Web Interface - Enhanced</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; background: #0f1419; color: #fff; }
-        .container { max-width: 1400px; margin: 0 auto; padding: 20px; }
-        .header { text-align: center; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 40px 20px; border-radius: 15px; margin-bottom: 30px; box-shadow: 0 10px 30px rgba(0,0,0,0.3); }
-        .header h1 { font-size: 2.5em; margin-bottom: 10px; text-shadow: 2px 2px 4px rgba(0,0,0,0.3); }
-        .header p { font-size: 1.2em; opacity: 0.9; }
-        .enhanced-badge { background: linear-gradient(45deg, #4ecdc4, #44a08d); padding: 8px 16px; border-radius: 20px; font-size: 0.9em; margin-top: 10px; display: inline-block; }
-        .main-grid { display: grid; grid-template-columns: 350px 1fr; gap: 30px; }
-        .sidebar { background: #1a1a2e; padding: 25px; border-radius: 15px; height: fit-content; box-shadow: 0 5px 15px rgba(0,0,0,0.2); }
-        .main-content { background: #16213e; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.2); }
-        .step { background: #0f3460; margin: 20px 0; padding: 25px; border-radius: 12px; border-left: 4px solid #667eea; transition: all 0.3s ease; }
-        .step:hover { transform: translateY(-2px); box-shadow: 0 8px 25px rgba(0,0,0,0.3); }
-        .step h2 { color: #667eea; margin-bottom: 15px; font-size: 1.3em; }
-        .button { background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 12px 24px; border: none; border-radius: 8px; cursor: pointer; font-size: 16px; margin: 8px 5px; transition: all 0.3s ease; font-weight: 600; }
-        .button:hover { transform: translateY(-2px); box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4); }
-        .button:disabled { background: #555; cursor: not-allowed; transform: none; box-shadow: none; }
-        .secondary { background: linear-gradient(135deg, #4ecdc4, #44a08d); }
-        .secondary:hover { box-shadow: 0 5px 15px rgba(78, 205, 196, 0.4); }
-        .upload-area { border: 2px dashed #667eea; padding: 50px 20px; text-align: center; margin: 20px 0; border-radius: 12px; background: rgba(102, 126, 234, 0.1); transition: all 0.3s ease; cursor: pointer; }
-        .upload-area:hover { border-color: #764ba2; background: rgba(102, 126, 234, 0.2); }
-        .upload-area.dragover { border-color: #4ecdc4; background: rgba(78, 205, 196, 0.2); }
-        .config-section { margin-bottom: 20px; }
-        .config-section label { display: block; margin-bottom: 8px; font-weight: 600; color: #667eea; }
-        .config-section input, .config-section select { width: 100%; padding: 12px; border: 1px solid #333; border-radius: 8px; background: #0f1419; color: #fff; font-size: 14px; }
-        .config-section input:focus, .config-section select:focus { outline: none; border-color: #667eea; box-shadow: 0 0 0 2px rgba(102, 126, 234, 0.2); }
-        .token-status { padding: 8px 12px; border-radius: 6px; margin: 10px 0; font-size: 12px; }
-        .token-status.valid { background: rgba(78, 205, 196, 0.2); border: 1px solid #4ecdc4; color: #4ecdc4; }
-        .token-status.invalid { background: rgba(255, 107, 107, 0.2); border: 1px solid #ff6b6b; color: #ff6b6b; }
-        .token-status.checking { background: rgba(255, 193, 7, 0.2); border: 1px solid #ffc107; color: #ffc107; }
-        .progress { width: 100%; height: 8px; background: #333; border-radius: 4px; overflow: hidden; margin: 15px 0; }
-        .progress-bar { height: 100%; background: linear-gradient(90deg, #667eea, #4ecdc4); width: 0%; transition: width 0.3s ease; }
-        .status { padding: 15px; border-radius: 8px; margin: 15px 0; }
-        .status.success { background: rgba(78, 205, 196, 0.2); border: 1px solid #4ecdc4; color: #4ecdc4; }
-        .status.error { background: rgba(255, 107, 107, 0.2); border: 1px solid #ff6b6b; color: #ff6b6b; }
-        .status.info { background: rgba(102, 126, 234, 0.2); border: 1px solid #667eea; color: #667eea; }
-        table { width: 100%; border-collapse: collapse; margin: 20px 0; background: #0f1419; border-radius: 8px; overflow: hidden; }
-        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #333; }
-        th { background: #1a1a2e; color: #667eea; font-weight: 600; }
-        tr:hover { background: rgba(102, 126, 234, 0.1); }
-        .hidden { display: none; }
-        .loading { display: inline-block; width: 20px; height: 20px; border: 3px solid rgba(255,255,255,.3); border-radius: 50%; border-top-color: #667eea; animation: spin 1s ease-in-out infinite; }
-        @keyframes spin { to { transform: rotate(360deg); } }
-        .file-info { background: rgba(78, 205, 196, 0.1); padding: 15px; border-radius: 8px; margin: 15px 0; }
-        @media (max-width: 768px) { .main-grid { grid-template-columns: 1fr; } }
-    </style>
+    <link rel="stylesheet" href="__CSS_URL__">
 </head>
 <body>
     <div class="container">
@@ -388,6 +1295,11 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                     <input type="range" id="min-duration" min="5" max="60" value="15">
                 </div>
                 
+                <div class="config-section">
+                    <label for="max-duration">⏱️ Max Clip Duration: <span id="max-duration-value">120s</span></label>
+                    <input type="range" id="max-duration" min="60" max="1800" step="30" value="120">
+                </div>
+                
                 <div class="status info">
                     <strong>🔄 Status:</strong> <span id="system-status">Ready</span>
                 </div>
@@ -399,7 +1311,7 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                     <div class="upload-area" id="upload-area">
                         <input type="file" id="file-input" accept="video/*" style="display: none;">
                         <p>🎬 Click or drag to upload video file</p>
-                        <p><small>Supports MP4, AVI, MOV, MKV, FLV, WMV (Max: 100MB)</small></p>
+                        <p><small>Supports MP4, AVI, MOV, MKV, FLV, WMV (interrupted uploads resume automatically)</small></p>
                     </div>
                     <div id="file-info" class="file-info hidden">
                         <p><strong>✅ File uploaded:</strong> <span id="filename"></span></p>
@@ -453,6 +1365,7 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                             <thead>
                                 <tr>
                                     <th>Clip #</th>
+                                    <th>Preview</th>
                                     <th>Topic</th>
                                     <th>Start</th>
                                     <th>End</th>
@@ -473,6 +1386,7 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                     <h2>🎬 Step 4: Process Video</h2>
                     <button class="button secondary" id="trim-btn" onclick="trimOnly()" disabled>✂️ Trim Only</button>
                     <button class="button" id="resize-btn" onclick="trimAndResize()" disabled>📐 Trim + Resize</button>
+                    <button class="button secondary" id="batch-btn" onclick="exportAllClips()" disabled>📦 Export All Clips</button>
                     <div id="processing-progress" class="hidden">
                         <div class="progress">
                             <div class="progress-bar" id="processing-bar"></div>
@@ -497,11 +1411,73 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
         </div>
     </div>
 
-    <script>
+    <script src="__JS_URL__"></script>
+</body>
+</html>
+        """
+
+    @staticmethod
+    def get_main_css():
+        return """
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; background: #0f1419; color: #fff; }
+        .container { max-width: 1400px; margin: 0 auto; padding: 20px; }
+        .header { text-align: center; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 40px 20px; border-radius: 15px; margin-bottom: 30px; box-shadow: 0 10px 30px rgba(0,0,0,0.3); }
+        .header h1 { font-size: 2.5em; margin-bottom: 10px; text-shadow: 2px 2px 4px rgba(0,0,0,0.3); }
+        .header p { font-size: 1.2em; opacity: 0.9; }
+        .enhanced-badge { background: linear-gradient(45deg, #4ecdc4, #44a08d); padding: 8px 16px; border-radius: 20px; font-size: 0.9em; margin-top: 10px; display: inline-block; }
+        .main-grid { display: grid; grid-template-columns: 350px 1fr; gap: 30px; }
+        .sidebar { background: #1a1a2e; padding: 25px; border-radius: 15px; height: fit-content; box-shadow: 0 5px 15px rgba(0,0,0,0.2); }
+        .main-content { background: #16213e; padding: 25px; border-radius: 15px; box-shadow: 0 5px 15px rgba(0,0,0,0.2); }
+        .step { background: #0f3460; margin: 20px 0; padding: 25px; border-radius: 12px; border-left: 4px solid #667eea; transition: all 0.3s ease; }
+        .step:hover { transform: translateY(-2px); box-shadow: 0 8px 25px rgba(0,0,0,0.3); }
+        .step h2 { color: #667eea; margin-bottom: 15px; font-size: 1.3em; }
+        .button { background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 12px 24px; border: none; border-radius: 8px; cursor: pointer; font-size: 16px; margin: 8px 5px; transition: all 0.3s ease; font-weight: 600; }
+        .button:hover { transform: translateY(-2px); box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4); }
+        .button:disabled { background: #555; cursor: not-allowed; transform: none; box-shadow: none; }
+        .secondary { background: linear-gradient(135deg, #4ecdc4, #44a08d); }
+        .secondary:hover { box-shadow: 0 5px 15px rgba(78, 205, 196, 0.4); }
+        .upload-area { border: 2px dashed #667eea; padding: 50px 20px; text-align: center; margin: 20px 0; border-radius: 12px; background: rgba(102, 126, 234, 0.1); transition: all 0.3s ease; cursor: pointer; }
+        .upload-area:hover { border-color: #764ba2; background: rgba(102, 126, 234, 0.2); }
+        .upload-area.dragover { border-color: #4ecdc4; background: rgba(78, 205, 196, 0.2); }
+        .config-section { margin-bottom: 20px; }
+        .config-section label { display: block; margin-bottom: 8px; font-weight: 600; color: #667eea; }
+        .config-section input, .config-section select { width: 100%; padding: 12px; border: 1px solid #333; border-radius: 8px; background: #0f1419; color: #fff; font-size: 14px; }
+        .config-section input:focus, .config-section select:focus { outline: none; border-color: #667eea; box-shadow: 0 0 0 2px rgba(102, 126, 234, 0.2); }
+        .token-status { padding: 8px 12px; border-radius: 6px; margin: 10px 0; font-size: 12px; }
+        .token-status.valid { background: rgba(78, 205, 196, 0.2); border: 1px solid #4ecdc4; color: #4ecdc4; }
+        .token-status.invalid { background: rgba(255, 107, 107, 0.2); border: 1px solid #ff6b6b; color: #ff6b6b; }
+        .token-status.checking { background: rgba(255, 193, 7, 0.2); border: 1px solid #ffc107; color: #ffc107; }
+        .progress { width: 100%; height: 8px; background: #333; border-radius: 4px; overflow: hidden; margin: 15px 0; }
+        .progress-bar { height: 100%; background: linear-gradient(90deg, #667eea, #4ecdc4); width: 0%; transition: width 0.3s ease; }
+        .status { padding: 15px; border-radius: 8px; margin: 15px 0; }
+        .status.success { background: rgba(78, 205, 196, 0.2); border: 1px solid #4ecdc4; color: #4ecdc4; }
+        .status.error { background: rgba(255, 107, 107, 0.2); border: 1px solid #ff6b6b; color: #ff6b6b; }
+        .status.info { background: rgba(102, 126, 234, 0.2); border: 1px solid #667eea; color: #667eea; }
+        table { width: 100%; border-collapse: collapse; margin: 20px 0; background: #0f1419; border-radius: 8px; overflow: hidden; }
+        th, td { padding: 15px; text-align: left; border-bottom: 1px solid #333; }
+        th { background: #1a1a2e; color: #667eea; font-weight: 600; }
+        tr:hover { background: rgba(102, 126, 234, 0.1); }
+        .hidden { display: none; }
+        .thumb { display: inline-block; margin-right: 3px; border-radius: 3px; background-color: #000; background-repeat: no-repeat; vertical-align: middle; }
+        .loading { display: inline-block; width: 20px; height: 20px; border: 3px solid rgba(255,255,255,.3); border-radius: 50%; border-top-color: #667eea; animation: spin 1s ease-in-out infinite; }
+        @keyframes spin { to { transform: rotate(360deg); } }
+        .file-info { background: rgba(78, 205, 196, 0.1); padding: 15px; border-radius: 8px; margin: 15px 0; }
+        @media (max-width: 768px) { .main-grid { grid-template-columns: 1fr; } }
+        """
+
+    @staticmethod
+    def get_main_js():
+        return """
         let currentStep = 1;
         let uploadedFile = null;
         let selectedClip = null;
         let processedVideo = null;
+        let foundClips = [];
+        let reselectTimer = null;
+        // Thumbnail sprite sheets of the uploaded video (see loadThumbnails)
+        let thumbnails = null;
+        const PREVIEW_WIDTH = 80;
 
         // Initialize
         document.addEventListener('DOMContentLoaded', function() {
@@ -518,8 +1494,18 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             uploadArea.addEventListener('drop', handleDrop);
             fileInput.addEventListener('change', handleFileSelect);
             
-            document.getElementById('min-duration').addEventListener('input', function() {
-                document.getElementById('min-duration-value').textContent = this.value + 's';
+            ['min-duration', 'max-duration'].forEach(id => {
+                const slider = document.getElementById(id);
+                slider.addEventListener('input', function() {
+                    document.getElementById(id + '-value').textContent = this.value + 's';
+                });
+                // Once clips are shown, reselect them for the new range (the server
+                // keeps the transcript analysis, so this is fast)
+                slider.addEventListener('change', function() {
+                    if (currentStep < 4) return;
+                    clearTimeout(reselectTimer);
+                    reselectTimer = setTimeout(findClips, 300);
+                });
             });
         }
 
@@ -543,26 +1529,19 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             }
         }
 
-        async function processFile(file) {
-            if (file.size > 100 * 1024 * 1024) { // 100MB limit
-                showError('File size exceeds 100MB limit');
-                return;
-            }
+        const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+        const UPLOAD_PARALLEL_CHUNKS = 4;
+        const UPLOAD_MAX_RETRIES = 5;
 
+        async function processFile(file) {
             showProgress('upload');
             updateSystemStatus('Uploading file...');
 
             try {
-                const formData = new FormData();
-                formData.append('file', file);
-
-                const response = await fetch('/api/upload', {
-                    method: 'POST',
-                    body: formData
+                const result = await uploadChunked(file, (done, total) => {
+                    setProgress('upload-bar', total ? done / total * 100 : 100);
                 });
                 
-                const result = await response.json();
-                
                 hideProgress('upload');
                 
                 if (result.success) {
@@ -578,6 +1557,11 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                     document.getElementById('transcribe-btn').disabled = false;
                     currentStep = 2;
                     updateSystemStatus('File uploaded successfully - Ready for transcription');
+                    if (result.duplicate) {
+                        showArtifacts(result.artifacts).catch(error => {
+                            showError('Could not restore previous results: ' + error.message);
+                        });
+                    }
                 } else {
                     showError('Upload failed: ' + result.error);
                 }
@@ -587,6 +1571,161 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             }
         }
 
+        // Results from an earlier upload of the same recording; cached transcripts are
+        // listed by model and language, and transcribing with those returns at once
+        async function showArtifacts(artifacts) {
+            const modelSize = document.getElementById('model-size').value;
+            const cached = Object.keys(artifacts).filter(k => k.startsWith('transcript:')).map(k => artifacts[k]);
+            const entry = cached.find(t => t.model_size === modelSize) || cached[0];
+            if (!entry) return;
+            const transcript = await runJob('transcription', '/api/transcribe', {
+                file_id: uploadedFile.file_id, model_size: entry.model_size, language: entry.language
+            });
+            showTranscription(transcript);
+            if (artifacts.clips) {
+                showClips(artifacts.clips);
+            }
+            updateSystemStatus('Already processed - previous results restored');
+        }
+
+        // SHA-256 in the browser lets the server skip transfers of known files
+        const DEDUP_HASH_MAX_SIZE = 256 * 1024 * 1024;
+
+        async function hashFile(file) {
+            if (file.size > DEDUP_HASH_MAX_SIZE || !(window.crypto && crypto.subtle)) return null;
+            const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+            return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        }
+
+        // Resumable upload: init, parallel idempotent chunk PUTs, complete
+        async function uploadChunked(file, onProgress) {
+            const resumeKey = 'clipsai-upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+            const sha256 = await hashFile(file);
+            let session = null;
+            const savedId = localStorage.getItem(resumeKey);
+            if (savedId) {
+                const resumed = await postJSON('/api/upload/init', {
+                    upload_id: savedId, filename: file.name, size: file.size, sha256
+                });
+                if (resumed.success && resumed.url) {
+                    localStorage.removeItem(resumeKey);
+                    return resumed;
+                }
+                if (resumed.success) session = resumed;
+            }
+            if (!session) {
+                session = await postJSON('/api/upload/init', {
+                    filename: file.name, size: file.size, chunk_size: UPLOAD_CHUNK_SIZE, sha256
+                });
+                if (!session.success || session.url) return session;
+                localStorage.setItem(resumeKey, session.upload_id);
+            }
+
+            const received = new Set(session.received);
+            const pending = [];
+            for (let i = 0; i < session.total_chunks; i++) {
+                if (!received.has(i)) pending.push(i);
+            }
+            const chunkBytes = i => Math.min(session.chunk_size, file.size - i * session.chunk_size);
+            let done = 0;
+            received.forEach(i => done += chunkBytes(i));
+            onProgress(done, file.size);
+
+            async function sendChunk(index) {
+                const start = index * session.chunk_size;
+                const blob = file.slice(start, start + chunkBytes(index));
+                for (let attempt = 0; ; attempt++) {
+                    try {
+                        const response = await fetch('/api/upload/' + session.upload_id + '/' + index, {
+                            method: 'PUT', body: blob
+                        });
+                        const result = await response.json();
+                        if (result.success) return;
+                        if (response.status < 500 || attempt >= UPLOAD_MAX_RETRIES) throw new Error(result.error);
+                    } catch (error) {
+                        if (attempt >= UPLOAD_MAX_RETRIES) throw error;
+                    }
+                    await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+                }
+            }
+
+            async function worker() {
+                while (pending.length) {
+                    const index = pending.shift();
+                    await sendChunk(index);
+                    done += chunkBytes(index);
+                    onProgress(done, file.size);
+                }
+            }
+            await Promise.all(Array.from({length: UPLOAD_PARALLEL_CHUNKS}, worker));
+
+            const result = await postJSON('/api/upload/' + session.upload_id + '/complete', {});
+            if (result.success) localStorage.removeItem(resumeKey);
+            return result;
+        }
+
+        // Submit a background job and follow its event stream; resolves to its result
+        async function runJob(type, url, body, onPartial) {
+            const submitted = await postJSON(url, body);
+            if (!submitted.success) throw new Error(submitted.error);
+            const job = submitted.job.state === 'queued' || submitted.job.state === 'running'
+                ? await followJob(submitted.status_url, update => showJobProgress(type, update), onPartial)
+                : submitted.job;
+            if (job.state !== 'succeeded') throw new Error(job.error || 'Job ' + job.state);
+            return job.result;
+        }
+
+        const JOB_POLL_INTERVAL = 1000;
+
+        function followJob(statusUrl, onUpdate, onPartial) {
+            return new Promise((resolve, reject) => {
+                const events = new EventSource(statusUrl + '/events');
+                events.addEventListener('progress', e => onUpdate(JSON.parse(e.data)));
+                if (onPartial) {
+                    events.addEventListener('partial', e => onPartial(JSON.parse(e.data)));
+                }
+                events.addEventListener('done', e => {
+                    events.close();
+                    const job = JSON.parse(e.data);
+                    onUpdate(job);
+                    resolve(job);
+                });
+                events.onerror = () => {
+                    // The browser reconnects by itself unless the stream was refused (e.g. the
+                    // server has too many open streams): then poll the job instead
+                    if (events.readyState === EventSource.CLOSED) {
+                        pollJob(statusUrl, onUpdate).then(resolve, reject);
+                    }
+                };
+            });
+        }
+
+        async function pollJob(statusUrl, onUpdate) {
+            while (true) {
+                const response = await fetch(statusUrl);
+                const job = await response.json();
+                if (!job.success) throw new Error(job.error || 'Lost connection to job ' + statusUrl);
+                onUpdate(job);
+                if (job.state !== 'queued' && job.state !== 'running') return job;
+                await new Promise(wake => setTimeout(wake, JOB_POLL_INTERVAL));
+            }
+        }
+
+        function showJobProgress(type, job) {
+            setProgress(type + '-bar', job.progress * 100);
+            const stage = job.stage.replace(/_/g, ' ');
+            updateSystemStatus(stage.charAt(0).toUpperCase() + stage.slice(1) + '... ' + Math.round(job.progress * 100) + '%');
+        }
+
+        async function postJSON(url, data) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(data)
+            });
+            return response.json();
+        }
+
         async function validateToken() {
             const token = document.getElementById('hf-token').value.trim();
             const statusDiv = document.getElementById('token-status');
@@ -640,51 +1779,117 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             updateSystemStatus('Transcribing video...');
             
             try {
-                const response = await fetch('/api/transcribe', { method: 'POST' });
-                const result = await response.json();
+                // Long recordings are transcribed in chunks; show each as it finishes
+                const chunks = [];
+                const result = await runJob('transcription', '/api/transcribe', {
+                    file_id: uploadedFile.file_id,
+                    model_size: document.getElementById('model-size').value
+                }, chunk => {
+                    chunks[chunk.chunk] = chunk.text;
+                    document.getElementById('transcript-text').textContent =
+                        chunks.map(text => text === undefined ? '…' : text).join(' ');
+                    document.getElementById('transcription-result').classList.remove('hidden');
+                });
                 
                 if (result.success) {
                     hideProgress('transcription');
-                    document.getElementById('detected-language').textContent = result.language.toUpperCase();
-                    document.getElementById('video-duration').textContent = result.duration + 's';
-                    document.getElementById('word-count').textContent = result.word_count;
-                    document.getElementById('confidence').textContent = (result.confidence * 100).toFixed(0) + '%';
-                    document.getElementById('transcript-text').textContent = result.transcript;
-                    document.getElementById('transcription-result').classList.remove('hidden');
-                    document.getElementById('clips-btn').disabled = false;
-                    currentStep = 3;
+                    showTranscription(result);
                     updateSystemStatus('Transcription complete - Ready to find clips');
                 } else {
                     showError('Transcription failed: ' + result.error);
                 }
             } catch (error) {
+                hideProgress('transcription');
                 showError('Transcription failed: ' + error.message);
             }
         }
 
+        function showTranscription(result) {
+            document.getElementById('detected-language').textContent = result.language.toUpperCase();
+            document.getElementById('video-duration').textContent = result.duration + 's';
+            document.getElementById('word-count').textContent = result.word_count;
+            document.getElementById('confidence').textContent = (result.confidence * 100).toFixed(0) + '%';
+            document.getElementById('transcript-text').textContent = result.transcript;
+            document.getElementById('transcription-result').classList.remove('hidden');
+            document.getElementById('clips-btn').disabled = false;
+            currentStep = 3;
+        }
+
         async function findClips() {
             showProgress('clips');
             updateSystemStatus('Finding clips...');
             
             try {
-                const response = await fetch('/api/find_clips', { method: 'POST' });
-                const result = await response.json();
+                const result = await runJob('clips', '/api/find_clips', {
+                    file_id: uploadedFile.file_id,
+                    model_size: document.getElementById('model-size').value,
+                    min_duration: parseInt(document.getElementById('min-duration').value),
+                    max_duration: parseInt(document.getElementById('max-duration').value)
+                });
                 
                 if (result.success) {
                     hideProgress('clips');
-                    populateClipsTable(result.clips);
-                    document.getElementById('clips-count').textContent = result.clips.length;
-                    document.getElementById('clips-result').classList.remove('hidden');
-                    currentStep = 4;
+                    showClips(result);
                     updateSystemStatus('Clips found - Select a clip to process');
                 } else {
                     showError('Clip finding failed: ' + result.error);
                 }
             } catch (error) {
+                hideProgress('clips');
                 showError('Clip finding failed: ' + error.message);
             }
         }
 
+        function showClips(result) {
+            foundClips = result.clips;
+            document.getElementById('batch-btn').disabled = result.clips.length === 0;
+            populateClipsTable(result.clips);
+            document.getElementById('clips-count').textContent = result.clips.length;
+            document.getElementById('clips-result').classList.remove('hidden');
+            currentStep = 4;
+            if (!thumbnails || thumbnails.file_id !== uploadedFile.file_id) {
+                loadThumbnails(uploadedFile.file_id).then(manifest => {
+                    thumbnails = manifest;
+                    if (manifest) populateClipsTable(foundClips);
+                }).catch(() => {});
+            }
+        }
+
+        // Sprite sheet manifest of an upload; waits for its indexing job if that is still running
+        async function loadThumbnails(fileId) {
+            const url = '/api/uploads/' + fileId + '/thumbnails';
+            let response = await fetch(url);
+            let manifest = await response.json();
+            if (response.status === 202) {
+                const job = manifest.job.state === 'queued' || manifest.job.state === 'running'
+                    ? await followJob(manifest.status_url, () => {})
+                    : manifest.job;
+                if (job.state !== 'succeeded') return null;
+                response = await fetch(url);
+                manifest = await response.json();
+            }
+            return response.ok && manifest.success ? manifest : null;
+        }
+
+        // Start, middle and end frames of a clip, cut from the sprite sheets
+        function previewHtml(clip) {
+            if (!thumbnails || thumbnails.file_id !== uploadedFile.file_id || !thumbnails.thumbnails.length) return '';
+            const scale = PREVIEW_WIDTH / thumbnails.tile_width;
+            const sheetWidth = thumbnails.columns * thumbnails.tile_width * scale;
+            return [clip.start, (clip.start + clip.end) / 2, clip.end].map(time => {
+                // The last thumbnail at or before this time
+                let thumb = thumbnails.thumbnails[0];
+                for (const candidate of thumbnails.thumbnails) {
+                    if (candidate.time > time) break;
+                    thumb = candidate;
+                }
+                return `<span class="thumb" title="${formatTime(thumb.time)}" style="width: ${PREVIEW_WIDTH}px; ` +
+                    `height: ${Math.round(thumbnails.tile_height * scale)}px; ` +
+                    `background-image: url('${thumbnails.sheets[thumb.sheet]}'); background-size: ${sheetWidth}px auto; ` +
+                    `background-position: -${thumb.x * scale}px -${thumb.y * scale}px"></span>`;
+            }).join('');
+        }
+
         function populateClipsTable(clips) {
             const tbody = document.getElementById('clips-tbody');
             tbody.innerHTML = '';
@@ -693,6 +1898,7 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                 const row = tbody.insertRow();
                 row.innerHTML = `
                     <td>${clip.id}</td>
+                    <td>${previewHtml(clip)}</td>
                     <td>${clip.topic || 'N/A'}</td>
                     <td>${formatTime(clip.start)}</td>
                     <td>${formatTime(clip.end)}</td>
@@ -732,15 +1938,12 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             updateSystemStatus(statusText);
             
             try {
-                const response = await fetch('/api/process', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        operation: operation,
-                        clip_id: selectedClip ? selectedClip.clipId : 1
-                    })
+                const result = await runJob('processing', '/api/process', {
+                    file_id: uploadedFile.file_id,
+                    operation: operation,
+                    clip_id: selectedClip ? selectedClip.clipId : 1,
+                    aspect_ratio: document.getElementById('aspect-ratio').value
                 });
-                const result = await response.json();
                 
                 if (result.success) {
                     hideProgress('processing');
@@ -757,15 +1960,52 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
                     showError('Processing failed: ' + result.error);
                 }
             } catch (error) {
+                hideProgress('processing');
                 showError('Processing failed: ' + error.message);
             }
         }
 
+        // All found clips as one batch job on the server's process pool
+        async function exportAllClips() {
+            showProgress('processing');
+            const statusText = 'Exporting ' + foundClips.length + ' clips...';
+            document.getElementById('processing-status').textContent = statusText;
+            updateSystemStatus(statusText);
+
+            try {
+                const result = await runJob('processing', '/api/process_batch', {
+                    file_id: uploadedFile.file_id,
+                    operation: 'trim',
+                    aspect_ratio: document.getElementById('aspect-ratio').value,
+                    clips: foundClips.map(clip => ({clip_id: clip.id}))
+                });
+
+                hideProgress('processing');
+                const duration = result.clips.reduce((total, clip) => total + clip.duration, 0);
+                const size = result.clips.reduce((total, clip) => total + (clip.size || 0), 0);
+                document.getElementById('operation-type').textContent = 'batch export (' + result.message + ')';
+                document.getElementById('output-duration').textContent = duration.toFixed(1);
+                document.getElementById('output-filename').textContent = result.archive_url || result.clips.map(c => c.output_file).join(', ');
+                document.getElementById('output-size').textContent = (size / 1024 / 1024).toFixed(2) + ' MB';
+                document.getElementById('processing-result').classList.remove('hidden');
+                document.getElementById('download-btn').disabled = !result.archive_url;
+                processedVideo = {output_file: 'clips.zip', url: result.archive_url};
+                currentStep = 5;
+                updateSystemStatus(result.message);
+                if (!result.success) {
+                    showError(result.clips.filter(c => !c.success).map(c => 'Clip ' + c.clip_id + ': ' + c.error).join('; '));
+                }
+            } catch (error) {
+                hideProgress('processing');
+                showError('Batch export failed: ' + error.message);
+            }
+        }
+
         function downloadVideo() {
             if (processedVideo) {
-                // In a real implementation, this would download the actual processed file
                 const link = document.createElement('a');
-                link.href = 'data:application/octet-stream;base64,';
+                // Simulated outputs have no file to fetch
+                link.href = processedVideo.url || 'data:application/octet-stream;base64,';
                 link.download = processedVideo.output_file;
                 link.click();
                 updateSystemStatus('Download initiated!');
@@ -775,24 +2015,15 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
 
         function showProgress(type) {
             document.getElementById(type + '-progress').classList.remove('hidden');
-            animateProgress(type + '-bar');
+            setProgress(type + '-bar', 0);
         }
 
         function hideProgress(type) {
             document.getElementById(type + '-progress').classList.add('hidden');
         }
 
-        function animateProgress(barId) {
-            const bar = document.getElementById(barId);
-            let width = 0;
-            const interval = setInterval(() => {
-                width += 2;
-                bar.style.width = Math.min(width, 100) + '%';
-                if (width >= 100) {
-                    clearInterval(interval);
-                    setTimeout(() => bar.style.width = '0%', 500);
-                }
-            }, 50);
+        function setProgress(barId, percent) {
+            document.getElementById(barId).style.width = Math.min(percent, 100) + '%';
         }
 
         function formatTime(seconds) {
@@ -831,26 +2062,238 @@ class ClipsAIHandler(http.server.SimpleHTTPRequestHandler):
             .catch(() => {
                 updateSystemStatus('Server connection error');
             });
-    </script>
-</body>
-</html>
         """
 
-def start_server(port=8501):
-    """Start the enhanced ClipsAI web server"""
+def register_collectors(handler):
+    """Scrape-time metrics read from the handler's shared components"""
+    REGISTRY.gauge('clipsai_jobs_queued', "Jobs waiting for a worker", lambda: handler.jobs.queue_depth())
+    REGISTRY.gauge('clipsai_jobs_running', "Running jobs by kind",
+                   lambda: {(kind,): count for kind, count in handler.jobs.running().items()}, ('kind',))
+
+    def cache_counts():
+        # (hits, misses) per cache; a model load or audio extraction counts as a miss.
+        # Components not loaded yet have seen no lookups.
+        transcripts = handler.transcript_cache.stats()
+        models = handler.models.stats()
+        tokens = handler.token_validator.stats()
+        finder = handler.component_stats('clip_finder') or {'hits': 0, 'misses': 0}
+        audio = handler.component_stats('audio_cache') or {'hits': 0, 'extractions': 0}
+        tracks = handler.component_stats('crop_tracks') or {'reused': 0, 'computed': 0}
+        index = handler.component_stats('video_index') or {'reused': 0, 'computed': 0}
+        return {
+            'transcripts': (transcripts['hits'], transcripts['misses']),
+            'models': (models['hits'], models['loads']),
+            'tokens': (tokens['hits'], tokens['misses']),
+            'clip_analyses': (finder['hits'], finder['misses']),
+            'audio': (audio['hits'], audio['extractions']),
+            'crop_tracks': (tracks['reused'], tracks['computed']),
+            'video_index': (index['reused'], index['computed']),
+        }
+
+    REGISTRY.gauge('clipsai_cache_hits_total', "Cache lookups answered from the cache",
+                   lambda: {(name,): hits for name, (hits, _) in cache_counts().items()}, ('cache',), 'counter')
+    REGISTRY.gauge('clipsai_cache_misses_total', "Cache lookups that had to compute or load",
+                   lambda: {(name,): misses for name, (_, misses) in cache_counts().items()}, ('cache',), 'counter')
+    REGISTRY.gauge('clipsai_cache_hit_ratio', "Hits / lookups per cache",
+                   lambda: {(name,): round(hits / (hits + misses), 4) if hits + misses else None
+                            for name, (hits, misses) in cache_counts().items()}, ('cache',), merge='local')
+    REGISTRY.gauge('clipsai_transcript_cache_bytes', "Bytes held by the transcript cache",
+                   lambda: handler.transcript_cache.stats()['bytes'])
+    REGISTRY.gauge('clipsai_model_bytes', "Estimated memory of loaded Whisper models",
+                   lambda: handler.models.stats()['bytes'])
+    # Every process sees the same upload directory
+    REGISTRY.gauge('clipsai_storage_bytes', "Bytes in the upload directory by category",
+                   lambda: {(category,): size for category, size in handler.storage.usage().items()},
+                   ('category',), merge='max')
+    REGISTRY.gauge('clipsai_storage_evictions_total', "Uploads and outputs evicted to stay within the quota",
+                   lambda: handler.storage.evictions, kind='counter')
+
+
+register_collectors(ClipsAIHandler)
+
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """TCP server that hands each connection to a bounded pool of worker threads.
+
+    The accept loop blocks once every worker is busy and ``max_pending``
+    connections are queued, so overload backs up into the listen backlog
+    instead of spawning unbounded threads.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS, max_pending=None,
+                 bind_and_activate=True):
+        self.workers = max(1, int(workers))
+        if max_pending is None:
+            max_pending = self.workers * 2
+        self._slots = threading.BoundedSemaphore(self.workers + max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='clipsai-http')
+        # Held by each open job event stream (see serve_job_events)
+        self.event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS or max(1, self.workers // 4))
+        self._active = 0
+        self._idle = threading.Condition()
+        # Called from the accept loop (pre-fork heartbeat), also while waiting for a free worker
+        self.heartbeat = None
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def get_request(self):
+        request, client_address = self.socket.accept()
+        # Pre-fork workers accept on a non-blocking socket
+        request.setblocking(True)
+        return request, client_address
+
+    def service_actions(self):
+        if self.heartbeat:
+            self.heartbeat()
+
+    def process_request(self, request, client_address):
+        while not self._slots.acquire(timeout=1.0):
+            self.service_actions()
+        with self._idle:
+            self._active += 1
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # Pool already shut down
+            self._request_done()
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._request_done()
+
+    def _request_done(self):
+        self._slots.release()
+        with self._idle:
+            self._active -= 1
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """Wait until no request is in progress; returns False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_server(port=8501, workers=DEFAULT_WORKERS, host="", sock=None):
+    """Create the HTTP server; ``workers=1`` serves one request at a time.
+
+    ``sock`` is an already listening socket to serve instead of binding ``port``.
+    """
+    ClipsAIHandler.open_upload_dir()
+    if sock is None:
+        return ThreadPoolHTTPServer((host, port), ClipsAIHandler, workers=workers)
+    httpd = ThreadPoolHTTPServer(sock.getsockname(), ClipsAIHandler, workers=workers, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    httpd.server_address = sock.getsockname()
+    return httpd
+
+
+def start_server(port=8501, workers=DEFAULT_WORKERS, preload_models=PRELOAD_MODELS, processes=DEFAULT_PROCESSES,
+                 port_fallback=0, host=""):
+    """Start the enhanced ClipsAI web server.
+
+    The port is bound once, here; with ``processes > 1`` every worker process
+    serves that same socket. A busy port is an error unless ``port_fallback``
+    allows trying the next ones.
+    """
+    sock = prefork.inherited_socket()
+    if sock is not None:
+        # A pre-fork worker started by the master below
+        serve(sock, workers, preload_models)
+        return
+    try:
+        sock = prefork.bind_socket(host, port, port_fallback)
+    except prefork.PortInUse as e:
+        print(f"❌ {e.strerror}. Stop the other server or choose another --port.")
+        sys.exit(1)
+    port = sock.getsockname()[1]
     print(f"🎬 Enhanced ClipsAI Web Interface running at http://localhost:{port}")
     print(f"✨ Features: File Upload, Token Validation, Real Processing")
-    
-    try:
-        with socketserver.TCPServer(("", port), ClipsAIHandler) as httpd:
-            print("🔄 Server is ready for testing...")
-            httpd.serve_forever()
-    except OSError as e:
-        if e.errno == 98:  # Address already in use
-            print(f"⚠️  Port {port} is already in use. Trying port {port + 1}")
-            start_server(port + 1)
+
+    print(f"📁 Uploads and metadata in {ClipsAIHandler.upload_dir}")
+    if processes <= 1:
+        serve(sock, workers, preload_models)
+        return
+    # Workers share the upload directory; worker state of an earlier run is stale
+    shared_dir = os.path.join(ClipsAIHandler.upload_dir, '.workers')
+    shutil.rmtree(shared_dir, ignore_errors=True)
+    # Workers share the run id too, so each knows which unfinished jobs are its siblings'
+    env = dict(os.environ, CLIPSAI_UPLOAD_DIR=ClipsAIHandler.upload_dir, CLIPSAI_WORKERS=str(workers),
+               CLIPSAI_PRELOAD_MODELS=','.join(preload_models), **{prefork.RUN_ID_ENV: prefork.run_id()})
+    print(f"🧩 {processes} worker processes with {workers} threads each; "
+          f"kill -HUP {os.getpid()} restarts them gracefully")
+    prefork.Supervisor(sock, processes, [sys.executable, os.path.abspath(__file__)], env).run()
+
+
+def serve(sock, workers=DEFAULT_WORKERS, preload_models=()):
+    """Serve a listening socket; a pre-fork worker drains its requests and jobs on SIGTERM"""
+    with create_server(workers=workers, sock=sock) as httpd:
+        # Listening from here on; heavy imports and model loads happen behind it
+        if WARMUP:
+            threading.Thread(target=ClipsAIHandler.warm_up, name='clipsai-warmup', daemon=True).start()
         else:
-            raise
+            ClipsAIHandler.startup.state = 'disabled'
+        if preload_models:
+            ClipsAIHandler.models.preload(preload_models)
+        ClipsAIHandler.storage.start()
+        # Run again what an earlier run (or a crashed worker) left unfinished
+        ClipsAIHandler.jobs.recover(ClipsAIHandler.job_call)
+
+        if not prefork.is_worker():
+            print(f"🔄 Server is ready for testing ({httpd.workers} workers)...")
+            httpd.serve_forever()
+            return
+
+        stopping = threading.Event()
+
+        def stop():
+            # serve_forever runs in this thread, so shutdown() must be called from another
+            if not stopping.is_set():
+                stopping.set()
+                threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+        prefork.install_worker_signals(stop)
+        httpd.heartbeat = prefork.Heartbeat.from_environ(stop).beat
+        print(f"👷 Worker {prefork.worker_index()} (pid {os.getpid()}) ready with {httpd.workers} threads")
+        httpd.serve_forever()
+        drain(httpd)
+
+
+def drain(httpd, timeout=prefork.GRACEFUL_TIMEOUT):
+    """Let in-flight requests and queued or running jobs finish, for up to ``timeout`` seconds"""
+    deadline = time.monotonic() + timeout
+    idle = httpd.wait_idle(timeout)
+    jobs = ClipsAIHandler.jobs
+    while (jobs.queue_depth() or any(jobs.running().values())) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    unfinished = jobs.queue_depth() + sum(jobs.running().values())
+    print(f"👋 Worker {prefork.worker_index()} (pid {os.getpid()}) stopped"
+          + ("" if idle and not unfinished else " before all its requests and jobs finished"))
+
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Enhanced ClipsAI web server")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8501')))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="worker threads serving requests concurrently, per process (env: CLIPSAI_WORKERS)")
+    parser.add_argument('--processes', type=prefork.process_count, default=DEFAULT_PROCESSES,
+                        help="server processes sharing the port; 0 for one per CPU (env: CLIPSAI_PROCESSES)")
+    parser.add_argument('--port-fallback', type=int, default=0, metavar='N',
+                        help="if the port is in use, try up to N following ports instead of exiting")
+    parser.add_argument('--preload-models', default=','.join(PRELOAD_MODELS),
+                        help="comma separated Whisper model sizes to load in the background at startup "
+                             "(env: CLIPSAI_PRELOAD_MODELS)")
+    args = parser.parse_args()
+    start_server(args.port, args.workers, [m for m in args.preload_models.split(',') if m], args.processes,
+                 args.port_fallback)
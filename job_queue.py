@@ -0,0 +1,535 @@
+"""
+Background job queue for long-running pipeline stages
+
+POST endpoints submit a job and return its id immediately; a bounded pool of
+worker threads runs the work. Each job kind has its own concurrency limit, so
+CPU-heavy transcriptions cannot occupy every worker while short trims wait.
+
+With a metadata database (see metadata_db.py) every job is stored there, with
+the parameters it was submitted with; its changes are written in batches a few
+times a second and as soon as it finishes. Other server processes serve
+status, event streams and the job list from the database and cancel a job by
+flagging its row. Jobs left unfinished by a process that is
+gone (a restart, or a crashed pre-fork worker) are taken over by
+:meth:`JobManager.recover`, which runs them again from their parameters.
+"""
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from metrics import REGISTRY, STAGE_BUCKETS
+from shared_state import pid_alive
+
+# Seconds between checks for cancel requests and changes of other processes' jobs
+POLL_INTERVAL = 0.25
+# Seconds between looks for jobs left behind by processes that are gone
+RECOVER_INTERVAL = 5
+# A job interrupted this many times is failed instead of run again
+MAX_ATTEMPTS = 3
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+JOBS = REGISTRY.counter('clipsai_jobs_total', "Finished jobs by kind and final state", ('kind', 'state'))
+JOB_WAIT = REGISTRY.histogram('clipsai_job_wait_seconds', "Time jobs spent queued before starting",
+                              ('kind',), STAGE_BUCKETS)
+JOB_RUN = REGISTRY.histogram('clipsai_job_run_seconds', "Time from job start to finish",
+                             ('kind', 'state'), STAGE_BUCKETS)
+STAGE_SECONDS = REGISTRY.histogram('clipsai_job_stage_seconds', "Time spent in each pipeline stage",
+                                   ('kind', 'stage'), STAGE_BUCKETS)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when the job has been cancelled"""
+
+
+class QueueFull(Exception):
+    """Too many jobs are waiting to run"""
+
+
+class Job:
+    """One unit of pipeline work and its observable state"""
+
+    def __init__(self, kind, fn, args):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.state = QUEUED
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        # Partial results published while running (append-only)
+        self.partials = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._stage_started = None
+        # Trace mode (see profiling.py), the submitting request's trace and this job's trace
+        self.profile = None
+        self.parent_trace = None
+        self.trace_id = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        # Bumped on every observable change so event streams can wait for news
+        self.version = 0
+        self._changed = threading.Condition(self._lock)
+        # Called with the lock held after each change (JobManager publishing)
+        self.on_change = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def update(self, progress=None, stage=None, message=None):
+        """Report progress (0..1) from inside the job; raises JobCancelled if cancelled"""
+        with self._lock:
+            if progress is not None:
+                self.progress = max(0.0, min(1.0, float(progress)))
+            if stage is not None and stage != self.stage:
+                self._end_stage()
+                self.stage = stage
+                profiling.mark_stage(stage)
+            if message is not None:
+                self.message = message
+            self._notify()
+        self.check_cancelled()
+
+    def add_partial(self, data):
+        """Publish a partial result (e.g. one transcribed chunk) to event streams"""
+        with self._lock:
+            self.partials.append(data)
+            self._notify(partial=data)
+
+    def _end_stage(self):
+        # Caller holds self._lock; 'queued' is covered by the wait histogram
+        now = time.monotonic()
+        if self._stage_started is not None and self.stage not in ('queued', 'done'):
+            STAGE_SECONDS.observe(now - self._stage_started, (self.kind, self.stage))
+        self._stage_started = now
+
+    def _notify(self, partial=None):
+        # Caller holds self._lock
+        self.version += 1
+        self._changed.notify_all()
+        if self.on_change is not None:
+            self.on_change(self, partial)
+
+    def wait_for_change(self, seen_version, timeout):
+        """Block until the job changes after ``seen_version`` or ``timeout`` passes"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout)
+            return self.version
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def sleep(self, seconds):
+        """Wait like time.sleep, but wake up early and raise when cancelled"""
+        if self._cancel.wait(seconds):
+            raise JobCancelled()
+
+    def to_dict(self, include_result=True):
+        with self._lock:
+            return self._snapshot(include_result)
+
+    def _snapshot(self, include_result=True):
+        # Caller holds self._lock
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "stage": self.stage,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "result": self.result if include_result else None,
+            "error": self.error,
+            "partials": len(self.partials),
+            "version": self.version,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "trace_id": self.trace_id,
+        }
+
+
+def is_job_id(value):
+    return isinstance(value, str) and len(value) == 32 and all(c in '0123456789abcdef' for c in value)
+
+
+class StoredJob:
+    """Read-only view of a job stored in the metadata database, e.g. one another process runs"""
+
+    def __init__(self, db, row):
+        self.db = db
+        self.id = row['id']
+        self._apply(row)
+
+    @classmethod
+    def load(cls, db, job_id):
+        row = db.query_one('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        return cls(db, row) if row else None
+
+    def _apply(self, row):
+        self._snapshot = json.loads(row['snapshot'])
+        self._result = json.loads(row['result']) if row['result'] else None
+        self.kind = row['kind']
+        self.state = row['state']
+        self.created = row['created']
+        self.finished = row['finished']
+        self.version = row['version']
+
+    def refresh(self):
+        row = self.db.query_one('SELECT * FROM jobs WHERE id = ?', (self.id,))
+        if row:
+            self._apply(row)
+
+    @property
+    def finished_state(self):
+        return self.state in FINISHED_STATES
+
+    @property
+    def partials(self):
+        return [json.loads(row['data']) for row in
+                self.db.query('SELECT data FROM job_partials WHERE job_id = ? ORDER BY seq', (self.id,))]
+
+    def wait_for_change(self, seen_version, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            self.refresh()
+            remaining = deadline - time.monotonic()
+            if self.version != seen_version or remaining <= 0:
+                return self.version
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def to_dict(self, include_result=True):
+        snapshot = dict(self._snapshot)
+        snapshot['result'] = self._result if include_result else None
+        return snapshot
+
+
+class JobManager:
+    """Schedules jobs onto a shared worker pool under per-kind concurrency limits"""
+
+    def __init__(self, max_workers=4, limits=None, max_queued=256, retention=3600, db=None, owner=None):
+        self.max_workers = max_workers
+        self.limits = dict(limits or {})
+        self.max_queued = max_queued
+        self.retention = retention
+        self.db = db
+        # Identifies this run of the server; unfinished jobs of other runs were interrupted
+        self.owner = owner or uuid.uuid4().hex
+        self._resume = None
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='clipsai-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = collections.deque()
+        self._running = collections.Counter()
+        # Jobs changed since they were last written, with their unwritten partials (see _flush)
+        self._unpublished = {}
+        self._publish_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if db is not None:
+            threading.Thread(target=self._watch_db, name='clipsai-job-watch', daemon=True).start()
+
+    def _persist(self, job, params=None):
+        # Store a new job; later changes are noted by _publish and written by _flush
+        if self.db is not None:
+            with job._lock:
+                self.db.execute(
+                    'INSERT INTO jobs (id, kind, state, created, finished, version, snapshot, result, params, '
+                    'owner, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job.id, job.kind, job.state, job.created, job.finished, job.version,
+                     json.dumps(job._snapshot(include_result=False)), json.dumps(job.result),
+                     None if params is None else json.dumps(params), self.owner, os.getpid()))
+                job.on_change = self._publish
+
+    def _publish(self, job, partial):
+        # Job lock held: only note the change, so progress updates never wait on the database
+        with self._publish_lock:
+            pending = self._unpublished.setdefault(job.id, (job, []))
+            if partial is not None:
+                pending[1].append((len(job.partials) - 1, partial))
+
+    def _flush(self):
+        """Write the jobs changed since the last flush, in one transaction.
+
+        Called by the watcher every POLL_INTERVAL and when a job finishes, so
+        a job reporting progress many times a second costs one write per interval.
+        """
+        with self._flush_lock:
+            with self._publish_lock:
+                pending, self._unpublished = self._unpublished, {}
+            if not pending:
+                return
+            updates, partials = [], []
+            for job, job_partials in pending.values():
+                with job._lock:
+                    updates.append((job.state, job.finished, job.version,
+                                    json.dumps(job._snapshot(include_result=False)), json.dumps(job.result), job.id))
+                partials += [(job.id, seq, json.dumps(data)) for seq, data in job_partials]
+            try:
+                with self.db.transaction():
+                    connection = self.db.connection()
+                    connection.executemany('INSERT INTO job_partials (job_id, seq, data) VALUES (?, ?, ?)', partials)
+                    connection.executemany('UPDATE jobs SET state = ?, finished = ?, version = ?, snapshot = ?, '
+                                           'result = ? WHERE id = ?', updates)
+            except sqlite3.Error as e:
+                # Other processes see a stale state; the jobs themselves carry on
+                print(f"⚠️  Could not store {len(updates)} job updates: {e}")
+
+    def submit(self, kind, fn, *args, params=None):
+        """Queue ``fn(job, *args)``; its return value becomes the job result.
+
+        ``params`` (JSON) are stored with the job so :meth:`recover` can run it
+        again after an interruption.
+        """
+        job = Job(kind, fn, args)
+        # Jobs of a traced request are traced too; others are sampled
+        parent = profiling.current()
+        job.profile = parent.mode if parent else profiling.sampled_mode()
+        job.parent_trace = parent.id if parent else None
+        with self._lock:
+            self._prune()
+            if len(self._pending) >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({self.max_queued} jobs waiting)")
+            self._persist(job, params)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._dispatch()
+        return job
+
+    def completed(self, kind, result):
+        """Record an already finished job, e.g. for a result served from cache"""
+        job = Job(kind, None, ())
+        job.state, job.stage, job.progress = SUCCEEDED, 'done', 1.0
+        job.result = result
+        job.started = job.finished = job.created
+        self._persist(job)
+        with self._lock:
+            self._jobs[job.id] = job
+        JOBS.inc(1, (kind, 'cached'))
+        return job
+
+    def get(self, job_id):
+        """A job of this process, or a :class:`StoredJob` view of another process's job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.db is not None and is_job_id(job_id):
+            job = StoredJob.load(self.db, job_id)
+        return job
+
+    def list(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if self.db is not None:
+            local = {job.id for job in jobs}
+            rows = self.db.query('SELECT id, kind, state, created, finished, version, snapshot, NULL AS result '
+                                 'FROM jobs ORDER BY created DESC')
+            jobs += [StoredJob(self.db, row) for row in rows if row['id'] not in local]
+        return jobs
+
+    def cancel(self, job_id):
+        """Cancel a job; queued jobs never start, running jobs stop at their next check"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.state not in FINISHED_STATES:
+                job._cancel.set()
+                if job.state == QUEUED:
+                    self._pending.remove(job)
+                    self._finish(job, CANCELLED)
+        if job is None:
+            return self._cancel_stored(job_id)
+        return job
+
+    def _cancel_stored(self, job_id):
+        # Flag the row for the process running the job (see _watch_db)
+        job = self.get(job_id) if self.db is not None else None
+        if job is not None and not job.finished_state:
+            self.db.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+        return job
+
+    def recover(self, resume):
+        """Take over unfinished jobs whose process is gone, now and every few seconds after.
+
+        ``resume(kind, params)`` returns ``(fn, args)`` to run a job again, or
+        None if it cannot be; such jobs, and jobs interrupted ``MAX_ATTEMPTS``
+        times, fail instead.
+        """
+        self._resume = resume
+        rows = self.db.query('SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY created', (QUEUED, RUNNING))
+        for row in rows:
+            # A live process is still running its jobs, whichever run it belongs to; this
+            # process's pid on another run's row means the pid was reused after a restart
+            if row['pid'] == os.getpid():
+                if row['owner'] == self.owner:
+                    continue
+            elif pid_alive(row['pid']):
+                continue
+            # Another process may be recovering the same job: only one update matches
+            claimed = self.db.execute('UPDATE jobs SET owner = ?, pid = ?, attempts = attempts + 1 '
+                                      'WHERE id = ? AND owner IS ? AND pid IS ?',
+                                      (self.owner, os.getpid(), row['id'], row['owner'], row['pid'])).rowcount
+            if claimed:
+                self._restore(row, resume)
+
+    def _restore(self, row, resume):
+        call = None
+        if not row['cancel_requested'] and row['params'] and row['attempts'] < MAX_ATTEMPTS:
+            try:
+                call = resume(row['kind'], json.loads(row['params']))
+            except Exception as e:
+                print(f"⚠️  Cannot resume {row['kind']} job {row['id']}: {e}")
+        job = Job(row['kind'], None, ())
+        job.id, job.created, job.version = row['id'], row['created'], row['version']
+        job.on_change = self._publish
+        with self._lock:
+            self._jobs[job.id] = job
+            if call is None:
+                if not row['cancel_requested']:
+                    job.error = "Interrupted: the server process running it stopped"
+                    print(f"⚠️  Interrupted {job.kind} job {job.id} failed")
+                self._finish(job, CANCELLED if row['cancel_requested'] else FAILED)
+                return
+            job.fn, job.args = call
+            job.message = "Resumed after its server process stopped"
+            self.db.execute('DELETE FROM job_partials WHERE job_id = ?', (job.id,))
+            with job._lock:
+                job._notify()
+            self._pending.append(job)
+            self._dispatch()
+        print(f"♻️  Resumed interrupted {job.kind} job {job.id}")
+
+    def _watch_db(self):
+        # Apply cancel requests for this process's jobs, recover orphaned jobs, drop old ones
+        last_recover = last_sweep = 0
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                self._flush()
+                for row in self.db.query('SELECT id FROM jobs WHERE state IN (?, ?) AND cancel_requested = 1 '
+                                         'AND owner = ? AND pid = ?', (QUEUED, RUNNING, self.owner, os.getpid())):
+                    self.cancel(row['id'])
+                now = time.monotonic()
+                if self._resume is not None and now - last_recover > RECOVER_INTERVAL:
+                    last_recover = now
+                    self.recover(self._resume)
+                if now - last_sweep > 60:
+                    last_sweep = now
+                    finished = (*FINISHED_STATES, time.time() - self.retention)
+                    with self.db.transaction():
+                        self.db.execute('DELETE FROM job_partials WHERE job_id IN (SELECT id FROM jobs '
+                                        'WHERE state IN (?, ?, ?) AND finished < ?)', finished)
+                        self.db.execute('DELETE FROM jobs WHERE state IN (?, ?, ?) AND finished < ?', finished)
+            except sqlite3.Error as e:
+                print(f"⚠️  Job watcher: {e}")
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def running(self):
+        """Running jobs per kind"""
+        with self._lock:
+            return dict(self._running)
+
+    def _dispatch(self):
+        # Start the oldest pending jobs whose kind still has capacity (lock held)
+        for job in list(self._pending):
+            if sum(self._running.values()) >= self.max_workers:
+                break
+            if self._running[job.kind] >= self.limits.get(job.kind, self.max_workers):
+                continue
+            self._pending.remove(job)
+            self._running[job.kind] += 1
+            with job._lock:
+                job.state = RUNNING
+                job.started = time.time()
+                job._stage_started = time.monotonic()
+                job._notify()
+            JOB_WAIT.observe(job.started - job.created, (job.kind,))
+            self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        state = SUCCEEDED
+        try:
+            job.check_cancelled()
+            with profiling.traced(job.profile, job.kind, 'job', job_id=job.id, parent=job.parent_trace) as trace:
+                if trace is not None:
+                    job.trace_id = trace.id
+                result = job.fn(job, *job.args)
+            with job._lock:
+                job.result = result
+                job.progress = 1.0
+                job._end_stage()
+                job.stage = 'done'
+        except JobCancelled:
+            state = CANCELLED
+        except Exception as e:
+            print(f"❌ {job.kind} job {job.id} failed: {e}")
+            state = FAILED
+            job.error = str(e)
+        with self._lock:
+            self._running[job.kind] -= 1
+            self._finish(job, state)
+            self._dispatch()
+        if self.db is not None:
+            # The outcome is stored right away, not on the watcher's next pass
+            self._flush()
+
+    def _finish(self, job, state):
+        with job._lock:
+            if job.started:
+                job._end_stage()
+            job.state = state
+            job.finished = time.time()
+            if state == CANCELLED:
+                job.stage = 'cancelled'
+            job.fn = job.args = None
+            job._notify()
+        JOBS.inc(1, (job.kind, state))
+        if job.started:
+            JOB_RUN.observe(job.finished - job.started, (job.kind, state))
+
+    def _prune(self):
+        # Forget finished jobs older than the retention period (lock held)
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job._cancel.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.db is not None:
+            self._flush()
+
+
+def parse_limits(spec):
+    """Parse ``"transcribe=1,process=2"`` into a dict"""
+    limits = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            kind, value = item.split('=', 1)
+            limits[kind.strip()] = int(value)
+    return limits
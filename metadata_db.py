@@ -0,0 +1,138 @@
+"""
+Durable metadata in SQLite: uploads, artifacts, transcripts, jobs and the storage index
+
+One hidden database file in the upload directory (``.storage/clipsai.db``,
+never served by /uploads/) holds the records that used to live in memory or
+in per-upload JSON files, so a restart keeps the library, its transcripts,
+clip candidates, processed outputs and jobs.
+The database runs in WAL mode: readers never wait for the writer, and every
+server process of a pre-fork server can use it at once. Each thread opens its
+own connection; writes are short ``BEGIN IMMEDIATE`` transactions. Uploads
+are keyed by content hash and jobs are indexed by state and age, so lookups
+stay logarithmic as the library grows.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+
+# Seconds a writer waits for another process's transaction before failing
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    sha256 TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    names TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    sha256 TEXT NOT NULL REFERENCES uploads (sha256) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sha256, key)
+);
+CREATE INDEX IF NOT EXISTS artifacts_key ON artifacts (key);
+CREATE TABLE IF NOT EXISTS transcripts (
+    sha256 TEXT NOT NULL,
+    model_size TEXT NOT NULL,
+    language TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (sha256, model_size, language)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL,
+    version INTEGER NOT NULL,
+    snapshot TEXT NOT NULL,
+    result TEXT,
+    params TEXT,
+    owner TEXT,
+    pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE TABLE IF NOT EXISTS storage_files (
+    path TEXT PRIMARY KEY,
+    entry TEXT,
+    category TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS storage_files_entry ON storage_files (entry);
+CREATE TABLE IF NOT EXISTS job_partials (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class MetadataDB:
+    """Thread-local SQLite connections to one database file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self.transaction() as db:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    db.execute(statement)
+
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # New thread, or a forked child that must not reuse the parent's connection
+            local.connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                               check_same_thread=False)
+            local.connection.row_factory = sqlite3.Row
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            # With WAL, NORMAL only syncs at checkpoints; a power cut can lose the last commits, not corrupt
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection.execute('PRAGMA foreign_keys=ON')
+            local.depth = 0
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """A write transaction, serialized across threads and processes; nests"""
+        connection = self.connection()
+        local = self._local
+        if local.depth:
+            local.depth += 1
+            try:
+                yield connection
+            finally:
+                local.depth -= 1
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        local.depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+        finally:
+            local.depth = 0
+
+    def execute(self, sql, params=()):
+        """Run one statement in its own transaction (or the enclosing one); returns the cursor"""
+        return self.connection().execute(sql, params)
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
@@ -0,0 +1,257 @@
+"""
+Prometheus-style metrics without extra dependencies
+
+Counters and histograms are updated in place on the hot path (one lock and a
+bisect per observation); everything derived from other components' state
+(queue depth, cache hit ratios) is read by collectors only when ``/metrics`` is
+scraped. ``REGISTRY.render()`` produces the Prometheus text exposition format.
+
+Worker processes of a pre-fork server share a directory (``REGISTRY.share``):
+each writes its values there every few seconds, and a scrape of any worker
+renders the sum over all of them. Counters of exited workers are kept;
+gauges only count live workers (or take the maximum, or stay per process).
+"""
+
+import atexit
+import bisect
+import glob
+import os
+import threading
+import time
+
+from shared_state import pid_alive, read_json, write_json
+
+# Seconds; suits HTTP requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Seconds; suits pipeline stages and job waits
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+START_TIME = time.time()
+
+# Seconds between writes of this process's values to the shared directory
+SHARE_INTERVAL = 5.0
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self, values=None):
+        values = sorted((self.values() if values is None else values).items())
+        return [(self.name, _labels(self.label_names, key), value) for key, value in values]
+
+
+class Histogram:
+    """Cumulative bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2) + [0.0]
+            series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def values(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def samples(self, values=None):
+        series = sorted((self.values() if values is None else values).items())
+        samples = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                samples.append((f"{self.name}_bucket",
+                                _labels(self.label_names + ('le',), key + (_number(float(bound)),)), cumulative))
+            samples.append((f"{self.name}_count", _labels(self.label_names, key), values[-2]))
+            samples.append((f"{self.name}_sum", _labels(self.label_names, key), values[-1]))
+        return samples
+
+
+class Gauge:
+    """Value read from a callback at scrape time.
+
+    ``fn`` returns a number, or ``{label values tuple: number}`` for labelled gauges.
+    ``merge`` combines the values of worker processes: ``sum``, ``max`` or
+    ``local`` (this process only).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, fn, labels=(), kind='gauge', merge='sum'):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.fn = fn
+        self.kind = kind
+        self.merge = merge
+
+    def values(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def samples(self, values=None):
+        values = self.values() if values is None else values
+        return [(self.name, _labels(self.label_names, key), value) for key, value in sorted(values.items())]
+
+
+class Registry:
+    """The metrics of one process, rendered in registration order"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.shared_dir = None
+
+    def register(self, metric):
+        # Registering a name again (e.g. a reloaded module) returns the existing metric
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, fn, labels=(), kind='gauge', merge='sum'):
+        """Scrape-time value; ``kind='counter'`` for totals kept elsewhere"""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, fn, labels, kind, merge)
+            return self._metrics[name]
+
+    def share(self, directory):
+        """Aggregate with the other processes writing to ``directory``"""
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+        atexit.register(self.write_shared)
+
+        def run():
+            while True:
+                time.sleep(SHARE_INTERVAL)
+                self.write_shared()
+
+        threading.Thread(target=run, name='clipsai-metrics-share', daemon=True).start()
+
+    def _state(self, metrics):
+        # This process's values in JSON form: {name: [[label values], value], ...}
+        state = {}
+        for metric in metrics:
+            if getattr(metric, 'merge', 'sum') == 'local':
+                continue
+            try:
+                state[metric.name] = [[list(key), value] for key, value in metric.values().items()]
+            except Exception:
+                pass
+        return state
+
+    def write_shared(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        try:
+            write_json(os.path.join(self.shared_dir, f"{os.getpid()}.json"),
+                       {"pid": os.getpid(), "metrics": self._state(metrics)})
+        except OSError:
+            pass
+
+    def _merged(self, metrics):
+        # Values per metric summed over every process's last written state
+        own = self._state(metrics)
+        states = [(os.getpid(), own)]
+        for path in glob.glob(os.path.join(glob.escape(self.shared_dir), '*.json')):
+            data = read_json(path)
+            if data and data['pid'] != os.getpid():
+                states.append((data['pid'], data['metrics']))
+        merged = {}
+        for metric in metrics:
+            merge = getattr(metric, 'merge', 'sum')
+            if merge == 'local':
+                continue
+            values = merged[metric.name] = {}
+            for pid, state in states:
+                if metric.kind == 'gauge' and pid != os.getpid() and not pid_alive(pid):
+                    continue
+                for key, value in state.get(metric.name, ()):
+                    key = tuple(key)
+                    previous = values.get(key)
+                    if previous is None:
+                        values[key] = value
+                    elif isinstance(value, list):
+                        values[key] = [a + b for a, b in zip(previous, value)]
+                    elif merge == 'max':
+                        values[key] = max(previous, value)
+                    else:
+                        values[key] = previous + value
+        return merged
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        merged = self._merged(metrics) if self.shared_dir else {}
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples(merged.get(metric.name))
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REGISTRY.gauge('clipsai_uptime_seconds', "Seconds since the server process started",
+               lambda: round(time.time() - START_TIME, 3), merge='max')
@@ -0,0 +1,233 @@
+"""
+Process-wide pool of loaded Whisper models
+
+Loading a model dominates short transcriptions, so loaded models are kept warm
+and shared by every request and job. When the estimated memory of the loaded
+models exceeds the budget, the least recently used idle models are evicted.
+Models in use are never evicted. Work that loads models in other processes
+(parallel transcription) reserves their memory under the same budget.
+
+The backend is chosen by ``CLIPSAI_WHISPER_BACKEND``: ``whisperx``, ``simulated``
+(a small local stand-in without weights, used for testing) or ``auto``.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+# Approximate resident size per model (see README "Model Selection")
+MODEL_MEMORY = {
+    'tiny': 1024 * MB,
+    'base': 1024 * MB,
+    'small': 2048 * MB,
+    'medium': 5120 * MB,
+    'large-v2': 10240 * MB,
+}
+
+
+class SimulatedWhisperModel:
+    """Stand-in for a Whisper model: no weights, deterministic output"""
+
+    SAMPLE_TRANSCRIPT = "This is a sample transcription of the uploaded video. In a real implementation, this would be generated using WhisperX with the selected model size."
+
+    def __init__(self, model_size, load_seconds=0.2, seconds=1.8):
+        time.sleep(load_seconds)
+        self.model_size = model_size
+        self.seconds = seconds
+
+    def transcribe(self, audio, language=None, progress=None):
+        # ``audio`` is a path or 16 kHz samples; samples set the length of the
+        # output (and of the simulated work), a path gives the sample recording
+        duration = 85.7
+        tokens = self.SAMPLE_TRANSCRIPT.split()
+        if audio is not None and not isinstance(audio, str):
+            duration = len(audio) / 16000
+            tokens = tokens * max(1, round(duration / 85.7))
+
+        steps = 20
+        for step in range(1, steps + 1):
+            time.sleep(self.seconds * duration / 85.7 / steps)
+            if progress:
+                progress(step / steps)
+
+        step = duration / len(tokens)
+        words = [{"word": token, "start": round(i * step, 3), "end": round((i + 0.8) * step, 3), "score": 0.94}
+                 for i, token in enumerate(tokens)]
+        return {"language": language or "en", "duration": duration, "words": words}
+
+
+class WhisperXModel:
+    """Adapter giving a WhisperX model the pool's ``transcribe`` interface"""
+
+    def __init__(self, model_size):
+        import whisperx
+        self.whisperx = whisperx
+        self.device = os.environ.get('CLIPSAI_DEVICE', 'cpu')
+        compute_type = 'float16' if self.device == 'cuda' else 'int8'
+        self.model = whisperx.load_model(model_size, self.device, compute_type=compute_type)
+        self.model_size = model_size
+        self._align_models = {}
+
+    def transcribe(self, audio, language=None, progress=None):
+        # A path, or 16 kHz mono float32 samples (as load_audio returns)
+        if isinstance(audio, str):
+            audio = self.whisperx.load_audio(audio)
+        result = self.model.transcribe(audio, batch_size=16, language=language)
+        if progress:
+            progress(0.8)
+        language = result['language']
+        if language not in self._align_models:
+            self._align_models[language] = self.whisperx.load_align_model(language, self.device)
+        align_model, metadata = self._align_models[language]
+        aligned = self.whisperx.align(result['segments'], align_model, metadata, audio, self.device)
+        words = [{"word": w['word'], "start": w['start'], "end": w['end'], "score": w.get('score', 0.0)}
+                 for seg in aligned['segments'] for w in seg.get('words', []) if 'start' in w]
+        if progress:
+            progress(1.0)
+        return {"language": language, "duration": len(audio) / 16000, "words": words}
+
+
+def load_whisper_model(model_size):
+    """Default loader honouring CLIPSAI_WHISPER_BACKEND"""
+    backend = os.environ.get('CLIPSAI_WHISPER_BACKEND', 'auto')
+    if backend in ('auto', 'whisperx'):
+        try:
+            return WhisperXModel(model_size)
+        except ImportError:
+            if backend == 'whisperx':
+                raise
+    return SimulatedWhisperModel(model_size)
+
+
+class _Entry:
+    def __init__(self):
+        self.model = None
+        self.size = 0
+        self.in_use = 0
+        self.ready = threading.Event()
+        self.error = None
+
+
+class ModelPool:
+    """Keeps models warm, shares them across threads and evicts LRU under a memory budget"""
+
+    def __init__(self, loader=load_whisper_model, budget=12 * 1024 * MB, memory=None):
+        self.loader = loader
+        self.budget = budget
+        self.memory = dict(MODEL_MEMORY, **(memory or {}))
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # model_size -> _Entry, least recent first
+
+    def is_loaded(self, model_size):
+        with self._lock:
+            entry = self._entries.get(model_size)
+            return entry is not None and entry.ready.is_set() and entry.error is None
+
+    @contextlib.contextmanager
+    def acquire(self, model_size):
+        """Borrow a loaded model, loading it once if needed; concurrent callers share the load"""
+        with self._lock:
+            entry = self._entries.get(model_size)
+            loading = entry is None
+            if loading:
+                entry = self._entries[model_size] = _Entry()
+                entry.size = self.memory.get(model_size, 1024 * MB)
+                self.loads += 1
+            else:
+                self.hits += 1
+            entry.in_use += 1
+            self._entries.move_to_end(model_size)
+
+        try:
+            if loading:
+                self._load(model_size, entry)
+            entry.ready.wait()
+            if entry.error is not None:
+                raise entry.error
+            yield entry.model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                self._evict()
+
+    def _load(self, model_size, entry):
+        with self._lock:
+            # Make room before loading so peak memory stays within budget where possible
+            self._evict()
+        try:
+            entry.model = self.loader(model_size)
+            print(f"🧠 Loaded Whisper model '{model_size}'")
+        except Exception as e:
+            entry.error = e
+            with self._lock:
+                if self._entries.get(model_size) is entry:
+                    del self._entries[model_size]
+        finally:
+            entry.ready.set()
+
+    @contextlib.contextmanager
+    def reserve(self, model_size, copies):
+        """Reserve memory for up to ``copies`` of a model loaded in other processes.
+
+        Idle models are evicted to make room. Yields the number of copies that
+        fit the budget, at least one; the memory is held until the block exits.
+        """
+        size = self.memory.get(model_size, 1024 * MB)
+        with self._lock:
+            self._evict(copies * size)
+            available = self.budget - self._reserved - sum(e.size for e in self._entries.values())
+            granted = max(1, min(copies, available // size))
+            self._reserved += granted * size
+        try:
+            yield granted
+        finally:
+            with self._lock:
+                self._reserved -= granted * size
+
+    def _evict(self, needed=0):
+        # Evict idle models, least recently used first, until ``needed`` more bytes fit the budget (lock held)
+        loaded = sum(e.size for e in self._entries.values()) + self._reserved + needed
+        for model_size, entry in list(self._entries.items()):
+            if loaded <= self.budget:
+                break
+            if entry.in_use or not entry.ready.is_set():
+                continue
+            del self._entries[model_size]
+            loaded -= entry.size
+            self.evictions += 1
+            entry.model = None
+            print(f"🧹 Evicted Whisper model '{model_size}'")
+
+    def preload(self, model_sizes):
+        """Load models in a background thread so the server can answer immediately"""
+        def run():
+            for model_size in model_sizes:
+                try:
+                    with self.acquire(model_size):
+                        pass
+                except Exception as e:
+                    print(f"⚠️  Could not preload model '{model_size}': {e}")
+
+        thread = threading.Thread(target=run, name='clipsai-model-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": [size for size, e in self._entries.items() if e.ready.is_set()],
+                "loading": [size for size, e in self._entries.items() if not e.ready.is_set()],
+                "bytes": sum(e.size for e in self._entries.values()),
+                "reserved_bytes": self._reserved,
+                "budget": self.budget,
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+            }
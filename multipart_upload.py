@@ -0,0 +1,216 @@
+"""
+Single-pass streaming parser for multipart/form-data uploads
+
+Replaces cgi.FieldStorage (removed in Python 3.13). File parts are written
+straight to their destination while the request body is read, hashed on the
+fly, and aborted as soon as the server-side size limit is exceeded.
+"""
+
+import email.message
+import hashlib
+import os
+
+# Bytes requested from the socket per read
+READ_SIZE = 64 * 1024
+# Limits for the non-file parts of the form
+MAX_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """The request body is not valid multipart/form-data"""
+
+
+class UploadTooLarge(Exception):
+    """The uploaded file exceeds the configured size limit"""
+
+    def __init__(self, limit):
+        super().__init__(f"File exceeds the {limit / (1024 * 1024):.0f}MB upload limit")
+        self.limit = limit
+
+
+class UploadedFile:
+    """A file part that has been written to disk"""
+
+    def __init__(self, field_name, filename, content_type, path):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self.sha256 = None
+
+
+def get_header_param(value, param, header='content-type'):
+    """Return a parameter such as ``boundary`` or ``name`` from a MIME header value"""
+    msg = email.message.Message()
+    msg[header] = value
+    if param == 'filename':
+        return msg.get_filename()
+    return msg.get_param(param, header=header)
+
+
+def clean_filename(filename):
+    """Strip client-side directories (old browsers send full paths) from a filename"""
+    filename = filename.replace('\\', '/').split('/')[-1]
+    return filename.strip().lstrip('.') or None
+
+
+class MultipartParser:
+    """Incremental multipart/form-data parser reading a body of known length.
+
+    ``open_file(field_name, filename, content_type)`` is called for each file
+    part and must return the path to write it to. Returns ``(fields, files)``
+    from :meth:`parse`, where ``fields`` maps names to strings and ``files``
+    maps names to :class:`UploadedFile`. With ``file_fields`` only file parts
+    of those names are written; others are drained unread. No written file is
+    left behind by a part that is sent again or a body that fails to parse.
+    """
+
+    def __init__(self, rfile, content_type, content_length, open_file, max_file_size=None, file_fields=None):
+        boundary = get_header_param(content_type, 'boundary')
+        if not boundary:
+            raise MultipartError("Missing multipart boundary")
+        self.rfile = rfile
+        self.remaining = content_length
+        self.open_file = open_file
+        self.max_file_size = max_file_size
+        self.file_fields = file_fields
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # Treat the body as if preceded by CRLF so the first boundary matches the delimiter
+        self.buffer = b'\r\n'
+
+    def _fill(self):
+        """Read more of the body into the buffer; returns False at end of body"""
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(READ_SIZE, self.remaining))
+        if not data:
+            raise MultipartError("Request body ended early")
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def _read_until(self, marker, limit):
+        """Consume and return the buffer up to ``marker`` (which is also consumed)"""
+        while True:
+            index = self.buffer.find(marker)
+            if index >= 0:
+                data = self.buffer[:index]
+                self.buffer = self.buffer[index + len(marker):]
+                return data
+            if len(self.buffer) > limit:
+                raise MultipartError("Multipart section too large")
+            if not self._fill():
+                raise MultipartError("Unexpected end of multipart body")
+
+    def _stream_until_delimiter(self, write):
+        """Pass part data to ``write`` until the next delimiter, keeping memory bounded"""
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    write(self.buffer[:index])
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                return
+            if len(self.buffer) > keep:
+                write(self.buffer[:-keep])
+                self.buffer = self.buffer[-keep:]
+            if not self._fill():
+                raise MultipartError("Unexpected end of multipart body")
+
+    def _read_part_headers(self):
+        raw = self._read_until(b'\r\n\r\n', MAX_HEADER_SIZE)
+        headers = {}
+        for line in raw.decode('utf-8', 'replace').split('\r\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        return headers
+
+    def parse(self):
+        files = {}
+        try:
+            return self._parse(files)
+        except BaseException:
+            for upload in files.values():
+                _remove(upload.path)
+            raise
+
+    def _parse(self, files):
+        fields = {}
+        # Skip the preamble up to the first boundary
+        self._read_until(self.delimiter, MAX_HEADER_SIZE)
+
+        while True:
+            while len(self.buffer) < 2 and self._fill():
+                pass
+            if self.buffer.startswith(b'--'):
+                break
+            if not self.buffer.startswith(b'\r\n'):
+                raise MultipartError("Malformed multipart boundary")
+            self.buffer = self.buffer[2:]
+
+            headers = self._read_part_headers()
+            disposition = headers.get('content-disposition', '')
+            name = get_header_param(disposition, 'name', 'content-disposition')
+            filename = get_header_param(disposition, 'filename', 'content-disposition')
+
+            if filename is None:
+                chunks = []
+                size = [0]
+
+                def collect(data):
+                    size[0] += len(data)
+                    if size[0] > MAX_FIELD_SIZE:
+                        raise MultipartError(f"Form field '{name}' too large")
+                    chunks.append(data)
+
+                self._stream_until_delimiter(collect)
+                if name:
+                    fields[name] = b''.join(chunks).decode('utf-8', 'replace')
+                continue
+
+            filename = clean_filename(filename)
+            if not filename or (self.file_fields is not None and name not in self.file_fields):
+                # Empty file input, or a file nobody asked for: drain the part
+                self._stream_until_delimiter(lambda data: None)
+                continue
+            upload = self._write_file_part(name, filename, headers.get('content-type', 'application/octet-stream'))
+            if name in files:
+                # The last part of a name wins; drop the file of the earlier one
+                _remove(files[name].path)
+            files[name] = upload
+
+        # Discard the epilogue
+        while self._fill():
+            self.buffer = b''
+        return fields, files
+
+    def _write_file_part(self, name, filename, content_type):
+        upload = UploadedFile(name, filename, content_type, None)
+        upload.path = self.open_file(name, filename, content_type)
+        digest = hashlib.sha256()
+        try:
+            with open(upload.path, 'wb') as f:
+                def write(data):
+                    upload.size += len(data)
+                    if self.max_file_size is not None and upload.size > self.max_file_size:
+                        raise UploadTooLarge(self.max_file_size)
+                    digest.update(data)
+                    f.write(data)
+
+                self._stream_until_delimiter(write)
+        except BaseException:
+            _remove(upload.path)
+            raise
+        upload.sha256 = digest.hexdigest()
+        return upload
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,165 @@
+"""
+Chunked parallel transcription for long recordings
+
+The upload's extracted audio (see audio_cache.py) is split at silences into
+chunks of roughly ``CLIPSAI_TRANSCRIBE_CHUNK_SECONDS``, and the chunks are
+transcribed concurrently on a process pool. Each worker process keeps its own
+model and memory-maps its chunk straight from the shared audio file. The
+models' memory is reserved in the server's model pool, which caps the number
+of worker processes, and the processes exit when the transcription ends.
+Word timestamps are shifted back to positions in the whole recording, and each
+finished chunk is reported as a partial result before the transcript is
+stitched together.
+"""
+
+import collections
+import contextlib
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import model_pool
+from audio_cache import SAMPLE_RATE, open_samples
+from process_pool import ProcessPool
+
+CHUNK_SECONDS = float(os.environ.get('CLIPSAI_TRANSCRIBE_CHUNK_SECONDS', '300'))
+# Recordings shorter than this are transcribed in one piece in "auto" mode
+PARALLEL_MIN_SECONDS = float(os.environ.get('CLIPSAI_PARALLEL_MIN_SECONDS', '600'))
+MIN_SILENCE = 0.3
+FRAME_SECONDS = 0.02
+
+# Per worker process: the last model used, kept warm between chunks
+_worker_model = None
+
+
+def transcribe_workers():
+    return int(os.environ.get('CLIPSAI_TRANSCRIBE_WORKERS', '0')) or min(4, os.cpu_count() or 1)
+
+
+# The workers' models are only accounted for while a transcription runs, so the pool does not outlive it
+_pool = ProcessPool(transcribe_workers, idle_seconds=0)
+
+
+def frame_energy(samples, hop):
+    """RMS level of consecutive ``hop``-sample frames, computed block by block"""
+    frames = len(samples) // hop
+    energy = np.empty(frames, dtype=np.float32)
+    block = max(1, (1 << 22) // hop)
+    for first in range(0, frames, block):
+        last = min(frames, first + block)
+        chunk = np.asarray(samples[first * hop:last * hop]).reshape(-1, hop)
+        energy[first:last] = np.sqrt(np.mean(chunk * chunk, axis=1))
+    return energy
+
+
+def silence_threshold(energy):
+    """Frame level below which audio counts as silence: a small factor over the noise floor"""
+    return max(2.0 * float(np.percentile(energy, 10)), 1e-3) if len(energy) else 1e-3
+
+
+def split_points(samples, chunk_seconds=CHUNK_SECONDS, rate=SAMPLE_RATE):
+    """Chunk ``(start, end)`` sample ranges, cut in the longest silence near each target length"""
+    total = len(samples)
+    target = int(chunk_seconds * rate)
+    if total <= target * 1.25:
+        return [(0, total)]
+
+    hop = int(FRAME_SECONDS * rate)
+    energy = frame_energy(samples, hop)
+    silent = np.concatenate(([False], energy < silence_threshold(energy), [False]))
+    edges = np.flatnonzero(silent[1:] != silent[:-1])
+    run_starts, run_ends = edges[0::2], edges[1::2]
+    long_enough = (run_ends - run_starts) * FRAME_SECONDS >= MIN_SILENCE
+    centres = (run_starts[long_enough] + run_ends[long_enough]) // 2 * hop
+    lengths = (run_ends - run_starts)[long_enough]
+
+    points = [0]
+    while total - points[-1] > target * 1.25:
+        previous = points[-1]
+        cut = None
+        for spread in (0.25, 0.5):
+            window = (centres >= previous + target * (1 - spread)) & (centres <= previous + target * (1 + spread))
+            if window.any():
+                cut = int(centres[window][np.argmax(lengths[window])])
+                break
+        points.append(cut if cut is not None else previous + target)
+    points.append(total)
+    return list(zip(points[:-1], points[1:]))
+
+
+def transcribe_chunk(audio_path, start, end, model_size, language):
+    """Runs in a worker process: transcribe one sample range of the audio file"""
+    global _worker_model
+    if _worker_model is None or _worker_model.model_size != model_size:
+        _worker_model = None
+        _worker_model = model_pool.load_whisper_model(model_size)
+    return _worker_model.transcribe(open_samples(audio_path)[start:end], language)
+
+
+def transcribe(job, audio_path, model_size, language=None, chunk_seconds=CHUNK_SECONDS, on_chunk=None,
+               models=None):
+    """Transcribe an extracted audio file in parallel chunks; returns a model-style result.
+
+    With ``models`` (a ModelPool) the worker processes' models are reserved
+    under its memory budget, and only as many workers start as fit.
+    """
+    samples = open_samples(audio_path)
+    total_samples = len(samples)
+    chunks = split_points(samples, chunk_seconds)
+    del samples
+    workers = min(transcribe_workers(), len(chunks))
+    reservation = models.reserve(model_size, workers) if models is not None else contextlib.nullcontext(workers)
+    with reservation as workers, _pool.use(workers) as pool:
+        return _transcribe_chunks(job, pool, audio_path, chunks, total_samples, model_size, language, on_chunk)
+
+
+def _transcribe_chunks(job, pool, audio_path, chunks, total_samples, model_size, language, on_chunk):
+    job.update(0.1, 'transcribing', f"0/{len(chunks)} chunks")
+    futures = {pool.submit(transcribe_chunk, audio_path, start, end, model_size, language): index
+               for index, (start, end) in enumerate(chunks)}
+    pieces = {}
+    done_samples = 0
+    try:
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            job.check_cancelled()
+            for future in finished:
+                index = futures[future]
+                try:
+                    output = future.result()
+                except BrokenProcessPool:
+                    _pool.reset()
+                    raise
+                start, end = chunks[index]
+                offset = start / SAMPLE_RATE
+                words = [dict(w, start=round(w['start'] + offset, 3), end=round(w['end'] + offset, 3))
+                         for w in output['words']]
+                pieces[index] = (output['language'], words)
+                done_samples += end - start
+                if on_chunk:
+                    on_chunk({
+                        "chunk": index,
+                        "chunks": len(chunks),
+                        "start": round(offset, 3),
+                        "end": round(end / SAMPLE_RATE, 3),
+                        "language": output['language'],
+                        "text": ' '.join(w['word'] for w in words),
+                        "words": words,
+                    })
+                job.update(0.1 + 0.9 * done_samples / total_samples,
+                           message=f"{len(pieces)}/{len(chunks)} chunks")
+    finally:
+        for future in futures:
+            future.cancel()
+
+    words = [w for index in sorted(pieces) for w in pieces[index][1]]
+    languages = collections.Counter(language for language, _ in pieces.values())
+    return {
+        "language": language or languages.most_common(1)[0][0],
+        "duration": total_samples / SAMPLE_RATE,
+        "words": words,
+        "chunks": len(chunks),
+    }
@@ -0,0 +1,294 @@
+"""
+Pre-fork serving: several server processes on one listening socket
+
+The master binds the socket once and starts ``processes`` workers, each a
+fresh interpreter running the server on the inherited socket (its descriptor
+is passed in ``CLIPSAI_LISTEN_FD``). The kernel hands each new connection to
+one of the workers waiting in ``accept``, so CPU-bound request work (JSON
+encoding, hashing, multipart parsing) runs on every core instead of one GIL.
+
+The master supervises the workers:
+  * each worker writes to a heartbeat pipe while its accept loop runs; one
+    that stays silent for ``CLIPSAI_WORKER_TIMEOUT`` seconds is killed
+  * workers that exit are restarted, with a growing delay if they keep
+    crashing right after starting
+  * ``SIGHUP`` restarts the workers gracefully: replacements (running the
+    current code) start first, then each old worker stops accepting, finishes
+    its requests and jobs for up to ``CLIPSAI_GRACEFUL_TIMEOUT`` seconds and
+    exits
+  * ``SIGTERM`` or ``SIGINT`` stops all workers the same way
+
+State the workers share lives in the upload directory (see shared_state.py).
+"""
+
+import errno
+import os
+import select
+import signal
+import socket
+import subprocess
+import time
+import uuid
+
+# Seconds without a heartbeat before a worker counts as hung
+WORKER_TIMEOUT = float(os.environ.get('CLIPSAI_WORKER_TIMEOUT', '30'))
+# Seconds a stopping worker gets to finish its requests and jobs
+GRACEFUL_TIMEOUT = float(os.environ.get('CLIPSAI_GRACEFUL_TIMEOUT', '30'))
+# A worker exiting sooner than this after starting counts as a crash loop
+MIN_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+HEARTBEAT_INTERVAL = 1.0
+
+LISTEN_FD_ENV = 'CLIPSAI_LISTEN_FD'
+HEARTBEAT_FD_ENV = 'CLIPSAI_HEARTBEAT_FD'
+WORKER_INDEX_ENV = 'CLIPSAI_WORKER_INDEX'
+RUN_ID_ENV = 'CLIPSAI_RUN_ID'
+
+
+class PortInUse(OSError):
+    """The requested port is taken by another process"""
+
+
+def process_count(value):
+    """``0`` means one worker per CPU"""
+    value = int(value)
+    return value if value > 0 else (os.cpu_count() or 1)
+
+
+def bind_socket(host, port, fallback=0, backlog=128):
+    """Bind and listen on ``port``, or on one of the next ``fallback`` ports if asked to"""
+    for candidate in range(port, port + fallback + 1):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, candidate))
+        except OSError as e:
+            sock.close()
+            if e.errno != errno.EADDRINUSE:
+                raise
+            if candidate == port + fallback:
+                raise PortInUse(e.errno, f"Port {candidate} is already in use") from None
+            print(f"⚠️  Port {candidate} is already in use, trying port {candidate + 1}")
+            continue
+        sock.listen(backlog)
+        return sock
+
+
+def is_worker():
+    return LISTEN_FD_ENV in os.environ
+
+
+def worker_index():
+    return int(os.environ.get(WORKER_INDEX_ENV, '0'))
+
+
+def run_id():
+    """Identifies this run of the server: the same in the master and all its workers"""
+    return os.environ.setdefault(RUN_ID_ENV, uuid.uuid4().hex)
+
+
+def inherited_socket():
+    """The listening socket passed by the master, or None outside a worker"""
+    if not is_worker():
+        return None
+    sock = socket.socket(fileno=int(os.environ[LISTEN_FD_ENV]))
+    # Every worker wakes up for a new connection; the losers must not block in accept
+    sock.setblocking(False)
+    return sock
+
+
+class Heartbeat:
+    """Worker side of the heartbeat pipe; ``beat`` is cheap enough to call from the accept loop"""
+
+    def __init__(self, fd, on_orphaned):
+        self.fd = fd
+        self.on_orphaned = on_orphaned
+        self.orphaned = False
+        self._last = 0.0
+        os.set_blocking(fd, False)
+
+    @classmethod
+    def from_environ(cls, on_orphaned):
+        fd = os.environ.get(HEARTBEAT_FD_ENV)
+        return cls(int(fd), on_orphaned) if fd else None
+
+    def beat(self):
+        now = time.monotonic()
+        if self.orphaned or now - self._last < HEARTBEAT_INTERVAL:
+            return
+        self._last = now
+        try:
+            os.write(self.fd, b'.')
+        except BlockingIOError:
+            pass
+        except OSError:
+            # The master is gone: nobody supervises or restarts this worker
+            self.orphaned = True
+            self.on_orphaned()
+
+
+class Worker:
+    def __init__(self, index, process, heartbeat_fd):
+        self.index = index
+        self.process = process
+        self.heartbeat_fd = heartbeat_fd
+        self.started = time.monotonic()
+        self.last_beat = self.started
+        self.ready = False
+        # Set once the worker has been asked to stop
+        self.stop_deadline = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+
+class Supervisor:
+    """Runs and supervises ``processes`` workers on ``sock`` until SIGTERM or SIGINT"""
+
+    def __init__(self, sock, processes, command, env=None, worker_timeout=WORKER_TIMEOUT,
+                 graceful_timeout=GRACEFUL_TIMEOUT):
+        self.sock = sock
+        self.processes = processes
+        self.command = command
+        self.env = dict(os.environ if env is None else env)
+        self.worker_timeout = worker_timeout
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}  # index -> current worker
+        self.retiring = []  # replaced workers finishing their work
+        self._restart_delay = {}
+        self._respawn_at = {}
+        self._stopping = False
+        self._restart_requested = False
+
+    def spawn(self, index):
+        read_fd, write_fd = os.pipe()
+        env = dict(self.env, **{LISTEN_FD_ENV: str(self.sock.fileno()), HEARTBEAT_FD_ENV: str(write_fd),
+                                WORKER_INDEX_ENV: str(index)})
+        process = subprocess.Popen(self.command, env=env, pass_fds=(self.sock.fileno(), write_fd))
+        os.close(write_fd)
+        worker = Worker(index, process, read_fd)
+        print(f"👷 Started worker {index} (pid {worker.pid})")
+        return worker
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_restart)
+        for index in range(self.processes):
+            self.workers[index] = self.spawn(index)
+        try:
+            while self.workers or self.retiring or self._respawn_at:
+                self._poll_heartbeats()
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self._restart()
+                if self._stopping:
+                    self._stop_all()
+                self._check_workers()
+        finally:
+            for worker in list(self.workers.values()) + self.retiring:
+                if worker.process.poll() is None:
+                    worker.process.kill()
+            self.sock.close()
+
+    def _request_stop(self, signum, frame):
+        if self._stopping:
+            print("⚠️  Stopping workers now")
+            for worker in list(self.workers.values()) + self.retiring:
+                if worker.process.poll() is None:
+                    worker.process.kill()
+        self._stopping = True
+
+    def _request_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def _poll_heartbeats(self):
+        fds = {worker.heartbeat_fd: worker for worker in list(self.workers.values()) + self.retiring
+               if worker.heartbeat_fd is not None}
+        try:
+            readable, _, _ = select.select(list(fds), [], [], 0.5)
+        except InterruptedError:
+            return
+        now = time.monotonic()
+        for fd in readable:
+            worker = fds[fd]
+            if os.read(fd, 4096):
+                worker.last_beat = now
+                if not worker.ready:
+                    worker.ready = True
+                    self._retire_replaced(worker.index)
+            else:
+                os.close(fd)
+                worker.heartbeat_fd = None
+
+    def _restart(self):
+        print(f"🔁 Restarting {len(self.workers)} workers")
+        for index, worker in list(self.workers.items()):
+            self.retiring.append(worker)
+            self.workers[index] = self.spawn(index)
+
+    def _retire_replaced(self, index):
+        # The replacement for ``index`` accepts connections: let the old worker finish
+        for worker in self.retiring:
+            if worker.index == index and worker.stop_deadline is None:
+                self._stop(worker)
+
+    def _stop(self, worker):
+        worker.stop_deadline = time.monotonic() + self.graceful_timeout + 5
+        if worker.process.poll() is None:
+            worker.process.send_signal(signal.SIGTERM)
+
+    def _stop_all(self):
+        for worker in list(self.workers.values()) + self.retiring:
+            if worker.stop_deadline is None:
+                self._stop(worker)
+        self.retiring.extend(self.workers.values())
+        self.workers.clear()
+        self._respawn_at.clear()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self.retiring):
+            if worker.process.poll() is not None:
+                self.retiring.remove(worker)
+                self._close(worker)
+                print(f"👋 Worker {worker.index} (pid {worker.pid}) exited")
+            elif worker.stop_deadline is not None and now > worker.stop_deadline:
+                print(f"⚠️  Worker {worker.index} (pid {worker.pid}) did not stop in time; killing it")
+                worker.process.kill()
+                worker.stop_deadline = now + 5
+        for index, worker in list(self.workers.items()):
+            code = worker.process.poll()
+            if code is None:
+                if now - worker.last_beat > self.worker_timeout:
+                    print(f"⚠️  Worker {index} (pid {worker.pid}) sent no heartbeat for "
+                          f"{self.worker_timeout:.0f}s; killing it")
+                    worker.process.kill()
+                    worker.last_beat = now
+                continue
+            self._close(worker)
+            del self.workers[index]
+            delay = 0.0
+            if now - worker.started < MIN_UPTIME:
+                delay = min(MAX_RESTART_DELAY, max(0.5, self._restart_delay.get(index, 0) * 2))
+            self._restart_delay[index] = delay
+            print(f"⚠️  Worker {index} (pid {worker.pid}) exited with code {code}; "
+                  f"restarting in {delay:.1f}s")
+            self._respawn_at[index] = now + delay
+        for index, when in list(self._respawn_at.items()):
+            if now >= when:
+                del self._respawn_at[index]
+                self.workers[index] = self.spawn(index)
+
+    def _close(self, worker):
+        if worker.heartbeat_fd is not None:
+            os.close(worker.heartbeat_fd)
+            worker.heartbeat_fd = None
+
+
+def install_worker_signals(stop):
+    """Worker side: SIGTERM calls ``stop``; SIGINT is left to the master"""
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
@@ -0,0 +1,76 @@
+"""
+Process pools for CPU-bound pipeline work
+
+Batch clip cutting and parallel transcription each run their work on a
+:class:`ProcessPool`: a ``ProcessPoolExecutor`` started on first use, shut
+down once it has been idle for a while (so its processes, and whatever they
+loaded, do not stay around for good) and replaced when one of its workers dies.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Seconds an unused pool keeps its processes
+IDLE_SECONDS = float(os.environ.get('CLIPSAI_POOL_IDLE_SECONDS', '60'))
+
+
+class ProcessPool:
+    """A lazily started process pool; ``workers()`` gives its default size"""
+
+    def __init__(self, workers, idle_seconds=IDLE_SECONDS):
+        self.workers = workers
+        self.idle_seconds = idle_seconds
+        self._executor = None
+        self._size = 0
+        self._users = 0
+        self._idle_timer = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def use(self, workers=None):
+        """The executor, with ``workers`` processes if given; kept running while in use"""
+        workers = workers or self.workers()
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if self._executor is not None and not self._users and self._size != workers:
+                self._shutdown()
+            if self._executor is None:
+                # spawn: forking a process that runs server threads can deadlock
+                self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._size = workers
+            self._users += 1
+            executor = self._executor
+        try:
+            yield executor
+        finally:
+            with self._lock:
+                self._users -= 1
+                if not self._users and self._executor is not None:
+                    if self.idle_seconds > 0:
+                        self._idle_timer = threading.Timer(self.idle_seconds, self._shutdown_idle)
+                        self._idle_timer.daemon = True
+                        self._idle_timer.start()
+                    else:
+                        self._shutdown()
+
+    def reset(self):
+        """Replace a pool whose worker died so later jobs get fresh processes"""
+        with self._lock:
+            self._shutdown()
+
+    def _shutdown_idle(self):
+        with self._lock:
+            if not self._users:
+                self._shutdown()
+
+    def _shutdown(self):
+        # (lock held)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
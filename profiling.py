@@ -0,0 +1,275 @@
+"""
+Opt-in request and job profiling
+
+A traced request or job records nested timing spans: the request itself, the
+spans code marks with :func:`span` (body parsing, disk I/O, model inference,
+ffmpeg runs) and each pipeline stage a job reports. With ``cprofile`` the
+traced thread also runs under cProfile. Finished traces are kept in memory
+(the last ``CLIPSAI_PROFILE_KEEP``) and exported as Chrome trace-event JSON,
+which chrome://tracing and Perfetto open.
+
+Tracing is enabled per request with an ``X-ClipsAI-Profile: 1`` (or
+``cprofile``) header or a ``profile=1`` query parameter, and for a fraction
+``CLIPSAI_PROFILE_SAMPLE_RATE`` of all other requests and jobs. Setting
+``CLIPSAI_PROFILE_FLAGS=0`` ignores the header and query flags, leaving only
+sampling. Jobs submitted while a request is traced are traced too. Without an
+active trace, :func:`span` returns a shared no-op context manager.
+
+Worker processes of a pre-fork server also write finished traces to a shared
+directory (``TRACES.share``), so any worker can list and export them.
+"""
+
+import collections
+import contextlib
+import contextvars
+import glob
+import os
+import random
+import threading
+import time
+import uuid
+
+from shared_state import read_json, write_json
+
+SAMPLE_RATE = float(os.environ.get('CLIPSAI_PROFILE_SAMPLE_RATE', '0'))
+HONOUR_FLAGS = os.environ.get('CLIPSAI_PROFILE_FLAGS', '1') != '0'
+KEEP = int(os.environ.get('CLIPSAI_PROFILE_KEEP', '100'))
+
+SPANS = 'spans'
+CPROFILE = 'cprofile'
+_MODES = {'1': SPANS, 'true': SPANS, 'spans': SPANS, 'cprofile': CPROFILE}
+
+_current = contextvars.ContextVar('clipsai_trace', default=None)
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Trace:
+    """Spans recorded for one request or job"""
+
+    def __init__(self, name, kind, mode, args):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.kind = kind
+        self.mode = mode
+        self.args = args
+        self.started = time.time()
+        self.duration = None
+        self.profile_text = None
+        self._origin = time.perf_counter()
+        self._events = []
+        self._stage = None
+        self._lock = threading.Lock()
+        self._token = None
+        self._profiler = None
+
+    def add(self, name, category, start, end, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+
+    def mark_stage(self, stage):
+        """End the current stage span and start ``stage`` (None just ends it)"""
+        now = time.perf_counter()
+        if self._stage is not None:
+            name, start = self._stage
+            self.add(name, 'stage', start, now)
+        self._stage = (stage, now) if stage is not None else None
+
+    def summary(self):
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "kind": self.kind,
+            "mode": self.mode,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "spans": len(self._events),
+            "has_profile": self.profile_text is not None,
+            **self.args,
+        }
+
+    def to_chrome(self):
+        """Chrome trace-event JSON object"""
+        with self._lock:
+            events = list(self._events)
+        threads = {event["tid"] for event in events}
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                     "args": {"name": f"{self.kind} thread {tid}"}} for tid in sorted(threads)]
+        return {"traceEvents": metadata + sorted(events, key=lambda e: (e["ts"], -e["dur"])),
+                "displayTimeUnit": "ms", "otherData": self.summary()}
+
+
+class StoredTrace:
+    """A trace another process wrote to the shared directory"""
+
+    def __init__(self, data):
+        self.id = data['summary']['trace_id']
+        self.profile_text = data['profile']
+        self._summary = data['summary']
+        self._chrome = data['chrome']
+
+    def summary(self):
+        return self._summary
+
+    def to_chrome(self):
+        return self._chrome
+
+
+class TraceStore:
+    """The most recent finished traces"""
+
+    def __init__(self, keep=KEEP):
+        self.keep = keep
+        self.shared_dir = None
+        self._lock = threading.Lock()
+        self._traces = collections.OrderedDict()
+
+    def share(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+
+    def add(self, trace):
+        with self._lock:
+            self._traces[trace.id] = trace
+            while len(self._traces) > self.keep:
+                self._traces.popitem(last=False)
+        if self.shared_dir:
+            self._write_shared(trace)
+
+    def _write_shared(self, trace):
+        try:
+            write_json(os.path.join(self.shared_dir, f"{trace.id}.trace"),
+                       {"summary": trace.summary(), "chrome": trace.to_chrome(), "profile": trace.profile_text})
+            write_json(os.path.join(self.shared_dir, f"{trace.id}.summary"), trace.summary())
+            for path in self._shared_summaries()[self.keep:]:
+                for suffix in ('summary', 'trace'):
+                    try:
+                        os.remove(f"{path[:-len('.summary')]}.{suffix}")
+                    except FileNotFoundError:
+                        pass
+        except OSError:
+            pass
+
+    def _shared_summaries(self):
+        # Newest first
+        paths = []
+        for path in glob.glob(os.path.join(glob.escape(self.shared_dir), '*.summary')):
+            try:
+                paths.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass
+        return [path for _, path in sorted(paths, reverse=True)]
+
+    def get(self, trace_id):
+        with self._lock:
+            trace = self._traces.get(trace_id)
+        if trace is None and self.shared_dir and trace_id.isalnum():
+            data = read_json(os.path.join(self.shared_dir, f"{trace_id}.trace"))
+            trace = StoredTrace(data) if data else None
+        return trace
+
+    def list(self):
+        if self.shared_dir:
+            summaries = (read_json(path) for path in self._shared_summaries()[:self.keep])
+            return [summary for summary in summaries if summary]
+        with self._lock:
+            return [trace.summary() for trace in reversed(self._traces.values())]
+
+
+TRACES = TraceStore()
+
+
+def requested_mode(flag):
+    """Trace mode for a request: its profile flag if honoured, else sampled"""
+    if flag is not None and HONOUR_FLAGS:
+        mode = _MODES.get(flag.strip().lower())
+        if mode:
+            return mode
+    return sampled_mode()
+
+
+def sampled_mode():
+    return SPANS if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE else None
+
+
+def current():
+    return _current.get()
+
+
+def start(name, kind, mode, **args):
+    """Begin tracing the calling thread; returns the trace, or None when ``mode`` is None"""
+    if mode is None:
+        return None
+    trace = Trace(name, kind, mode, {key: value for key, value in args.items() if value is not None})
+    trace._token = _current.set(trace)
+    if mode == CPROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            trace._profiler = profiler
+        except ValueError:
+            # Another profiler is active in this interpreter
+            trace.args["cprofile"] = "unavailable"
+    return trace
+
+
+def finish(trace):
+    """Stop tracing and keep the trace for export"""
+    end = time.perf_counter()
+    if trace._profiler is not None:
+        import io
+        import pstats
+        trace._profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(trace._profiler, stream=out).sort_stats('cumulative').print_stats(60)
+        trace.profile_text = out.getvalue()
+        trace._profiler = None
+    trace.mark_stage(None)
+    trace.add(trace.name, trace.kind, trace._origin, end, trace.args or None)
+    trace.duration = end - trace._origin
+    _current.reset(trace._token)
+    TRACES.add(trace)
+
+
+@contextlib.contextmanager
+def traced(mode, name, kind, **args):
+    trace = start(name, kind, mode, **args)
+    try:
+        yield trace
+    finally:
+        if trace is not None:
+            finish(trace)
+
+
+@contextlib.contextmanager
+def _span(trace, name, category, args):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, category, start_time, time.perf_counter(), args)
+
+
+def span(name, category='span', **args):
+    """Time a block as a span of the current trace; a no-op when not tracing"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _span(trace, name, category, args)
+
+
+def mark_stage(stage):
+    trace = _current.get()
+    if trace is not None:
+        trace.mark_stage(stage)
@@ -0,0 +1,142 @@
+"""
+Helpers for state shared by the worker processes of a pre-fork server
+
+Worker processes share the upload directory. Read-modify-write updates of
+files in it are serialized with :class:`FileLock`, and snapshots other workers
+read are written atomically with :func:`write_json`. Within one process,
+callers that need a result another thread is already computing wait on its
+:class:`Pending` instead of computing it again; :class:`DerivedResults` uses
+both to compute JSON results derived from an upload once across all workers.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+
+class Pending:
+    """Work in progress that other callers for the same result wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FileLock:
+    """Lock held across threads and processes (``flock`` on ``path``); reentrant per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            if self._pid != os.getpid():
+                # A forked child must not share the parent's open file (and its lock)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+def write_json(path, data):
+    """Replace ``path`` with ``data`` as JSON; readers never see a partial file"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    """Contents of a JSON file, or None if it is missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DerivedResults:
+    """JSON results derived from uploads, computed once and stored next to the upload.
+
+    Callers in this process wait on the thread computing a result; other
+    server processes wait on its file lock and then read the stored file.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.computed = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def get(self, sha256, suffix, compute):
+        """The result stored as ``.<sha256>.<suffix>``, or ``compute(record)`` stored there"""
+        key = (sha256, suffix)
+        while True:
+            record = self.store.get(sha256)
+            if record is None:
+                raise KeyError(sha256)
+            path = self.store.derived_path(sha256, suffix)
+            result = read_json(path)
+            if result is not None:
+                with self._lock:
+                    self.reused += 1
+                return result
+            with self._lock:
+                pending = self._pending.get(key)
+                leader = pending is None
+                if leader:
+                    pending = self._pending[key] = Pending()
+            if not leader:
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+                continue
+            try:
+                with FileLock(f"{path}.lock"):
+                    result = read_json(path)
+                    if result is None:
+                        result = compute(record)
+                        write_json(path, result)
+                        with self._lock:
+                            self.computed += 1
+                        return result
+                with self._lock:
+                    self.reused += 1
+                return result
+            except Exception as e:
+                pending.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._pending[key]
+                pending.done.set()
@@ -0,0 +1,84 @@
+"""
+Prebuilt static responses for the web UI
+
+The page, stylesheet and script are encoded once at startup, together with
+gzip and (when the ``brotli`` package is installed) brotli variants. Each
+variant carries a strong ETag so revalidation returns 304 without a body.
+"""
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cache lifetimes: the page always revalidates, fingerprinted assets never change
+NO_CACHE = 'no-cache'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class StaticAsset:
+    """An immutable response body with precompressed variants"""
+
+    def __init__(self, body, content_type, cache_control=NO_CACHE):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': body}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding):
+        # Strong ETags must differ between encodings of the same resource
+        suffix = '' if encoding == 'identity' else f"-{encoding}"
+        return f'"{self.digest}{suffix}"'
+
+    def choose_encoding(self, accept_encoding):
+        """Pick the smallest variant the client accepts"""
+        accepted = parse_accept_encoding(accept_encoding)
+        best = 'identity'
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                if len(self.variants[encoding]) < len(self.variants[best]):
+                    best = encoding
+        return best
+
+
+def parse_accept_encoding(header):
+    """Map codings in an Accept-Encoding header to their q-values"""
+    accepted = {}
+    for item in (header or '').split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def build_page_assets(html, css, js):
+    """Build the main page and its fingerprinted CSS/JS; returns ``{path: StaticAsset}``"""
+    css_asset = StaticAsset(css, 'text/css; charset=utf-8', IMMUTABLE)
+    js_asset = StaticAsset(js, 'application/javascript; charset=utf-8', IMMUTABLE)
+    css_path = f"/static/app.{css_asset.digest[:12]}.css"
+    js_path = f"/static/app.{js_asset.digest[:12]}.js"
+    page = html.replace('__CSS_URL__', css_path).replace('__JS_URL__', js_path)
+    page_asset = StaticAsset(page, 'text/html; charset=utf-8', NO_CACHE)
+    return {'/': page_asset, '/index.html': page_asset, css_path: css_asset, js_path: js_asset}
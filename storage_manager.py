@@ -0,0 +1,453 @@
+"""
+Storage lifecycle of the upload directory
+
+Everything the server writes lives under the upload directory: upload blobs
+with their hidden derived files (audio, diarization, crop tracks), processed
+clips and archives under ``processed/``, staged uploads and, by default, the
+transcript cache. :class:`StorageManager` keeps the directory under a byte
+quota (``CLIPSAI_STORAGE_QUOTA_MB``) and keeps ``CLIPSAI_STORAGE_MIN_FREE_MB``
+of the disk free:
+
+  * an upload is evicted as one entry together with its record, derived files
+    and processed clips; loose files in ``processed/`` such as batch archives
+    are entries of their own. Least recently used entries go first.
+  * the size of every file is kept in an index in the metadata database,
+    updated when an upload is stored, a job on an upload finishes or an entry
+    is evicted, so admitting an upload costs a few queries rather than a walk
+    of the directory. The background janitor rescans the directory to pick up
+    anything else.
+  * room promised to uploads still being received is recorded, under the
+    storage file lock, in ``.storage/reservations.json``, so every server
+    process sees it; the staging file of an upload counts only through its
+    reservation while that is held
+  * uses are recorded in memory (:meth:`StorageManager.touch`) and merged into
+    ``.storage/access.json`` under the same lock, so every server process sees
+    the same access times
+  * a background janitor evicts down to 90% of the quota and removes staged
+    uploads abandoned for a day
+  * entries used in the last ``CLIPSAI_STORAGE_MIN_IDLE`` seconds, or the
+    upload of a job queued or running in any server process (as the jobs
+    table of the metadata database shows), are never evicted; an upload that
+    cannot be made room for is refused with :class:`StorageFull`
+  * usage is read from the index without the storage lock, so status and
+    metrics requests never wait for the janitor or an eviction
+
+The transcript cache keeps to its own budget and is counted but not evicted
+here.
+"""
+
+import collections
+import contextlib
+import functools
+import glob
+import os
+import shutil
+import threading
+import time
+import urllib.parse
+import uuid
+
+from job_queue import QUEUED, RUNNING
+from shared_state import FileLock, pid_alive, read_json, write_json
+from upload_store import is_sha256
+
+# Byte quota of the upload directory (0: none) and disk space to leave free
+QUOTA_BYTES = int(os.environ.get('CLIPSAI_STORAGE_QUOTA_MB', '0')) * 1024 * 1024
+MIN_FREE_BYTES = int(os.environ.get('CLIPSAI_STORAGE_MIN_FREE_MB', '1024')) * 1024 * 1024
+# Entries used more recently than this many seconds are never evicted
+MIN_IDLE = float(os.environ.get('CLIPSAI_STORAGE_MIN_IDLE', '300'))
+JANITOR_INTERVAL = 60
+# The janitor evicts down to this fraction of the quota so uploads rarely wait on eviction
+LOW_WATERMARK = 0.9
+# Staged uploads not written to for this long are abandoned
+STAGING_MAX_AGE = 24 * 3600
+
+# Usage category of the top-level directories
+CATEGORIES = {'.incoming': 'staging', '.chunked': 'staging', '.transcripts': 'transcripts',
+              'processed': 'processed', '.storage': 'metadata'}
+
+
+class StorageFull(Exception):
+    """An upload does not fit even after evicting everything that may be evicted"""
+
+
+def format_mb(size):
+    size /= 1024 * 1024
+    return f"{size:.1f}MB" if size < 10 else f"{size:.0f}MB"
+
+
+class Entry:
+    """An evictable unit: an upload with everything derived from it, or a loose output file"""
+
+    def __init__(self, key):
+        self.key = key
+        self.paths = []
+        self.names = []  # paths relative to the upload directory
+        self.bytes = 0
+        self.last_access = 0.0
+
+    def add(self, path, name, size, mtime):
+        self.paths.append(path)
+        self.names.append(name)
+        self.bytes += size
+        self.last_access = max(self.last_access, mtime)
+
+
+class StorageManager:
+    """Tracks usage of the upload directory and evicts least recently used entries"""
+
+    def __init__(self, root, store, chunked_uploads, max_bytes=QUOTA_BYTES, min_free=MIN_FREE_BYTES,
+                 min_idle=MIN_IDLE):
+        self.root = root
+        self.store = store
+        self.db = store.db
+        self.chunked_uploads = chunked_uploads
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.min_idle = min_idle
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.refused = 0
+        self.expired = 0
+        self.last_collect = None
+        state_dir = os.path.join(root, '.storage')
+        os.makedirs(state_dir, exist_ok=True)
+        self._access_path = os.path.join(state_dir, 'access.json')
+        self._reservations_path = os.path.join(state_dir, 'reservations.json')
+        # Serializes index rebuilds, reservations and evictions across processes
+        self._lock = FileLock(os.path.join(state_dir, 'lock'))
+        self._mutex = threading.Lock()
+        self._touched = {}
+        self._pins = collections.Counter()
+        self._indexed = False
+        self._janitor = None
+
+    def start(self):
+        """Start the background janitor, which first brings the index up to date"""
+        with self._mutex:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._run_janitor, name='clipsai-storage', daemon=True)
+                self._janitor.start()
+
+    @staticmethod
+    def key_for(name):
+        """Entry key of a file served from the upload directory (``name`` relative to it)"""
+        name = name.replace(os.sep, '/')
+        if '/' not in name and is_sha256(name[:64]):
+            return name[:64]
+        return name
+
+    def touch(self, key):
+        """Record a use of an upload (by file id) or of a served file (see key_for)"""
+        if isinstance(key, str) and key:
+            with self._mutex:
+                self._touched[key] = time.time()
+
+    def using(self, key, fn):
+        """``fn`` wrapped so that ``key`` is not evicted while it runs; what it wrote is indexed after"""
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with self._mutex:
+                self._pins[key] += 1
+            result = None
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            finally:
+                with self._mutex:
+                    self._pins[key] -= 1
+                    if not self._pins[key]:
+                        del self._pins[key]
+                    self._touched[key] = time.time()
+                self.refresh(key, self._output_paths(result))
+        return run
+
+    @contextlib.contextmanager
+    def reserve(self, size, path=None):
+        """Make room for ``size`` incoming bytes and hold it while they are written to ``path``.
+
+        Raises StorageFull, without evicting anything, when even evicting every
+        idle entry would not be enough.
+        """
+        reservation = uuid.uuid4().hex
+        with self._lock:
+            self._ensure_index()
+            reservations = self._reservations()
+            total = self._indexed_bytes(reservations) + sum(r['bytes'] for r in reservations.values())
+            needed = self._needed(total, size, reservations)
+            if needed > 0:
+                candidates = self._candidates(self._entries(self._flush()))
+                available = sum(entry.bytes for entry in candidates)
+                if available < needed:
+                    self.refused += 1
+                    raise StorageFull(
+                        f"Not enough storage for a {format_mb(size)} upload: {format_mb(needed)} would have to "
+                        f"be freed but only {format_mb(available)} of older files can be removed. Try again later.")
+                self._evict(candidates, needed)
+            reservations[reservation] = {"pid": os.getpid(), "bytes": size, "path": self._name(path)}
+            write_json(self._reservations_path, reservations)
+        try:
+            yield
+        finally:
+            with self._lock:
+                reservations = read_json(self._reservations_path) or {}
+                if reservations.pop(reservation, None) is not None:
+                    write_json(self._reservations_path, reservations)
+
+    def index_files(self, paths, owner=None):
+        """Bring the index up to date for ``paths`` (absolute): sizes of files, removal of missing ones"""
+        rows, missing = [], []
+        for path in paths:
+            name = self._name(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                missing.append((name,))
+                continue
+            top = name.split('/')[0] if '/' in name else ''
+            category, key = self._classify(top, os.path.basename(name), name, {name: owner} if owner else {})
+            rows.append((name, key, category, stat.st_size, stat.st_mtime))
+        with self.db.transaction():
+            if missing:
+                self.db.connection().executemany('DELETE FROM storage_files WHERE path = ?', missing)
+            if rows:
+                self.db.connection().executemany(
+                    'INSERT OR REPLACE INTO storage_files (path, entry, category, bytes, mtime) VALUES (?, ?, ?, ?, ?)',
+                    rows)
+
+    def refresh(self, key, extra_paths=()):
+        """Re-index the files of one entry: an upload with its derived files, outputs and transcripts"""
+        paths = {os.path.join(self.root, row['path'])
+                 for row in self.db.query('SELECT path FROM storage_files WHERE entry = ?', (key,))}
+        paths.update(extra_paths)
+        if is_sha256(key):
+            root = glob.escape(self.root)
+            paths.update(glob.glob(os.path.join(root, f"{key}*")))
+            paths.update(glob.glob(os.path.join(root, f".{key}.*")))
+            paths.update(glob.glob(os.path.join(root, '.transcripts', f"{key}.*")))
+            paths.update(os.path.join(self.root, name) for name, owner in self._outputs_of(key))
+        else:
+            paths.add(os.path.join(self.root, key))
+        self.index_files(sorted(paths), owner=key if is_sha256(key) else None)
+
+    def _outputs_of(self, sha256):
+        record = self.store.get(sha256)
+        for output in (record or {}).get('artifacts', {}).get('processed') or []:
+            url = output.get('url') or ''
+            if url.startswith('/uploads/'):
+                yield urllib.parse.unquote(url[len('/uploads/'):]), sha256
+
+    def _output_paths(self, result):
+        # Files a job reports by URL (e.g. a batch archive) that are not part of its upload's record
+        if not isinstance(result, dict):
+            return []
+        return [os.path.join(self.root, urllib.parse.unquote(result[field][len('/uploads/'):]))
+                for field in ('url', 'archive_url')
+                if isinstance(result.get(field), str) and result[field].startswith('/uploads/')]
+
+    def collect(self):
+        """One janitor pass: share access times, expire staged uploads, rescan and evict down to the low watermark"""
+        with self._lock:
+            access = self._flush()
+            self.expired += self.chunked_uploads.expire(STAGING_MAX_AGE) + self._expire_incoming()
+            self.rescan()
+            entries = self._entries(access)
+            live = {name for entry in entries.values() for name in [entry.key] + entry.names}
+            if set(access) - live:
+                # Forget access times of removed entries
+                write_json(self._access_path, {key: when for key, when in access.items() if key in live})
+            reservations = self._reservations()
+            total = self._indexed_bytes(reservations) + sum(r['bytes'] for r in reservations.values())
+            needed = self._needed(total, 0, reservations, LOW_WATERMARK)
+            if needed > 0:
+                self._evict(self._candidates(entries), needed)
+            self.last_collect = time.time()
+
+    def _run_janitor(self):
+        try:
+            with self._lock:
+                self._ensure_index()
+        except Exception as e:
+            print(f"⚠️  Storage index rebuild failed: {e}")
+        while True:
+            time.sleep(JANITOR_INTERVAL)
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"⚠️  Storage janitor failed: {e}")
+
+    def _ensure_index(self):
+        # The index may be stale from before this process started; rebuild it once (storage lock held)
+        if not self._indexed:
+            self.rescan()
+
+    def rescan(self):
+        """Rebuild the index from a walk of the upload directory"""
+        with self._lock:
+            owners = self.store.outputs()
+            rows = []
+            for dirpath, _, filenames in os.walk(self.root):
+                directory = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+                top = '' if directory == '.' else directory.split('/')[0]
+                for filename in filenames:
+                    try:
+                        stat = os.lstat(os.path.join(dirpath, filename))
+                    except FileNotFoundError:
+                        continue
+                    name = filename if not top else f"{directory}/{filename}"
+                    category, key = self._classify(top, filename, name, owners)
+                    rows.append((name, key, category, stat.st_size, stat.st_mtime))
+            with self.db.transaction():
+                self.db.execute('DELETE FROM storage_files')
+                self.db.connection().executemany(
+                    'INSERT INTO storage_files (path, entry, category, bytes, mtime) VALUES (?, ?, ?, ?, ?)', rows)
+            self._indexed = True
+
+    def _name(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/') if path else None
+
+    def _reservations(self):
+        # Reservations of live processes (storage lock held); those of dead ones are dropped
+        reservations = read_json(self._reservations_path) or {}
+        live = {key: r for key, r in reservations.items() if pid_alive(r['pid'])}
+        if len(live) != len(reservations):
+            write_json(self._reservations_path, live)
+        return live
+
+    def _indexed_bytes(self, reservations):
+        # Indexed bytes, leaving out files still being written under a reservation (counted by it)
+        total = self.db.query_one('SELECT COALESCE(SUM(bytes), 0) FROM storage_files')[0]
+        reserved = [r['path'] for r in reservations.values() if r.get('path')]
+        if reserved:
+            total -= self.db.query_one(
+                f"SELECT COALESCE(SUM(bytes), 0) FROM storage_files WHERE path IN ({','.join('?' * len(reserved))})",
+                reserved)[0]
+        return total
+
+    def _entries(self, access):
+        """The evictable entries by key, with their last access"""
+        entries = {}
+        for row in self.db.query('SELECT path, entry, bytes, mtime FROM storage_files WHERE entry IS NOT NULL'):
+            entry = entries.get(row['entry']) or entries.setdefault(row['entry'], Entry(row['entry']))
+            entry.add(os.path.join(self.root, row['path']), row['path'], row['bytes'], row['mtime'])
+        for entry in entries.values():
+            entry.last_access = max([entry.last_access, access.get(entry.key, 0)]
+                                    + [access.get(name, 0) for name in entry.names])
+        return entries
+
+    def _flush(self):
+        # Merge this process's uses into the shared access times (storage lock held)
+        now = time.time()
+        with self._mutex:
+            touched, self._touched = self._touched, {}
+            touched.update((key, now) for key in self._pins)
+        access = read_json(self._access_path) or {}
+        changed = False
+        for key, when in touched.items():
+            if when > access.get(key, 0):
+                access[key] = when
+                changed = True
+        if changed:
+            write_json(self._access_path, access)
+        return access
+
+    def _classify(self, top, filename, name, owners):
+        # (usage category, entry key or None if not evictable)
+        if not top:
+            if filename.startswith('.') and is_sha256(filename[1:65]) and filename[65:66] == '.':
+                return 'derived', filename[1:65]
+            if is_sha256(filename[:64]):
+                return 'uploads', filename[:64]
+            return 'other', None
+        if top == 'processed':
+            return 'processed', owners.get(name, name)
+        return CATEGORIES.get(top, 'other'), None
+
+    def _needed(self, total, size, reservations, watermark=1.0):
+        # Bytes to free so ``size`` more fits the quota and leaves the minimum free space
+        needed = 0
+        if self.max_bytes:
+            needed = total + size - int(self.max_bytes * watermark)
+        # Reserved bytes not written yet will still take disk space
+        pending = 0
+        for r in reservations.values():
+            try:
+                written = os.stat(os.path.join(self.root, r['path'])).st_size if r.get('path') else 0
+            except OSError:
+                written = 0
+            pending += max(0, r['bytes'] - written)
+        free = shutil.disk_usage(self.root).free - pending
+        return max(needed, self.min_free + size - free)
+
+    def _candidates(self, entries):
+        # Idle entries no job of any process holds, least recently used first
+        cutoff = time.time() - self.min_idle
+        with self._mutex:
+            pinned = set(self._pins)
+        pinned.update(row['file_id'] for row in self.db.query(
+            "SELECT DISTINCT json_extract(params, '$.file_id') AS file_id FROM jobs WHERE state IN (?, ?)",
+            (QUEUED, RUNNING)))
+        return sorted((entry for entry in entries.values()
+                       if entry.key not in pinned and entry.last_access < cutoff),
+                      key=lambda entry: entry.last_access)
+
+    def _evict(self, candidates, needed):
+        # Remove entries in order until ``needed`` bytes are freed (storage lock held)
+        freed = 0
+        for entry in candidates:
+            if freed >= needed:
+                break
+            if is_sha256(entry.key):
+                self.store.remove(entry.key)
+            for path in entry.paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.db.execute('DELETE FROM storage_files WHERE entry = ?', (entry.key,))
+            freed += entry.bytes
+            self.evictions += 1
+            self.evicted_bytes += entry.bytes
+            print(f"🧹 Evicted {entry.key} ({format_mb(entry.bytes)}, "
+                  f"unused for {time.time() - entry.last_access:.0f}s)")
+        return freed
+
+    def _expire_incoming(self):
+        # Multipart uploads interrupted without cleaning up their staging file
+        cutoff = time.time() - STAGING_MAX_AGE
+        expired = 0
+        for name in os.listdir(self.store.incoming_dir):
+            path = os.path.join(self.store.incoming_dir, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    expired += 1
+            except OSError:
+                pass
+        return expired
+
+    def usage(self):
+        """Bytes per category from the index (a WAL read: no storage lock)"""
+        return {row['category']: row['bytes'] for row in self.db.query(
+            'SELECT category, SUM(bytes) AS bytes FROM storage_files GROUP BY category ORDER BY category')}
+
+    def stats(self):
+        usage = self.usage()
+        entries = self._entries(read_json(self._access_path) or {})
+        reservations = read_json(self._reservations_path) or {}
+        now = time.time()
+        return {
+            "bytes": sum(usage.values()),
+            "by_category": usage,
+            "max_bytes": self.max_bytes or None,
+            "disk_free_bytes": shutil.disk_usage(self.root).free,
+            "min_free_bytes": self.min_free,
+            "reserved_bytes": sum(r['bytes'] for r in reservations.values()),
+            "entries": len(entries),
+            "oldest_access_age": round(now - min(e.last_access for e in entries.values()), 1) if entries else None,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "refused_uploads": self.refused,
+            "expired_staged_uploads": self.expired,
+            "last_collect": self.last_collect,
+        }
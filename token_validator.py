@@ -0,0 +1,140 @@
+"""
+Cached Hugging Face token validation
+
+Checking a token means asking the Hugging Face API whether it can read the
+Pyannote diarization model. Results are cached by a hash of the token (the
+token itself is never stored): accepted tokens for a long TTL, rejected ones
+for a short TTL. Concurrent checks of the same token share one outbound
+request, and outbound requests reuse pooled connections. ``requests`` is
+imported with the first check, not when the server starts.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from shared_state import Pending
+
+PYANNOTE_MODEL = 'pyannote/speaker-diarization-3.0'
+LICENSE_URL = f'https://huggingface.co/{PYANNOTE_MODEL}'
+
+
+class TokenValidator:
+    """Validates Hugging Face tokens against the Pyannote model API with caching"""
+
+    def __init__(self, api_base=None, positive_ttl=3600, negative_ttl=60, timeout=10, pool_size=8):
+        self.api_base = (api_base or os.environ.get('CLIPSAI_HF_API_URL', 'https://huggingface.co')).rstrip('/')
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._cache = {}  # token hash -> (expires, result)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self):
+        # Created on first use; keeps TLS connections to the API alive between checks
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def validate(self, token):
+        """Return the response payload for ``token`` (see :meth:`_check`)"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.hits += 1
+                return cached[1]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = Pending()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait()
+            return pending.result
+
+        try:
+            result, ttl = self._check(token)
+            with self._lock:
+                if ttl:
+                    self._cache[key] = (time.monotonic() + ttl, result)
+                self._prune()
+        except Exception as e:
+            result = {"success": False, "valid": False, "error": str(e)}
+        finally:
+            with self._lock:
+                del self._pending[key]
+        pending.result = result
+        pending.done.set()
+        return result
+
+    def _check(self, token):
+        """Ask the API about ``token``; returns ``(payload, ttl)`` with ttl 0 for uncacheable"""
+        import requests
+        try:
+            response = self.session.get(
+                f'{self.api_base}/api/models/{PYANNOTE_MODEL}',
+                headers={'Authorization': f'Bearer {token}'},
+                timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "valid": False, "error": f"Network error: {str(e)}"}, 0
+
+        if response.status_code == 200:
+            return {
+                "success": True,
+                "valid": True,
+                "message": "Token is valid and has access to Pyannote models"
+            }, self.positive_ttl
+        elif response.status_code == 401:
+            return {
+                "success": False,
+                "valid": False,
+                "error": "Invalid token or token doesn't have required permissions"
+            }, self.negative_ttl
+        elif response.status_code == 403:
+            return {
+                "success": False,
+                "valid": False,
+                "error": "Token is valid but you need to accept the Pyannote license first",
+                "license_url": LICENSE_URL
+            }, self.negative_ttl
+        return {
+            "success": False,
+            "valid": False,
+            "error": f"Unexpected response from Hugging Face API: {response.status_code}"
+        }, 0
+
+    def _prune(self):
+        # Drop expired entries (lock held)
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
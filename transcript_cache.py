@@ -0,0 +1,237 @@
+"""
+Persistent transcript cache keyed by (content hash, Whisper model size, language)
+
+Entries are stored in a compact binary format: a small JSON header, the
+zlib-compressed word list, and packed float32 start/end times with uint16
+confidence scores. The cache is bounded by a byte budget and evicts the least
+recently used entries; an entry's mtime records its last use so the LRU order
+survives restarts. Server processes sharing the directory pick up each other's
+entries on lookup; each enforces the budget over the entries it knows. With a
+metadata database (see metadata_db.py) every entry also has a row there, so
+the transcripts of an upload are found with one indexed query.
+"""
+
+import array
+import collections
+import glob
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+MAGIC = b'CTC1'
+HEADER = struct.Struct('<4sII')  # magic, JSON header length, word count
+SUFFIX = '.ctc'
+SAFE_KEY = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def encode_transcript(result):
+    """Serialize a transcription result (with ``words``) to bytes"""
+    words = result.get('words') or []
+    meta = {k: v for k, v in result.items() if k not in ('words', 'transcript')}
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode()
+    text = zlib.compress('\n'.join(w['word'] for w in words).encode(), 6)
+    times = array.array('f', [w['start'] for w in words] + [w['end'] for w in words])
+    scores = array.array('H', [max(0, min(65535, round(w.get('score', 1.0) * 65535))) for w in words])
+    if sys.byteorder != 'little':
+        times.byteswap()
+        scores.byteswap()
+    return b''.join([
+        HEADER.pack(MAGIC, len(meta_bytes), len(words)),
+        meta_bytes,
+        struct.pack('<I', len(text)), text,
+        times.tobytes(),
+        scores.tobytes(),
+    ])
+
+
+def decode_transcript(data):
+    """Inverse of :func:`encode_transcript`"""
+    magic, meta_len, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a transcript cache entry")
+    offset = HEADER.size
+    result = json.loads(data[offset:offset + meta_len])
+    offset += meta_len
+    (text_len,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    text = zlib.decompress(data[offset:offset + text_len]).decode()
+    offset += text_len
+    times = array.array('f')
+    times.frombytes(data[offset:offset + 8 * count])
+    offset += 8 * count
+    scores = array.array('H')
+    scores.frombytes(data[offset:offset + 2 * count])
+    if sys.byteorder != 'little':
+        times.byteswap()
+        scores.byteswap()
+
+    tokens = text.split('\n') if count else []
+    result['words'] = [
+        {"word": tokens[i], "start": round(times[i], 3), "end": round(times[count + i], 3),
+         "score": round(scores[i] / 65535, 3)}
+        for i in range(count)
+    ]
+    result['transcript'] = ' '.join(tokens)
+    return result
+
+
+class TranscriptCache:
+    """On-disk LRU cache of transcription results under a byte budget"""
+
+    def __init__(self, cache_dir, max_bytes, db=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # filename -> size, oldest first
+        self._bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(SUFFIX):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._bytes += size
+        if self.db is not None:
+            with self.db.transaction():
+                # Rows of entries removed while the server was down, and files without rows
+                for row in self.db.query('SELECT sha256, model_size, language FROM transcripts'):
+                    if self.entry_name(*row) not in self._entries:
+                        self.db.execute('DELETE FROM transcripts WHERE sha256 = ? AND model_size = ? '
+                                        'AND language = ?', tuple(row))
+                for mtime, name, size in entries:
+                    self._add_row(name, size, mtime, replace=False)
+
+    def _add_row(self, name, size, created, replace=True):
+        if self.db is not None:
+            sha256, model_size, language, _ = name.split('.')
+            self.db.execute(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO transcripts "
+                            "(sha256, model_size, language, bytes, created) VALUES (?, ?, ?, ?, ?)",
+                            (sha256, model_size, language, size, created))
+
+    def _remove_row(self, name):
+        if self.db is not None:
+            sha256, model_size, language, _ = name.split('.')
+            self.db.execute('DELETE FROM transcripts WHERE sha256 = ? AND model_size = ? AND language = ?',
+                            (sha256, model_size, language))
+
+    @staticmethod
+    def entry_name(sha256, model_size, language):
+        parts = (sha256, model_size, language or 'auto')
+        if not all(part and SAFE_KEY.match(part) for part in parts):
+            return None
+        return '.'.join(parts) + SUFFIX
+
+    def get(self, sha256, model_size, language=None):
+        """Return a cached result or None; counts as a hit or miss"""
+        name = self.entry_name(sha256, model_size, language)
+        with self._lock:
+            if name is None or (name not in self._entries and not self._adopt(name)):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                result = decode_transcript(f.read())
+            os.utime(path)
+        except (OSError, ValueError, zlib.error, struct.error):
+            self._forget(name)
+            return None
+        return result
+
+    def put(self, sha256, model_size, language, result):
+        name = self.entry_name(sha256, model_size, language)
+        if name is None:
+            return
+        data = encode_transcript(result)
+        if len(data) > self.max_bytes:
+            return
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._add_row(name, len(data), time.time())
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until under budget (lock held)
+        while self._bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            self._remove_row(name)
+
+    def _adopt(self, name):
+        # Index an entry another process wrote (lock held)
+        try:
+            size = os.stat(os.path.join(self.cache_dir, name)).st_size
+        except OSError:
+            return False
+        self._entries[name] = size
+        self._bytes += size
+        return True
+
+    def _forget(self, name):
+        with self._lock:
+            self._bytes -= self._entries.pop(name, 0)
+        self._remove_row(name)
+
+    def entries_for(self, sha256):
+        """Summaries of the cached transcripts of one upload, keyed ``transcript:<model_size>:<language>``.
+
+        Read from the index alone: no entry is decoded and no hit or miss is counted.
+        """
+        if not SAFE_KEY.match(sha256 or ''):
+            return {}
+        if self.db is not None:
+            rows = [tuple(row) for row in self.db.query(
+                'SELECT model_size, language, bytes FROM transcripts WHERE sha256 = ? ORDER BY model_size, language',
+                (sha256,))]
+        else:
+            rows = []
+            for path in sorted(glob.glob(os.path.join(glob.escape(self.cache_dir), f"{sha256}.*{SUFFIX}"))):
+                try:
+                    rows.append(tuple(os.path.basename(path).split('.')[1:3]) + (os.stat(path).st_size,))
+                except OSError:
+                    pass
+        return {f"transcript:{model_size}:{language}": {"model_size": model_size,
+                                                        "language": None if language == 'auto' else language,
+                                                        "bytes": size}
+                for model_size, language, size in rows}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
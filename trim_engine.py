@@ -0,0 +1,282 @@
+"""
+Single-pass clip cutting
+
+Cutting N clips with one ffmpeg run per clip reads the source N times, and
+frame-accurate cuts also decode and re-encode every clip in full. The engine
+plans all clips of one source together and runs one ffmpeg pass that reads the
+source once and writes every piece:
+
+* video from the first keyframe inside a clip to its end is stream copied;
+* only the edge before that keyframe is re-encoded (a "smart cut"), or the
+  whole clip when it holds no keyframe, the codec cannot be matched, or the
+  clip is resized;
+* audio is stream copied.
+
+Afterwards the pieces of each clip are joined without re-encoding.
+"""
+
+import bisect
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import profiling
+
+# Codecs whose edges can be re-encoded to match a stream-copied body
+SMART_CUT_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+ANNEXB_FILTERS = {'h264': 'h264_mp4toannexb', 'hevc': 'hevc_mp4toannexb'}
+# Cut points this close to a keyframe count as aligned (seconds)
+KEYFRAME_TOLERANCE = 0.002
+
+_DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+_VIDEO = re.compile(r'Stream #0:\d+.*?: Video: (\w+)[^,]*, (\w+)')
+_SIZE = re.compile(r', (\d+)x(\d+)[ ,\n]')
+_TIMEBASE = re.compile(r'^#tb 0: (\d+)/(\d+)')
+
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+def ffmpeg_binary():
+    return shutil.which('ffmpeg')
+
+
+def probe(path):
+    """Codec, frame size, duration and keyframe ``(pts, dts)`` times of the first video stream.
+
+    Reads packets only (no decoding); results are cached per file version.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _probe_lock:
+        if key in _probe_cache:
+            return _probe_cache[key]
+
+    proc = subprocess.run(
+        [ffmpeg_binary(), '-hide_banner', '-nostdin', '-i', path,
+         '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-'],
+        capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise ValueError(f"Could not read video: {proc.stderr.strip().splitlines()[-1:]}")
+
+    header = proc.stderr.split('Stream mapping:')[0]
+    video = _VIDEO.search(header)
+    duration = _DURATION.search(header)
+    size = _SIZE.search(header, video.end()) if video else None
+    info = {
+        "video_codec": video.group(1) if video else None,
+        "pix_fmt": video.group(2) if video else None,
+        "width": int(size.group(1)) if size else None,
+        "height": int(size.group(2)) if size else None,
+        "has_audio": ': Audio: ' in header,
+        "duration": (int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+                     if duration else None),
+        "timescale": None,
+        "keyframes": [],
+    }
+
+    timebase = 1.0
+    for line in proc.stdout.splitlines():
+        match = _TIMEBASE.match(line)
+        if match:
+            timebase = int(match.group(1)) / int(match.group(2))
+            info["timescale"] = int(match.group(2)) // int(match.group(1))
+            continue
+        if line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.split(',')]
+        # framecrc writes F=<flags> only when the flags are not just "keyframe"
+        flags = next((int(f[2:], 16) for f in fields[6:] if f.startswith('F=')), 1)
+        if flags & 1:
+            info["keyframes"].append((int(fields[2]) * timebase, int(fields[1]) * timebase))
+    info["keyframes"].sort()
+
+    with _probe_lock:
+        if len(_probe_cache) >= 32:
+            _probe_cache.pop(next(iter(_probe_cache)))
+        _probe_cache[key] = info
+    return info
+
+
+def plan_clip(info, start, end, aspect_ratio=None):
+    """Decide how to produce one clip.
+
+    Returns ``(mode, keyframe)`` where mode is ``copy`` (starts on a keyframe),
+    ``smart`` (re-encode up to ``keyframe``, copy the rest) or ``encode``.
+    """
+    if aspect_ratio or info["video_codec"] not in SMART_CUT_ENCODERS:
+        return 'encode', None
+    keyframes = info["keyframes"]
+    index = bisect.bisect_left(keyframes, (start - KEYFRAME_TOLERANCE,))
+    if index == len(keyframes) or keyframes[index][0] >= end - KEYFRAME_TOLERANCE:
+        return 'encode', None
+    keyframe = keyframes[index]
+    if keyframe[0] - start <= KEYFRAME_TOLERANCE:
+        return 'copy', keyframe
+    return 'smart', keyframe
+
+
+def center_crop_filter(aspect_ratio):
+    """Centre-crop filter for an ``"W:H"`` aspect ratio"""
+    width, height = (int(x) for x in aspect_ratio.split(':'))
+    return f"crop='min(iw,ih*{width}/{height})':'min(ih,iw*{height}/{width})',scale=trunc(iw/2)*2:trunc(ih/2)*2"
+
+
+def cut_clips(source_path, clips, work_dir, progress=None, info=None):
+    """Cut ``clips`` (dicts with start, end, output_path and optional aspect_ratio
+    and video_filter) from ``source_path`` in one pass.
+
+    ``progress(fraction)`` is called while the pass runs; an exception raised
+    from it (e.g. a cancelled job) stops ffmpeg. ``info`` is the source's probe
+    result if already known (see video_index.py). Returns one dict per clip
+    with ``mode`` and ``size``, or ``error`` when joining that clip failed.
+    """
+    info = info or probe(source_path)
+    if info["video_codec"] is None:
+        raise ValueError("Source has no video stream")
+    duration = info["duration"] or max(clip['end'] for clip in clips)
+    work_dir = tempfile.mkdtemp(prefix='.cut-', dir=work_dir)
+    try:
+        plans = {}
+        encodes = []   # (start, end, extra filter, encoder args, piece path)
+        outputs = []   # ffmpeg output arguments for copied pieces
+        for index, clip in enumerate(clips):
+            start, end = clip['start'], min(clip['end'], duration)
+            if end - start < 0.01:
+                continue
+            mode, keyframe = plan_clip(info, start, end, clip.get('aspect_ratio'))
+            pieces = []
+            if mode == 'encode':
+                piece = os.path.join(work_dir, f"{index}.video.mp4")
+                if clip.get('aspect_ratio'):
+                    # A precomputed crop (see crop_tracks.py) or a centre crop
+                    video_filter = clip.get('video_filter') or center_crop_filter(clip['aspect_ratio'])
+                    encodes.append((start, end, video_filter, ['-c:v', 'libx264', '-preset', 'veryfast'], piece))
+                else:
+                    encodes.append((start, end, None, edge_encoder_args(info), piece))
+                pieces.append((piece, None))
+            else:
+                if mode == 'smart':
+                    piece = os.path.join(work_dir, f"{index}.head.mp4")
+                    encodes.append((start, keyframe[0], None, edge_encoder_args(info), piece))
+                    pieces.append((piece, keyframe[0] - start))
+                # Stream copy starts at the first packet whose dts reaches -ss, so
+                # start at the keyframe's dts and shift the end by the same lag
+                pts, dts = keyframe
+                piece = os.path.join(work_dir, f"{index}.body.mp4")
+                outputs += ['-map', '0:v:0', '-c', 'copy', '-ss', f"{dts - 0.0005:.4f}",
+                            '-to', f"{end - (pts - dts):.4f}", piece]
+                pieces.append((piece, None))
+            audio = None
+            if info["has_audio"]:
+                audio = os.path.join(work_dir, f"{index}.audio.m4a")
+                outputs += ['-map', '0:a:0', '-c', 'copy', '-ss', f"{start:.4f}", '-to', f"{end:.4f}", audio]
+            plans[index] = (mode, pieces, audio)
+        if not plans:
+            return [{"error": "Clip is outside the video"} for _ in clips]
+
+        # One decoded video stream feeds every re-encoded piece
+        graph = []
+        if len(encodes) > 1:
+            graph.append(f"[0:v]split={len(encodes)}" + ''.join(f"[s{i}]" for i in range(len(encodes))))
+        for i, (start, end, extra, encoder, piece) in enumerate(encodes):
+            chain = f"{f'[s{i}]' if len(encodes) > 1 else '[0:v]'}trim=start={start:.4f}:end={end:.4f},setpts=PTS-STARTPTS"
+            if extra:
+                chain += f",{extra}"
+            graph.append(f"{chain}[e{i}]")
+            # Keep the source frame timing; filter outputs default to 25 fps otherwise
+            outputs += ['-map', f"[e{i}]", '-fps_mode', 'passthrough'] + encoder + [piece]
+
+        # Seek to the keyframe before the first clip and keep source timestamps,
+        # so every -ss/-to and trim above can use positions in the source
+        first = min(clips[i]['start'] for i in plans)
+        last = max(min(clips[i]['end'], duration) for i in plans)
+        seek = 0.0
+        index = bisect.bisect_right(info["keyframes"], (first + KEYFRAME_TOLERANCE, float('inf')))
+        if index:
+            seek = info["keyframes"][index - 1][0]
+        cmd = [ffmpeg_binary(), '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+               '-progress', 'pipe:1', '-nostats',
+               '-ss', f"{seek:.4f}", '-copyts', '-t', f"{last - seek + 1:.4f}", '-i', source_path]
+        if graph:
+            cmd += ['-filter_complex', ';'.join(graph)]
+        with profiling.span('ffmpeg_cut', clips=len(plans), encodes=len(encodes)):
+            run_ffmpeg(cmd + outputs, seek, last, progress)
+
+        results = []
+        for index, clip in enumerate(clips):
+            if index not in plans:
+                results.append({"error": "Clip is outside the video"})
+                continue
+            mode, pieces, audio = plans[index]
+            try:
+                with profiling.span('join', clip=index, mode=mode):
+                    join_pieces(info, pieces, audio, clip['output_path'])
+                results.append({"mode": mode, "size": os.path.getsize(clip['output_path'])})
+            except (OSError, subprocess.CalledProcessError) as e:
+                results.append({"mode": mode, "error": describe_error(e)})
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def edge_encoder_args(info):
+    # Match the source codec and pixel format so the piece joins the copied body
+    # and the source time base (the concat demuxer does not rescale between pieces)
+    encoder = SMART_CUT_ENCODERS.get(info["video_codec"], 'libx264')
+    args = ['-c:v', encoder, '-preset', 'veryfast', '-crf', '18', '-pix_fmt', info["pix_fmt"]]
+    if info["timescale"]:
+        args += ['-video_track_timescale', str(info["timescale"])]
+    return args
+
+
+def run_ffmpeg(cmd, start, end, progress):
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.extend(process.stderr), daemon=True)
+    reader.start()
+    try:
+        for line in process.stdout:
+            if progress and line.startswith('out_time_us=') and line[12:].strip().isdigit():
+                position = int(line[12:]) / 1e6
+                # out_time is the source position with -copyts
+                progress(min(1.0, max(0.0, (position - start) / max(end - start, 0.001))))
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {''.join(stderr).strip()[-500:]}")
+
+
+def join_pieces(info, pieces, audio, output_path):
+    """Concatenate video pieces and mux the audio without re-encoding"""
+    list_path = f"{pieces[0][0]}.txt"
+    with open(list_path, 'w') as f:
+        for piece, duration in pieces:
+            f.write(f"file '{piece}'\n")
+            if duration:
+                # The exact length, rather than the one guessed from the piece's timestamps
+                f.write(f"duration {duration:.6f}\n")
+    cmd = [ffmpeg_binary(), '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+           '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio:
+        cmd += ['-i', audio, '-map', '0:v', '-map', '1:a']
+    cmd += ['-c', 'copy']
+    if len(pieces) > 1:
+        # Keep each piece's parameter sets in-band; the re-encoded edge and the
+        # copied body do not share one set of codec headers
+        cmd += ['-bsf:v', ANNEXB_FILTERS[info["video_codec"]]]
+    cmd.append(output_path)
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def describe_error(e):
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+        return e.stderr.decode(errors='replace').strip()[-500:]
+    return str(e)
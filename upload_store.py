@@ -0,0 +1,206 @@
+"""
+Content-addressed store for uploaded videos
+
+Each distinct video is stored once as ``<sha256><ext>`` in the upload
+directory. Its record in the metadata database (see metadata_db.py) maps the
+original file names to the blob and collects derived artifacts (transcripts,
+clip lists, processed outputs), so a re-upload of the same recording, or a
+restarted server, gets all of them back at once. Files derived from a blob
+(such as its extracted audio) live next to it as hidden
+``.<sha256>.<suffix>`` files, which /uploads/ does not serve and
+:meth:`UploadStore.remove` deletes with the blob.
+"""
+
+import glob
+import json
+import os
+import time
+import urllib.parse
+import uuid
+
+import profiling
+from shared_state import read_json
+
+HASH_CHARS = set('0123456789abcdef')
+
+
+def is_sha256(value):
+    return isinstance(value, str) and len(value) == 64 and set(value) <= HASH_CHARS
+
+
+def blob_extension(original_name):
+    """Keep the original extension so MIME types can still be guessed from the blob name"""
+    ext = os.path.splitext(original_name or '')[1].lower()
+    if len(ext) > 10 or not ext[1:].isalnum():
+        return ''
+    return ext
+
+
+class UploadStore:
+    """Stores upload blobs by content hash with their records in the metadata database"""
+
+    def __init__(self, root, db):
+        self.root = root
+        self.db = db
+        self.incoming_dir = os.path.join(root, '.incoming')
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self._import_records(os.path.join(root, '.meta'))
+
+    def _import_records(self, meta_dir):
+        # Records of earlier versions were JSON files, one per blob
+        paths = glob.glob(os.path.join(glob.escape(meta_dir), '*.json'))
+        with self.db.transaction():
+            for path in paths:
+                record = read_json(path)
+                if record and is_sha256(record.get('sha256')):
+                    self._insert(record)
+                    for key, value in record['artifacts'].items():
+                        self._set(record['sha256'], key, value)
+        for path in paths + [os.path.join(meta_dir, '.lock')]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(meta_dir)
+        except OSError:
+            pass
+        if paths:
+            print(f"📦 Imported {len(paths)} upload records into {self.db.path}")
+
+    def incoming_path(self):
+        """A private path to stream a new upload to before its hash is known"""
+        return os.path.join(self.incoming_dir, uuid.uuid4().hex)
+
+    def get(self, sha256):
+        """Return the record for a blob, or None if it is not stored"""
+        if not is_sha256(sha256):
+            return None
+        row = self.db.query_one('SELECT * FROM uploads WHERE sha256 = ?', (sha256,))
+        if row is None:
+            return None
+        record = {
+            "sha256": row['sha256'],
+            "filename": row['filename'],
+            "size": row['size'],
+            "created": row['created'],
+            "names": json.loads(row['names']),
+            "artifacts": {artifact['key']: json.loads(artifact['value']) for artifact in
+                          self.db.query('SELECT key, value FROM artifacts WHERE sha256 = ?', (sha256,))},
+        }
+        if not os.path.isfile(self.blob_path(record)):
+            return None
+        return record
+
+    def blob_path(self, record):
+        return os.path.join(self.root, record['filename'])
+
+    def derived_path(self, sha256, suffix):
+        return os.path.join(self.root, f".{sha256}.{suffix}")
+
+    def outputs(self):
+        """``{path under the upload directory: sha256}`` of every processed output with a file"""
+        owners = {}
+        for row in self.db.query("SELECT sha256, value FROM artifacts WHERE key = 'processed'"):
+            for output in json.loads(row['value']):
+                url = output.get('url') or ''
+                if url.startswith('/uploads/'):
+                    owners[urllib.parse.unquote(url[len('/uploads/'):])] = row['sha256']
+        return owners
+
+    def remove(self, sha256):
+        """Delete a blob with its record and derived files; returns the removed record or None"""
+        with self.db.transaction():
+            record = self.get(sha256)
+            if record is None:
+                return None
+            self.db.execute('DELETE FROM uploads WHERE sha256 = ?', (sha256,))
+            paths = [self.blob_path(record)]
+            paths += glob.glob(os.path.join(glob.escape(self.root), f".{sha256}.*"))
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return record
+
+    def add(self, src_path, sha256, original_name, size):
+        """Move a fully written upload into the store.
+
+        Returns ``(record, duplicate)``. When the content is already stored the
+        new copy is discarded and the existing record is returned.
+        """
+        with self.db.transaction():
+            record = self.get(sha256)
+            if record is not None:
+                os.remove(src_path)
+                duplicate = True
+            else:
+                record = {
+                    "sha256": sha256,
+                    "filename": f"{sha256}{blob_extension(original_name)}",
+                    "size": size,
+                    "created": time.time(),
+                    "names": [],
+                    "artifacts": {},
+                }
+                with profiling.span('store_upload', bytes=size):
+                    os.replace(src_path, self.blob_path(record))
+                # Replaces the row of a blob that was deleted from disk
+                self._insert(record)
+                duplicate = False
+            if original_name not in record['names']:
+                record['names'].append(original_name)
+                self._set_names(record)
+        return record, duplicate
+
+    def add_name(self, sha256, original_name, size):
+        """Record another original name for an existing blob (dedup before upload).
+
+        ``size`` must match the blob's, which catches a client sending the hash
+        of the wrong file. Returns the record, or None.
+        """
+        record = self.get(sha256)
+        if record is None or size != record['size']:
+            return None
+        with self.db.transaction():
+            record = self.get(sha256)
+            if record is not None and original_name and original_name not in record['names']:
+                record['names'].append(original_name)
+                self._set_names(record)
+            return record
+
+    def set_artifact(self, sha256, key, value):
+        """Attach a derived artifact (e.g. a transcript) to a stored blob"""
+        with self.db.transaction():
+            record = self.get(sha256)
+            if record is None:
+                return None
+            record['artifacts'][key] = value
+            self._set(sha256, key, value)
+            return record
+
+    def append_artifact(self, sha256, key, value):
+        """Append to a list-valued artifact such as processed outputs"""
+        with self.db.transaction():
+            record = self.get(sha256)
+            if record is None:
+                return None
+            record['artifacts'].setdefault(key, []).append(value)
+            self._set(sha256, key, record['artifacts'][key])
+            return record
+
+    def _insert(self, record):
+        self.db.execute('DELETE FROM uploads WHERE sha256 = ?', (record['sha256'],))
+        self.db.execute('INSERT INTO uploads (sha256, filename, size, created, names) VALUES (?, ?, ?, ?, ?)',
+                        (record['sha256'], record['filename'], record['size'], record['created'],
+                         json.dumps(record['names'])))
+
+    def _set_names(self, record):
+        self.db.execute('UPDATE uploads SET names = ? WHERE sha256 = ?',
+                        (json.dumps(record['names']), record['sha256']))
+
+    def _set(self, sha256, key, value):
+        self.db.execute('INSERT INTO artifacts (sha256, key, value) VALUES (?, ?, ?) '
+                        'ON CONFLICT (sha256, key) DO UPDATE SET value = excluded.value',
+                        (sha256, key, json.dumps(value)))
@@ -0,0 +1,294 @@
+"""
+Keyframe index and thumbnail sprite sheets, built once per upload
+
+Each upload is indexed in the background after it arrives, into hidden
+derived files next to it (removed with the upload):
+
+* a keyframe table: the probe result of the source (see ``trim_engine.probe``)
+  with the presentation and decode time of every keyframe and, for MP4/MOV
+  sources, the byte offset of its sample, read from the container's sample
+  tables. Trims plan their cuts from the stored table instead of reading the
+  whole source again, and clients can seek, or request a byte range, from the
+  nearest keyframe.
+* thumbnail sprite sheets: small frames, at most one every ``interval``
+  seconds, tiled into JPEG grids with a manifest of each thumbnail's time and
+  position, so clip previews need no video download. Only keyframes are
+  decoded, unless they are too sparse for the interval.
+"""
+
+import bisect
+import glob
+import math
+import os
+import re
+import struct
+import subprocess
+import threading
+import uuid
+
+import numpy as np
+
+import profiling
+import trim_engine
+from shared_state import DerivedResults
+
+KEYFRAMES_SUFFIX = 'keyframes.json'
+SPRITES_SUFFIX = 'sprites.json'
+TILE_WIDTH = 160
+COLUMNS = 10
+ROWS = 10
+# At most this many thumbnails, and at least this many seconds apart
+MAX_THUMBNAILS = 600
+MIN_INTERVAL = 2.0
+JPEG_QUALITY = 5  # ffmpeg -q:v, 2 (best) to 31
+# Larger movie headers are not read for byte offsets
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+
+_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+_SAMPLE_TABLES = {b'stss', b'stsc', b'stsz', b'stco', b'co64'}
+_PTS_TIME = re.compile(r'\bpts_time:\s*(-?[\d.]+)')
+# (offset, bytes) signatures of common video containers: MP4/MOV, Matroska/WebM, AVI, FLV, MPEG-PS, MPEG-TS
+_SIGNATURES = [(4, b'ftyp'), (4, b'moov'), (4, b'mdat'), (4, b'free'), (4, b'wide'), (0, b'\x1aE\xdf\xa3'),
+               (0, b'RIFF'), (0, b'FLV'), (0, b'\x00\x00\x01\xba')]
+
+
+def _boxes(data, start, end):
+    # (type, payload start, payload end) of the boxes in data[start:end]
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size, header = struct.unpack_from('>Q', data, pos + 8)[0], 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _read_moov(f):
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1 and len(header) == 16:
+            size, header_size = struct.unpack_from('>Q', header, 8)[0], 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            return None
+        if kind == b'moov':
+            if size > MAX_MOOV_BYTES:
+                return None
+            return f.read(size - header_size) if header_size == 16 else header[8:] + f.read(size - 16)
+        pos += size
+    return None
+
+
+def _collect(data, start, end, tables):
+    for kind, payload, payload_end in _boxes(data, start, end):
+        if kind in _CONTAINER_BOXES:
+            _collect(data, payload, payload_end, tables)
+        elif kind == b'hdlr':
+            # version and flags, pre_defined, then the handler type
+            tables[kind] = data[payload + 8:payload + 12]
+        elif kind in _SAMPLE_TABLES:
+            tables[kind] = data[payload:payload_end]
+
+
+def _sync_sample_offsets(tables):
+    def table(box, offset, count, dtype='>u4'):
+        return np.frombuffer(box, dtype, count, offset).astype(np.int64)
+
+    stsz = tables[b'stsz']
+    sample_size, count = struct.unpack_from('>II', stsz, 4)
+    sizes = np.full(count, sample_size, np.int64) if sample_size else table(stsz, 12, count)
+    if b'co64' in tables:
+        chunks = table(tables[b'co64'], 8, struct.unpack_from('>I', tables[b'co64'], 4)[0], '>u8')
+    else:
+        chunks = table(tables[b'stco'], 8, struct.unpack_from('>I', tables[b'stco'], 4)[0])
+    stsc = tables[b'stsc']
+    runs = table(stsc, 8, 3 * struct.unpack_from('>I', stsc, 4)[0]).reshape(-1, 3)
+    # Samples in every chunk, from runs of (first chunk, samples per chunk, description)
+    per_chunk = np.repeat(runs[:, 1], np.diff(np.append(runs[:, 0] - 1, len(chunks))))
+    chunk_of_sample = np.repeat(np.arange(len(chunks)), per_chunk)[:count]
+    first_in_chunk = np.cumsum(per_chunk) - per_chunk
+    ends = np.concatenate(([0], np.cumsum(sizes)))
+    if b'stss' in tables:
+        stss = tables[b'stss']
+        sync = table(stss, 8, struct.unpack_from('>I', stss, 4)[0]) - 1
+        sync = sync[sync < len(chunk_of_sample)]
+    else:
+        # Every sample is a sync sample
+        sync = np.arange(len(chunk_of_sample))
+    chunk = chunk_of_sample[sync]
+    return (chunks[chunk] + ends[sync] - ends[first_in_chunk[chunk]]).tolist()
+
+
+def keyframe_offsets(path):
+    """Byte offsets of the video keyframes of an MP4/MOV file in decode order, or None"""
+    try:
+        with open(path, 'rb') as f:
+            moov = _read_moov(f)
+        if moov is None:
+            return None
+        for kind, start, end in _boxes(moov, 0, len(moov)):
+            if kind == b'trak':
+                tables = {}
+                _collect(moov, start, end, tables)
+                if tables.get(b'hdlr') == b'vide' and {b'stsz', b'stsc'} <= set(tables):
+                    return _sync_sample_offsets(tables)
+    except (OSError, KeyError, ValueError, struct.error):
+        pass
+    return None
+
+
+def looks_like_video(path):
+    """Whether a file starts like a common video container (cheap check before indexing)"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(189)
+    except OSError:
+        return False
+    if any(head[offset:offset + len(magic)] == magic for offset, magic in _SIGNATURES):
+        return True
+    # MPEG-TS: a sync byte every 188 bytes
+    return len(head) == 189 and head[0] == head[188] == 0x47
+
+
+def nearest_keyframe(info, time):
+    """The last keyframe ``[pts, dts, offset]`` at or before ``time`` (the first one if none)"""
+    keyframes = info["keyframes"]
+    if not keyframes:
+        return None
+    index = bisect.bisect_right(keyframes, [time + trim_engine.KEYFRAME_TOLERANCE, math.inf])
+    return keyframes[max(index - 1, 0)]
+
+
+class VideoIndex:
+    """Stored keyframe tables and thumbnail sprite sheets per upload"""
+
+    def __init__(self, store):
+        self.store = store
+        self._results = DerivedResults(store)
+
+    def keyframes(self, sha256):
+        """Probe result of an upload with ``keyframes`` as ``[pts, dts, byte offset or None]``"""
+        return self._results.get(sha256, KEYFRAMES_SUFFIX, self._index_keyframes)
+
+    def probe(self, sha256):
+        """The stored keyframe table in the form of ``trim_engine.probe``"""
+        info = dict(self.keyframes(sha256))
+        info["keyframes"] = [(pts, dts) for pts, dts, _ in info["keyframes"]]
+        return info
+
+    def thumbnails(self, sha256, cancelled=None):
+        """Sprite sheet manifest: tile size, grid, sheet count and ``{time, sheet, x, y}`` per thumbnail"""
+        return self._results.get(sha256, SPRITES_SUFFIX, lambda record: self._render(sha256, record, cancelled))
+
+    def is_indexed(self, sha256):
+        return os.path.exists(self.store.derived_path(sha256, SPRITES_SUFFIX))
+
+    def sheet_path(self, sha256, number):
+        return self.store.derived_path(sha256, f"sprite-{int(number)}.jpg")
+
+    def _index_keyframes(self, record):
+        source_path = self.store.blob_path(record)
+        with profiling.span('index_keyframes'):
+            info = trim_engine.probe(source_path)
+            offsets = keyframe_offsets(source_path)
+        keyframes = sorted(info["keyframes"], key=lambda keyframe: keyframe[1])
+        if offsets is None or len(offsets) != len(keyframes):
+            # Not an MP4/MOV file, or its sample table disagrees with the demuxer
+            offsets = [None] * len(keyframes)
+        info = dict(info, keyframes=sorted([pts, dts, offset] for (pts, dts), offset in zip(keyframes, offsets)))
+        info["byte_offsets"] = offsets[:1] != [None]
+        return info
+
+    def _render(self, sha256, record, cancelled):
+        info = self.keyframes(sha256)
+        width, height = info["width"], info["height"]
+        if not width:
+            raise ValueError("Source has no video stream")
+        duration = info["duration"] or (info["keyframes"][-1][0] if info["keyframes"] else 0.0)
+        interval = max(MIN_INTERVAL, duration / MAX_THUMBNAILS)
+        tile_height = max(2, round(TILE_WIDTH * height / width / 2) * 2)
+
+        # Keyframes decode on their own; decode everything only if they are too sparse
+        selected, last = 0, -math.inf
+        for pts, _, _ in info["keyframes"]:
+            if pts - last >= interval:
+                selected, last = selected + 1, pts
+        keyframes_only = selected * 2 >= duration / interval
+
+        prefix = self.store.derived_path(sha256, f"sprite-{uuid.uuid4().hex}")
+        cmd = [trim_engine.ffmpeg_binary(), '-hide_banner', '-nostdin', '-loglevel', 'info', '-nostats', '-y',
+               '-progress', 'pipe:1']
+        if keyframes_only:
+            cmd += ['-skip_frame', 'nokey']
+        cmd += ['-i', self.store.blob_path(record), '-map', '0:v:0',
+                '-vf', f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})',showinfo,"
+                       f"scale={TILE_WIDTH}:{tile_height},tile={COLUMNS}x{ROWS}",
+                '-fps_mode', 'passthrough', '-q:v', str(JPEG_QUALITY), '-start_number', '0', f"{prefix}-%d.jpg"]
+        try:
+            with profiling.span('render_thumbnails', keyframes_only=keyframes_only):
+                times = self._run(cmd, cancelled)
+            sheets = math.ceil(len(times) / (COLUMNS * ROWS))
+            for number in range(sheets):
+                os.replace(f"{prefix}-{number}.jpg", self.sheet_path(sha256, number))
+        finally:
+            for path in glob.glob(f"{glob.escape(prefix)}-*.jpg"):
+                os.remove(path)
+        print(f"🖼️  Indexed {record['filename']}: {len(info['keyframes'])} keyframes, "
+              f"{len(times)} thumbnails on {sheets} sheets")
+        per_sheet = COLUMNS * ROWS
+        return {
+            "interval": round(interval, 3),
+            "tile_width": TILE_WIDTH,
+            "tile_height": tile_height,
+            "columns": COLUMNS,
+            "rows": ROWS,
+            "sheets": sheets,
+            "thumbnails": [{"time": round(time, 3), "sheet": i // per_sheet,
+                            "x": i % per_sheet % COLUMNS * TILE_WIDTH, "y": i % per_sheet // COLUMNS * tile_height}
+                           for i, time in enumerate(times)],
+        }
+
+    def _run(self, cmd, cancelled):
+        # Run ffmpeg; returns the times of the selected frames (from showinfo)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        times, errors = [], []
+
+        def read_stderr():
+            for line in process.stderr:
+                match = _PTS_TIME.search(line) if 'showinfo' in line else None
+                if match:
+                    times.append(float(match.group(1)))
+                else:
+                    errors.append(line)
+
+        reader = threading.Thread(target=read_stderr, daemon=True)
+        reader.start()
+        try:
+            # -progress writes a block every half second; a cancelled job stops ffmpeg here
+            for _ in process.stdout:
+                if cancelled:
+                    cancelled()
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            reader.join()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {''.join(errors[-5:]).strip()[-500:]}")
+        return times
+
+    def stats(self):
+        return {"computed": self._results.computed, "reused": self._results.reused}